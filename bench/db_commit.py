@@ -0,0 +1,91 @@
+# bench/db_commit.py
+#
+# 量 db_server 在不同持久化策略 (--durability) 下的寫入吞吐量
+# - 每個組合各啟動一個 db_server (暫存資料檔、獨立 port)，再開 N 條連線同時送 create
+# - 模擬房間結束時一次替每個玩家寫遊玩紀錄這種突發寫入
+#
+#   python bench/db_commit.py --clients 16 --writes 200
+#   python bench/db_commit.py --engines sqlite --modes sync group
+
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from common.protocol import send_frame, recv_frame
+
+BENCH_PORT = 9990
+
+
+def start_server(engine: str, mode: str, path: str, port: int) -> subprocess.Popen:
+    proc = subprocess.Popen([sys.executable, str(ROOT / "server" / "db_server.py"), "--port", str(port),
+                             "--engine", engine, "--path", path, "--durability", mode],
+                            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("db_server did not start")
+
+
+def run_clients(port: int, clients: int, writes: int) -> float:
+    """回傳每秒完成 (收到回覆) 的寫入數。"""
+    errors = []
+
+    def client(cid: int) -> None:
+        with socket.create_connection(("127.0.0.1", port)) as s:
+            for i in range(writes):
+                send_frame(s, {"action": "create", "collection": "player_games",
+                               "record": {"player": f"bench{cid}", "game_id": str(i), "version": "1", "has_played": True}})
+                resp = recv_frame(s)
+                if not resp or resp.get("status") != "ok": errors.append(resp)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - t0
+    if errors: raise RuntimeError(f"{len(errors)} writes failed: {errors[0]}")
+    return clients * writes / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engines", nargs="+", default=["json", "sqlite"])
+    parser.add_argument("--modes", nargs="+", default=["sync", "group", "async"])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--writes", type=int, default=100, help="每條連線寫入幾筆")
+    parser.add_argument("--port", type=int, default=BENCH_PORT)
+    args = parser.parse_args()
+
+    print(f"{args.clients} clients x {args.writes} creates")
+    print(f"{'engine':<7} | {'durability':<10} | {'writes/s':>9}")
+    print("-" * 33)
+    for engine in args.engines:
+        for mode in args.modes:
+            work = tempfile.mkdtemp(prefix="dbcommit-")
+            proc = start_server(engine, mode, os.path.join(work, "db." + ("json" if engine == "json" else "sqlite3")), args.port)
+            try:
+                rate = run_clients(args.port, args.clients, args.writes)
+            finally:
+                proc.terminate()
+                proc.wait()
+                shutil.rmtree(work, ignore_errors=True)
+            print(f"{engine:<7} | {mode:<10} | {rate:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
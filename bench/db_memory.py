@@ -0,0 +1,63 @@
+# bench/db_memory.py
+#
+# 量 SimpleDB 每筆紀錄佔用的記憶體：一筆一個 dict (json.load 的結果) vs Collection (欄位表 + tuple + intern 字串)
+# - 以 tracemalloc 計算 Python 物件實際配置的位元組，不受 allocator 是否把記憶體還給 OS 影響
+# - 資料仿照 player_games / ratings 的形狀
+#
+#   python bench/db_memory.py --records 100000
+
+import argparse
+import gc
+import json
+import sys
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from server.db_server import Collection
+
+
+def make_json(col: str, n: int) -> str:
+    """回傳該 collection 的 JSON 字串 (與 db_data.json 裡的格式相同)。"""
+    players, games = max(1, n // 10), max(1, n // 1000)
+    if col == "player_games":
+        recs = {str(i): {"player": f"player{i % players}", "game_id": str(i % games + 1), "version": f"1.{i % 3}",
+                         "has_played": bool(i % 2), "id": str(i)} for i in range(1, n + 1)}
+    else:
+        recs = {str(i): {"game_id": str(i % games + 1), "player": f"player{i % players}", "score": i % 5 + 1,
+                         "comment": "" if i % 4 else "nice game", "created": 1700000000 + i, "id": str(i)}
+                for i in range(1, n + 1)}
+    return json.dumps(recs, ensure_ascii=False)
+
+
+def measure(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del obj
+    return size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=100_000)
+    args = parser.parse_args()
+    n = args.records
+
+    print(f"{'collection':<13} | {'records':>8} | {'dict B/rec':>10} | {'compact B/rec':>13} | {'saved':>6}")
+    print("-" * 62)
+    for col in ("player_games", "ratings"):
+        raw = make_json(col, n)
+        as_dicts = measure(lambda: json.loads(raw))
+        compact = measure(lambda: Collection(json.loads(raw)))
+        print(f"{col:<13} | {n:>8} | {as_dicts / n:>10.1f} | {compact / n:>13.1f} | {1 - compact / as_dicts:>6.0%}")
+
+
+if __name__ == "__main__":
+    main()
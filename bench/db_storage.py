@@ -0,0 +1,116 @@
+# bench/db_storage.py
+#
+# 比較 db_server 兩種儲存引擎的啟動時間與常駐記憶體
+# - 產生 N 筆紀錄的 db_data.json (players / player_games / ratings 各約 1/3)，再用 db_migrate 轉成 SQLite
+# - 每個引擎在獨立子行程中開啟資料檔：量「開啟耗時」、「開啟後的 RSS 與增加量」與一次依 username 查詢的耗時
+#
+#   python bench/db_storage.py                       # 10k / 100k / 1M
+#   python bench/db_storage.py --sizes 10000 100000 --keep /tmp/dbbench
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from server.db_migrate import migrate
+
+# 子行程：只 import db_server、開資料檔、查一筆，最後輸出一行 JSON
+PROBE = r"""
+import contextlib, io, json, resource, sys, time
+def rss_kb():
+    # 目前常駐記憶體；ru_maxrss 在 Linux 會從父行程 (exec 前) 繼承，不適合拿來比較
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+    except (OSError, StopIteration):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+sys.path.insert(0, sys.argv[3])
+from server import db_server
+rss0 = rss_kb()
+t0 = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    db = db_server.open_db(sys.argv[1], sys.argv[2])
+t1 = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    hit = db.query("players", {"username": sys.argv[4]}, limit=1)
+t2 = time.perf_counter()
+rss1 = rss_kb()
+print(json.dumps({"open_s": t1 - t0, "lookup_ms": (t2 - t1) * 1000, "rss_mb": rss1 / 1024,
+                  "rss_delta_mb": (rss1 - rss0) / 1024, "found": bool(hit)}))
+"""
+
+
+def make_json(path: str, n: int) -> str:
+    """產生與 SimpleDB.save 相同格式 (indent=2) 的資料檔，回傳一個存在的 username。"""
+    players = n // 3
+    games = max(1, n // 1000)
+    data = {"_counters": {}, "players": {}, "player_games": {}, "ratings": {}, "games": {}}
+    for i in range(1, games + 1):
+        data["games"][str(i)] = {"name": f"game{i}", "owner": "dev", "version": "1", "max_players": 2 + i % 3,
+                                 "description": "benchmark game", "game_type": "GUI", "deleted": False, "id": str(i)}
+    for i in range(1, players + 1):
+        data["players"][str(i)] = {"username": f"player{i}", "password": "pw", "id": str(i)}
+    for i in range(1, players + 1):
+        data["player_games"][str(i)] = {"player": f"player{i}", "game_id": str(i % games + 1), "version": "1",
+                                        "has_played": bool(i % 2), "id": str(i)}
+    for i in range(1, n - 2 * players - games + 1):
+        data["ratings"][str(i)] = {"game_id": str(i % games + 1), "player": f"player{i % players + 1}",
+                                   "score": i % 5 + 1, "comment": "", "created": 1700000000 + i, "id": str(i)}
+    for col, recs in data.items():
+        if col != "_counters": data["_counters"][col] = len(recs)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return f"player{players // 2 or 1}"
+
+
+def probe(engine: str, path: str, user: str) -> dict:
+    out = subprocess.run([sys.executable, "-c", PROBE, engine, path, str(ROOT), user],
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--keep", default=None, help="把產生的資料檔留在這個目錄")
+    args = parser.parse_args()
+
+    work = args.keep or tempfile.mkdtemp(prefix="dbbench-")
+    os.makedirs(work, exist_ok=True)
+    print(f"{'records':>9} | {'engine':<6} | {'file MB':>8} | {'open s':>7} | {'lookup ms':>9} | {'RSS MB':>11} | {'+RSS MB':>8}")
+    print("-" * 78)
+    try:
+        for n in args.sizes:
+            src = os.path.join(work, f"db_{n}.json")
+            dst = os.path.join(work, f"db_{n}.sqlite3")
+            for p in (dst, dst + "-wal", dst + "-shm"):
+                if os.path.exists(p): os.remove(p)
+            user = make_json(src, n)
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                migrate(src, dst)
+            migrate_s = time.perf_counter() - t0
+            for engine, path in (("json", src), ("sqlite", dst)):
+                r = probe(engine, path, user)
+                assert r["found"], f"{engine}: lookup failed"
+                size = os.path.getsize(path) / 2**20
+                print(f"{n:>9} | {engine:<6} | {size:>8.1f} | {r['open_s']:>7.3f} | {r['lookup_ms']:>9.3f} | "
+                      f"{r['rss_mb']:>11.1f} | {r['rss_delta_mb']:>8.1f}")
+            print(f"{'':>9} | (migration {migrate_s:.1f}s)")
+    finally:
+        if not args.keep: shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
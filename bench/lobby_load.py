@@ -0,0 +1,487 @@
+# bench/lobby_load.py
+#
+# 整套系統的負載測試：啟動 db_server + main_server (暫存資料檔與上傳目錄、獨立 port、不錄 replay)，
+# 用真正的協定模擬大量 client
+# - lobby 階段：每個模擬玩家 register → login → 列遊戲 → 看詳情 → 下載 → 登記版本 → 列房間，
+#   同時最多 --concurrency 個玩家在跑
+# - games 階段：gomoku 兩人一房 (create / join)，連上 game port 後輪流下子，量對手收到一步棋的延遲；
+#   chase 三人一房，每人以 --hz 送位置更新 --game-seconds 秒，量其他人收到的延遲；結束後每人評分一次
+# - 報告各 action 的吞吐量與 p50 / p99 / p999 / max，遊戲訊息的延遲，以及各階段 db / lobby / session worker
+#   與壓測程式本身的 CPU 時間、伺服器行程的記憶體高峰 (讀 /proc，非 Linux 時省略)
+# - --out 存成 JSON (含 git commit 與參數)，--compare 與之前存的結果逐項比較，用來抓退步
+# - game port 固定是 20000~20099 (main_server 的 GAME_PORT_RANGE)，測試時不要同時開著正式的 Lobby
+#
+#   python bench/lobby_load.py --players 200 --concurrency 50
+#   python bench/lobby_load.py --gomoku-rooms 20 --chase-rooms 10 --hz 60 --out after.json --compare before.json
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from common.protocol import send_frame, recv_frame, recv_exact, send_file
+from server.metrics import Histogram
+
+LOBBY_PORT = 9890
+DB_PORT = 9990
+PASSWORD = "bench-pw"
+GAMES = {"gomoku": (ROOT / "games" / "gomoku" / "main.py", 2), "chase": (ROOT / "games" / "chase_gui" / "main.py", 3)}
+GAME_TIMEOUT = 30.0  # 遊戲連線上多久沒收到東西就算失敗
+SAMPLE_INTERVAL = 0.25
+
+
+# --- 統計 ---
+class Recorder:
+    """name -> 延遲 histogram 與失敗次數。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hists: Dict[str, Histogram] = {}
+        self.errors: Dict[str, int] = {}
+        self.first_error: Dict[str, Any] = {}
+
+    def observe(self, name: str, seconds: float) -> None:
+        h = self.hists.get(name)
+        if h is None:
+            with self.lock: h = self.hists.setdefault(name, Histogram())
+        h.record(seconds)
+
+    def error(self, name: str, detail: Any) -> None:
+        with self.lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            self.first_error.setdefault(name, detail)
+
+    def summary(self, elapsed: float) -> Dict[str, Dict[str, Any]]:
+        out = {}
+        for name in sorted(set(self.hists) | set(self.errors)):
+            h = self.hists.get(name) or Histogram()
+            p50, p99, p999 = h.quantiles()
+            out[name] = {"count": h.count, "errors": self.errors.get(name, 0), "rate": h.count / elapsed if elapsed else 0.0,
+                         "mean_ms": h.sum_us / h.count / 1000 if h.count else 0.0, "p50_ms": p50 * 1000,
+                         "p99_ms": p99 * 1000, "p999_ms": p999 * 1000, "max_ms": h.max_us / 1000}
+        return out
+
+
+class ProcSampler:
+    """
+    定期讀 /proc：各行程 (含 main_server 開的 session worker) 的累計 CPU 秒數與 RSS。
+    已結束的 worker 保留最後一次讀到的 CPU 時間，階段之間相減就是該階段用掉的 CPU。
+    """
+
+    def __init__(self, roles: Dict[str, int]):
+        self.roles = roles  # role -> 根行程 pid；根行程的子孫算在 "<role>_children"
+        self.cpu: Dict[int, Tuple[str, float]] = {}
+        self.peak_rss: Dict[str, int] = {}
+        self.tick = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self.enabled = os.path.exists("/proc/self/stat")
+        self.running = True
+        if self.enabled:
+            self.sample()
+            threading.Thread(target=self._loop, daemon=True).start()
+
+    @staticmethod
+    def _children(pid: int) -> List[int]:
+        out: List[int] = []
+        try:
+            for tid in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{tid}/children") as f:
+                    out += [int(p) for p in f.read().split()]
+        except OSError:
+            pass
+        return out
+
+    def _read(self, pid: int) -> Optional[Tuple[float, int]]:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{pid}/status") as f:
+                rss = next((int(line.split()[1]) for line in f if line.startswith("VmRSS:")), 0)
+        except (OSError, IndexError, ValueError):
+            return None
+        return (int(fields[11]) + int(fields[12])) / self.tick, rss  # utime + stime
+
+    def sample(self) -> None:
+        for role, root in self.roles.items():
+            rss_by_role: Dict[str, int] = {}
+            stack = [(root, role)]
+            while stack:
+                pid, r = stack.pop()
+                got = self._read(pid)
+                if got is None: continue
+                self.cpu[pid] = (r, got[0])
+                rss_by_role[r] = rss_by_role.get(r, 0) + got[1]
+                stack += [(c, f"{role}_children") for c in self._children(pid)]
+            for r, rss in rss_by_role.items():
+                self.peak_rss[r] = max(self.peak_rss.get(r, 0), rss)
+
+    def _loop(self) -> None:
+        while self.running:
+            time.sleep(SAMPLE_INTERVAL)
+            self.sample()
+
+    def snapshot(self) -> Dict[str, float]:
+        """各 role 到目前為止的累計 CPU 秒數 (含壓測程式本身的 "bench")。"""
+        if self.enabled: self.sample()
+        out: Dict[str, float] = {"bench": time.process_time()}
+        for r, sec in list(self.cpu.values()): out[r] = out.get(r, 0.0) + sec
+        return out
+
+
+def _cpu_delta(before: Dict[str, float], after: Dict[str, float], elapsed: float) -> Dict[str, Dict[str, float]]:
+    return {r: {"cpu_s": round(after[r] - before.get(r, 0.0), 3),
+                "cpu_pct": round((after[r] - before.get(r, 0.0)) / elapsed * 100, 1) if elapsed else 0.0}
+            for r in sorted(after)}
+
+
+# --- 伺服器 ---
+def _wait_port(port: int, proc: subprocess.Popen, what: str) -> None:
+    for _ in range(200):
+        if proc.poll() is not None: break
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"{what} did not start")
+
+
+def start_servers(work: str, lobby_port: int, db_port: int) -> Tuple[subprocess.Popen, subprocess.Popen]:
+    py = sys.executable
+    db = subprocess.Popen([py, str(ROOT / "server" / "db_server.py"), "--port", str(db_port),
+                           "--path", os.path.join(work, "db.json"), "--log-file", os.path.join(work, "db.log")],
+                          cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _wait_port(db_port, db, "db_server")
+    lobby = subprocess.Popen([py, str(ROOT / "server" / "main_server.py"), "--port", str(lobby_port),
+                              "--db", f"127.0.0.1:{db_port}", "--storage-dir", os.path.join(work, "storage"),
+                              "--no-replays", "--log-file", os.path.join(work, "lobby.log")],
+                             cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_port(lobby_port, lobby, "main_server")
+    except RuntimeError:
+        db.terminate()
+        raise
+    return db, lobby
+
+
+# --- client ---
+class LobbyClient:
+    """一條 lobby 連線；每個 request 的來回時間記到 rec[action]，失敗也記下來。"""
+
+    def __init__(self, port: int, rec: Recorder):
+        self.rec = rec
+        t0 = time.perf_counter()
+        self.sock = socket.create_connection(("127.0.0.1", port), timeout=GAME_TIMEOUT)
+        rec.observe("connect", time.perf_counter() - t0)
+
+    def req(self, action: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        send_frame(self.sock, {"action": action, "data": data or {}})
+        resp = recv_frame(self.sock) or {"status": "error", "error": "closed"}
+        if action == "player_download_req" and resp.get("status") == "ok":
+            if recv_exact(self.sock, int(resp["file_size"])) is None: resp = {"status": "error", "error": "short file"}
+        if resp.get("status") == "ok": self.rec.observe(action, time.perf_counter() - t0)
+        else: self.rec.error(action, resp.get("error"))
+        return resp
+
+    def close(self) -> None:
+        try: self.sock.close()
+        except OSError: pass
+
+
+def setup_games(port: int) -> Dict[str, str]:
+    """開發者帳號上架 gomoku / chase，回傳 遊戲 -> game_id。"""
+    dev = LobbyClient(port, Recorder())
+    dev.req("register", {"user_type": "developer", "username": "benchdev", "password": PASSWORD})
+    if dev.req("login", {"user_type": "developer", "username": "benchdev", "password": PASSWORD}).get("status") != "ok":
+        raise RuntimeError("developer login failed")
+    ids = {}
+    for name, (path, max_players) in GAMES.items():
+        g = dev.req("dev_create_game", {"name": f"bench-{name}", "version": "1", "max_players": max_players,
+                                        "game_type": "GUI"})["result"]
+        send_frame(dev.sock, {"action": "dev_upload_init", "data": {"game_id": g["id"], "file_size": path.stat().st_size,
+                                                                    "filename": "main.py"}})
+        if (recv_frame(dev.sock) or {}).get("status") != "ready_to_recv": raise RuntimeError("upload refused")
+        send_file(dev.sock, str(path))
+        if (recv_frame(dev.sock) or {}).get("status") != "ok": raise RuntimeError("upload failed")
+        ids[name] = str(g["id"])
+    dev.close()
+    return ids
+
+
+def lobby_player(port: int, i: int, game_ids: Dict[str, str], rec: Recorder) -> Optional[LobbyClient]:
+    try:
+        c = LobbyClient(port, rec)
+    except OSError as e:
+        rec.error("connect", str(e))
+        return None
+    try:
+        user = {"user_type": "player", "username": f"bench{i}", "password": PASSWORD}
+        c.req("register", user)
+        if c.req("login", user).get("status") != "ok": return c
+        c.req("player_list_games", {"limit": 50})
+        for gid in game_ids.values():
+            c.req("player_game_detail", {"game_id": gid})
+            c.req("player_download_req", {"game_id": gid})
+            c.req("player_download_game_update_db", {"game_id": gid})
+        c.req("player_list_rooms")
+    except OSError as e:
+        rec.error("lobby", str(e))
+    return c
+
+
+def run_lobby(port: int, players: int, concurrency: int, game_ids: Dict[str, str], keep: int,
+              rec: Recorder) -> List[LobbyClient]:
+    """跑完所有玩家的 lobby 流程；前 keep 個玩家的連線留給 games 階段，其餘關閉。"""
+    slots = threading.BoundedSemaphore(concurrency)
+    kept: List[Optional[LobbyClient]] = [None] * keep
+
+    def one(i: int) -> None:
+        with slots:
+            c = lobby_player(port, i, game_ids, rec)
+        if c is None: return
+        if i < keep: kept[i] = c
+        else: c.close()
+
+    threads = [threading.Thread(target=one, args=(i,), daemon=True) for i in range(players)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return [c for c in kept if c is not None]
+
+
+# --- games ---
+def _game_recv(sock: socket.socket, want: str) -> Optional[Dict[str, Any]]:
+    """讀到 type == want 的 frame 為止 (略過 ping / init 等)；斷線或 room closed 回傳 None。"""
+    while True:
+        msg = recv_frame(sock)
+        if msg is None or msg.get("type") == want: return msg
+        if msg.get("type") == "error": return None
+
+
+def _open_game(clients: List[LobbyClient], gid: str, rec: Recorder) -> Optional[List[socket.socket]]:
+    """第一個人開房、其餘加入，依序連上 game port，等到 gamestart。"""
+    r = clients[0].req("player_create_room", {"game_id": gid})
+    if r.get("status") != "ok": return None
+    room = r["result"]
+    for c in clients[1:]:
+        if c.req("player_join_room", {"room_id": room["id"]}).get("status") != "ok": return None
+    socks = []
+    for _ in clients:
+        s = socket.create_connection(("127.0.0.1", room["game_port"]), timeout=GAME_TIMEOUT)
+        if _game_recv(s, "init") is None: return None
+        socks.append(s)
+    t0 = time.perf_counter()
+    for s in socks:
+        if _game_recv(s, "gamestart") is None: return None
+    rec.observe("game_start_wait", time.perf_counter() - t0)
+    return socks
+
+
+def _close_game(socks: List[socket.socket]) -> None:
+    try: send_frame(socks[0], {"type": "leave"})
+    except OSError: pass
+    for s in socks:
+        try: s.close()
+        except OSError: pass
+
+
+def gomoku_room(clients: List[LobbyClient], gid: str, moves: int, rec: Recorder) -> None:
+    """兩人輪流下子：一方送出到另一方收到的時間記在 gomoku_move。"""
+    socks = _open_game(clients, gid, rec)
+    if socks is None: return rec.error("gomoku_room", "open failed")
+    try:
+        for m in range(moves):
+            src, dst = socks[m % 2], socks[1 - m % 2]
+            send_frame(src, {"type": "move", "row": m // 15 % 15, "col": m % 15, "color": ("black", "white")[m % 2],
+                             "t": time.perf_counter()})
+            msg = _game_recv(dst, "move")
+            if msg is None: return rec.error("gomoku_move", "lost")
+            rec.observe("gomoku_move", time.perf_counter() - msg["t"])
+    except OSError as e:
+        rec.error("gomoku_move", str(e))
+    finally:
+        _close_game(socks)
+
+
+def chase_room(clients: List[LobbyClient], gid: str, hz: float, seconds: float, rec: Recorder) -> None:
+    """每人以 hz 送位置；其他人收到的延遲記在 chase_update。"""
+    socks = _open_game(clients, gid, rec)
+    if socks is None: return rec.error("chase_room", "open failed")
+    done = threading.Event()
+
+    def sender(idx: int, s: socket.socket) -> None:
+        nxt = time.perf_counter() + idx / hz / len(socks)  # 錯開各玩家的送出時間
+        while not done.is_set():
+            now = time.perf_counter()
+            if now < nxt: time.sleep(nxt - now)
+            try:
+                send_frame(s, {"type": "update", "role": f"P{idx + 1}", "x": idx * 10, "y": int(now) % 500,
+                               "t": time.perf_counter()})
+            except OSError:
+                return
+            nxt += 1.0 / hz
+
+    def reader(s: socket.socket) -> None:
+        while True:
+            try:
+                msg = _game_recv(s, "update")
+            except OSError:
+                msg = None
+            if msg is None: return
+            rec.observe("chase_update", time.perf_counter() - msg["t"])
+
+    threads = [threading.Thread(target=sender, args=(i, s), daemon=True) for i, s in enumerate(socks)]
+    readers = [threading.Thread(target=reader, args=(s,), daemon=True) for s in socks]
+    for t in threads + readers: t.start()
+    time.sleep(seconds)
+    done.set()
+    for t in threads: t.join()
+    time.sleep(0.2)  # 讓最後一批更新送達
+    _close_game(socks)
+    for t in readers: t.join(GAME_TIMEOUT)
+
+
+def run_games(clients: List[LobbyClient], game_ids: Dict[str, str], args: argparse.Namespace, rec: Recorder) -> None:
+    for c in clients: c.rec = rec  # 開房 / 加入 / 評分算在 games 階段
+    rooms: List[Tuple[List[LobbyClient], str]] = []
+    threads, i = [], 0
+    for _ in range(args.gomoku_rooms):
+        rooms.append((clients[i:i + 2], game_ids["gomoku"]))
+        threads.append(threading.Thread(target=gomoku_room, args=(clients[i:i + 2], game_ids["gomoku"], args.moves, rec)))
+        i += 2
+    for _ in range(args.chase_rooms):
+        rooms.append((clients[i:i + 3], game_ids["chase"]))
+        threads.append(threading.Thread(target=chase_room, args=(clients[i:i + 3], game_ids["chase"], args.hz,
+                                                                  args.game_seconds, rec)))
+        i += 3
+    for t in threads: t.start()
+    for t in threads: t.join()
+    # 開局時 Lobby 已在背景把玩家標記為已遊玩，這時才能評分
+    for n, (members, gid) in enumerate(rooms):
+        for c in members: c.req("player_rate_game", {"game_id": gid, "score": 1 + n % 5, "comment": "bench"})
+
+
+# --- 報告 ---
+def _git_commit() -> Dict[str, Any]:
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return {"commit": None, "dirty": None}
+    return {"commit": sha or None, "dirty": bool(dirty)}
+
+
+def print_phase(name: str, phase: Dict[str, Any]) -> None:
+    print(f"\n[{name}] {phase['elapsed_s']:.1f}s")
+    print(f"  {'action':<32} {'count':>7} {'err':>5} {'per s':>8} {'p50 ms':>8} {'p99 ms':>8} {'p999 ms':>8} {'max ms':>8}")
+    for action, s in phase["actions"].items():
+        print(f"  {action:<32} {s['count']:>7} {s['errors']:>5} {s['rate']:>8.1f} {s['p50_ms']:>8.2f} "
+              f"{s['p99_ms']:>8.2f} {s['p999_ms']:>8.2f} {s['max_ms']:>8.2f}")
+    cpu = "  ".join(f"{r} {c['cpu_s']:.2f}s ({c['cpu_pct']:.0f}%)" for r, c in phase["cpu"].items())
+    print(f"  cpu: {cpu}")
+
+
+def compare(base: Dict[str, Any], cur: Dict[str, Any]) -> None:
+    """逐項比較每秒次數與 p99 (變化超過 10% 標出來)。"""
+    print(f"\n[compare] {base.get('commit')} -> {cur.get('commit')}")
+    for phase in ("lobby", "games"):
+        for action, s in cur.get(phase, {}).get("actions", {}).items():
+            b = base.get(phase, {}).get("actions", {}).get(action)
+            if not b: continue
+            parts = []
+            for key, worse_if_up in (("rate", False), ("p99_ms", True)):
+                old, new = b[key], s[key]
+                pct = (new - old) / old * 100 if old else 0.0
+                flag = " !" if abs(pct) > 10 and (pct > 0) == worse_if_up else ""
+                parts.append(f"{key} {old:.2f} -> {new:.2f} ({pct:+.0f}%){flag}")
+            label = f"{phase}/{action}"
+            print(f"  {label:<40} " + "  ".join(parts))
+    for role, peak in cur.get("peak_rss_kb", {}).items():
+        old = base.get("peak_rss_kb", {}).get(role)
+        if old: print(f"  peak rss {role:<22} {old / 1024:.1f}MB -> {peak / 1024:.1f}MB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--players", type=int, default=200, help="模擬幾個玩家跑 lobby 流程")
+    parser.add_argument("--concurrency", type=int, default=50, help="同時在跑 lobby 流程的玩家數")
+    parser.add_argument("--gomoku-rooms", type=int, default=10)
+    parser.add_argument("--moves", type=int, default=60, help="每房 gomoku 下幾步")
+    parser.add_argument("--chase-rooms", type=int, default=5)
+    parser.add_argument("--hz", type=float, default=30.0, help="chase 每人每秒送幾次位置 (10~60)")
+    parser.add_argument("--game-seconds", type=float, default=10.0, help="chase 每房玩幾秒")
+    parser.add_argument("--lobby-port", type=int, default=LOBBY_PORT)
+    parser.add_argument("--db-port", type=int, default=DB_PORT)
+    parser.add_argument("--out", default=None, help="結果存成這個 JSON 檔")
+    parser.add_argument("--compare", default=None, metavar="JSON", help="與之前 --out 存的結果比較")
+    parser.add_argument("--keep", default=None, help="把資料檔與伺服器 log 留在這個目錄")
+    args = parser.parse_args()
+    need = 2 * args.gomoku_rooms + 3 * args.chase_rooms
+    if need > args.players: parser.error(f"{need} players needed for the rooms, only --players {args.players}")
+    if args.gomoku_rooms + args.chase_rooms > 90: parser.error("at most 90 rooms (main_server allows 100 at a time)")
+
+    work = args.keep or tempfile.mkdtemp(prefix="lobbyload-")
+    os.makedirs(work, exist_ok=True)
+    db, lobby = start_servers(work, args.lobby_port, args.db_port)
+    sampler = ProcSampler({"db": db.pid, "lobby": lobby.pid})
+    result: Dict[str, Any] = dict(_git_commit(), time=datetime.now().isoformat(timespec="seconds"),
+                                  python=platform.python_version(), cpus=os.cpu_count(), args=vars(args))
+    try:
+        game_ids = setup_games(args.lobby_port)
+        print(f"{args.players} players (concurrency {args.concurrency}), {args.gomoku_rooms} gomoku rooms x {args.moves} moves, "
+              f"{args.chase_rooms} chase rooms @ {args.hz:g}Hz x {args.game_seconds:g}s")
+
+        rec, cpu0, t0 = Recorder(), sampler.snapshot(), time.perf_counter()
+        clients = run_lobby(args.lobby_port, args.players, args.concurrency, game_ids, need, rec)
+        elapsed = time.perf_counter() - t0
+        total = sum(h.count for h in rec.hists.values())
+        result["lobby"] = {"elapsed_s": round(elapsed, 3), "requests_per_s": round(total / elapsed, 1),
+                           "actions": rec.summary(elapsed), "cpu": _cpu_delta(cpu0, sampler.snapshot(), elapsed)}
+        result["errors"] = {f"lobby/{k}": str(v) for k, v in rec.first_error.items()}
+        if len(clients) < need: raise RuntimeError(f"only {len(clients)} of {need} players made it through the lobby")
+
+        rec, cpu0, t0 = Recorder(), sampler.snapshot(), time.perf_counter()
+        run_games(clients, game_ids, args, rec)
+        elapsed = time.perf_counter() - t0
+        result["games"] = {"elapsed_s": round(elapsed, 3), "actions": rec.summary(elapsed),
+                           "cpu": _cpu_delta(cpu0, sampler.snapshot(), elapsed)}
+        for c in clients: c.close()
+        result["peak_rss_kb"] = dict(sampler.peak_rss)
+        result["errors"].update({f"games/{k}": str(v) for k, v in rec.first_error.items()})
+    finally:
+        sampler.running = False
+        for p in (lobby, db): p.terminate()
+        for p in (lobby, db): p.wait()
+        if not args.keep: shutil.rmtree(work, ignore_errors=True)
+
+    print_phase("lobby", result["lobby"])
+    print(f"  total {result['lobby']['requests_per_s']:.0f} requests/s")
+    print_phase("games", result["games"])
+    for k, v in result["errors"].items(): print(f"  first error {k}: {v}")
+    if result["peak_rss_kb"]:
+        print("  peak rss: " + "  ".join(f"{r} {kb / 1024:.1f}MB" for r, kb in sorted(result["peak_rss_kb"].items())))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nsaved to {args.out}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), result)
+
+
+if __name__ == "__main__":
+    main()
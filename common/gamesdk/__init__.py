@@ -0,0 +1,16 @@
+# common/gamesdk
+# 遊戲 client 共用 SDK。Lobby 下載遊戲時會把整個資料夾複製到遊戲旁邊，
+# 遊戲直接 `from gamesdk import GameConnection` 即可。
+# 修改 API 時請一併調高 __version__，Lobby 會據此覆蓋玩家端的舊版。
+
+from .connection import (  # noqa: F401
+    DISCONNECTED,
+    RECONNECTED,
+    Dispatcher,
+    FramedConnection,
+    GameConnection,
+    encode_frame,
+)
+from .replay import REPLAY_END, ReplayConnection, ReplayReader, ReplayWriter, open_connection  # noqa: F401
+
+__version__ = "1.3.0"
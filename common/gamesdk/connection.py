@@ -0,0 +1,256 @@
+# common/gamesdk/connection.py
+# 遊戲端共用網路層：緩衝讀取的 framed connection + 背景送出佇列 + 重連退避 + 訊息分派
+# 注意：此檔會被 Lobby 複製到玩家的下載目錄，只能依賴標準函式庫
+
+import json
+import queue
+import socket
+import struct
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+HEADER = struct.Struct("!I")  # 4 bytes big-endian 長度，與 common/protocol.py 相同
+RECV_CHUNK = 65536
+
+# SDK 自己產生的本地訊息 (不會出現在網路上)
+DISCONNECTED = "disconnected"
+RECONNECTED = "reconnected"
+
+Handler = Callable[[Dict[str, Any]], None]
+
+
+def encode_frame(obj: Dict[str, Any]) -> bytes:
+    data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+    return HEADER.pack(len(data)) + data
+
+
+class FramedConnection:
+    """
+    包裝一條已連線的 socket。
+    - recv(): 一次 recv 最多 64KB 進緩衝區，再從緩衝區切出完整 frame (處理黏包 / 斷包)
+    - send(): 只把編好的 bytes 丟進佇列，由背景執行緒合併後 sendall，呼叫端不會被網路卡住
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self._buf = bytearray()
+        self._send_q: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        self.closed = False
+        threading.Thread(target=self._writer, daemon=True).start()
+
+    def send(self, obj: Dict[str, Any]) -> None:
+        if not self.closed:
+            self._send_q.put(encode_frame(obj))
+
+    def recv(self) -> Optional[Dict[str, Any]]:
+        """回傳下一個 frame；斷線或格式錯誤回傳 None。"""
+        buf = self._buf
+        while True:
+            if len(buf) >= HEADER.size:
+                (length,) = HEADER.unpack_from(buf)
+                end = HEADER.size + length
+                if len(buf) >= end:
+                    body = bytes(buf[HEADER.size:end])
+                    del buf[:end]
+                    try:
+                        return json.loads(body.decode("utf-8")) if length else {}
+                    except (ValueError, UnicodeDecodeError):
+                        return None
+            try:
+                chunk = self.sock.recv(RECV_CHUNK)
+            except OSError:
+                return None
+            if not chunk:
+                return None
+            buf += chunk
+
+    def _writer(self) -> None:
+        while True:
+            data = self._send_q.get()
+            if data is None:
+                # close() 之前排隊的 frame 已送完，這時才真正關閉 socket
+                self._shutdown()
+                break
+            # 把已經排隊的 frame 一起送，減少 syscall
+            parts = [data]
+            while True:
+                try:
+                    nxt = self._send_q.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._send_q.put(None)
+                    break
+                parts.append(nxt)
+            try:
+                self.sock.sendall(b"".join(parts))
+            except OSError:
+                self._shutdown()
+                break
+
+    def _shutdown(self) -> None:
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)  # 叫醒卡在 recv 的接收執行緒
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def close(self) -> None:
+        """送完已排隊的 frame 後關閉。"""
+        if self.closed:
+            return
+        self.closed = True
+        self._send_q.put(None)
+
+
+class Dispatcher:
+    """依 msg["type"] 分派給註冊的 handler；沒有對應 handler 時交給 default。"""
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._default: Optional[Handler] = None
+
+    def on(self, type_: str, handler: Handler) -> None:
+        self._handlers.setdefault(type_, []).append(handler)
+
+    def on_default(self, handler: Handler) -> None:
+        self._default = handler
+
+    def dispatch(self, msg: Dict[str, Any]) -> None:
+        handlers = self._handlers.get(msg.get("type"))
+        if handlers:
+            for h in handlers:
+                h(msg)
+        elif self._default:
+            self._default(msg)
+
+
+class GameConnection(Dispatcher):
+    """
+    遊戲 client 的連線物件。
+
+        conn = GameConnection(host, port)
+        conn.on("move", on_move)
+        if conn.connect():
+            conn.start()              # 在接收執行緒直接分派
+            # 或 conn.start(post=...) # 交給 GUI 主迴圈 (例如 pygame.event.post)，再呼叫 conn.dispatch
+
+    Server 在等待階段送的 ping 會直接丟掉；斷線時會送出一個本地的 {"type": "disconnected"}。
+
+    斷線續玩：Server 在 init frame 給 token，之後每個 frame 帶 seq。
+    auto_reconnect=True 時若連線中斷，會以退避重連並送出 {"type": "resume", "token", "last_seq"}，
+    Server 補送錯過的 frame；重連成功時送出本地的 {"type": "reconnected"}。
+    重連期間 send() 的訊息會先保留，續玩成功後再送出。
+
+    觀戰時若跟不上，Server 會送 {"type": "reset"} 後重送完整 snapshot (init、gamestart、歷史事件)；
+    遊戲收到 reset 時要清空盤面，否則已套用過的事件會被套用第二次。
+
+    遊戲結束時呼叫 report_result(贏家 role list, 玩家名稱)：所有座位回報一致時 Lobby 會據此調整配對用的 rating。
+    """
+
+    def __init__(self, host: str, port: int, retries: int = 10, backoff: float = 0.2,
+                 max_backoff: float = 2.0, auto_reconnect: bool = False):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.auto_reconnect = auto_reconnect
+        self.conn: Optional[FramedConnection] = None
+        self.running = False
+        self._post: Optional[Handler] = None
+        self.token: Optional[str] = None
+        self.last_seq = 0
+        self._lock = threading.Lock()
+        self._held: List[Dict[str, Any]] = []  # 重連期間暫存的送出訊息
+        self._resuming = False
+
+    def connect(self) -> bool:
+        """連線，失敗時以指數退避重試；全部失敗回傳 False。"""
+        delay = self.backoff
+        for _ in range(self.retries):
+            try:
+                sock = socket.create_connection((self.host, self.port))
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.conn = FramedConnection(sock)
+                return True
+            except OSError:
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+        return False
+
+    def start(self, post: Optional[Handler] = None) -> None:
+        """啟動接收執行緒。post 為 None 時直接在該執行緒 dispatch。"""
+        self._post = post
+        self.running = True
+        threading.Thread(target=self._recv_loop, daemon=True).start()
+
+    def send(self, obj: Dict[str, Any]) -> None:
+        with self._lock:
+            if self._resuming:
+                self._held.append(obj)
+            elif self.conn:
+                self.conn.send(obj)
+
+    def report_result(self, winners: List[str], player: str) -> None:
+        """回報勝負 (winners 為空代表平手)；Server 不轉發給其他玩家。"""
+        self.send({"type": "result", "winners": list(winners), "player": player})
+
+    def close(self) -> None:
+        """主動離開：通知 Server 結束房間 (與斷線不同，不會進入重連等待)。"""
+        self.running = False
+        if self.conn:
+            self.conn.send({"type": "leave"})
+            self.conn.close()
+
+    def _resume(self) -> bool:
+        with self._lock:
+            self._resuming = True
+        if not self.connect():
+            return False
+        self.conn.send({"type": "resume", "token": self.token, "last_seq": self.last_seq})
+        reply = self.conn.recv()
+        if not reply or reply.get("type") != "resumed":
+            if reply:
+                self._deliver(reply)  # 例如 Room closed
+            self.conn.close()
+            return False
+        with self._lock:
+            self._resuming = False
+            for obj in self._held:
+                self.conn.send(obj)
+            self._held = []
+        return True
+
+    def _deliver(self, msg: Dict[str, Any]) -> None:
+        if self._post:
+            self._post(msg)
+        else:
+            self.dispatch(msg)
+
+    def _recv_loop(self) -> None:
+        while self.running:
+            msg = self.conn.recv() if self.conn else None
+            if msg is None:
+                if not self.running:
+                    break
+                self.conn.close()
+                if self.auto_reconnect and self.token and self._resume():
+                    self._deliver({"type": RECONNECTED})
+                    continue
+                self.running = False
+                self._deliver({"type": DISCONNECTED})
+                break
+            type_ = msg.get("type")
+            if type_ == "ping":
+                continue
+            if type_ == "init" and msg.get("token"):
+                self.token = msg["token"]
+            if "seq" in msg:
+                self.last_seq = msg["seq"]
+            self._deliver(msg)
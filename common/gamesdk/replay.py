@@ -0,0 +1,214 @@
+# common/gamesdk/replay.py
+# 對局重播：append-only、分塊壓縮的二進位紀錄檔
+#
+# 檔案格式:
+#   FILE_HEADER  = b"NPRP" + version(1 byte)
+#   之後是一連串 chunk，每個 chunk 可獨立解壓:
+#     CHUNK_HEADER = t_start(double) n_key(uint32) n_rec(uint32) comp_len(uint32)
+#     zlib(records)，前 n_key 筆是 keyframe (chunk 開始時重建盤面所需的 frame)
+#   record = t(float32, 相對開局秒數) + len(uint32) + JSON body
+#
+# chunk header 不壓縮，seek 時只需跳讀 header 找到目標 chunk，
+# 套用它的 keyframe 後即可從該點開始播放，不必從頭解壓。
+# Server (GameSession) 與遊戲 client 共用此檔，只能依賴標準函式庫。
+
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .connection import Dispatcher, GameConnection, Handler
+
+MAGIC = b"NPRP"
+FORMAT_VERSION = 1
+FILE_HEADER = struct.Struct("!4sB")
+CHUNK_HEADER = struct.Struct("!dIII")
+RECORD = struct.Struct("!fI")
+KEYFRAME_INTERVAL = 5.0  # 秒
+
+REPLAY_END = "replay_end"  # 本地訊息：播放完畢
+
+
+def coalesce_key(msg: Dict[str, Any]) -> Optional[Tuple[str, Any]]:
+    """同一個 key 的訊息只有最新一筆影響盤面 (例如座標)；None 代表必須全部保留。"""
+    if msg.get("type") == "update" and "role" in msg:
+        return ("update", msg["role"])
+    return None
+
+
+class ReplayWriter:
+    """
+    GameSession 的 relay 執行緒呼叫 record()，可多執行緒同時呼叫。
+    每 KEYFRAME_INTERVAL 秒把累積的 record 壓縮成一個 chunk 寫入並 flush。
+    """
+
+    def __init__(self, path: str, keyframe_interval: float = KEYFRAME_INTERVAL):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.lock = threading.Lock()
+        self.t0 = time.monotonic()
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.f = open(path, "ab")
+        if new_file:
+            self.f.write(FILE_HEADER.pack(MAGIC, FORMAT_VERSION))
+        self.chunk_start = 0.0
+        self.keyframe: List[Tuple[float, bytes]] = []
+        self.pending: List[Tuple[float, bytes]] = []
+        # 用來產生下一個 keyframe 的目前狀態
+        self.history: List[Tuple[float, bytes]] = []
+        self.latest: Dict[Tuple[str, Any], Tuple[float, bytes]] = {}
+
+    def record(self, msg: Dict[str, Any], data: Optional[bytes] = None) -> None:
+        """data 若是已編好的 frame (4 bytes header + JSON)，直接取 body，不再 encode。"""
+        body = data[4:] if data else json.dumps(msg, ensure_ascii=False).encode("utf-8")
+        with self.lock:
+            if self.f.closed:
+                return
+            t = time.monotonic() - self.t0
+            self.pending.append((t, body))
+            key = coalesce_key(msg)
+            if key is None:
+                self.history.append((t, body))
+            else:
+                self.latest[key] = (t, body)
+            if t - self.chunk_start >= self.keyframe_interval:
+                self._flush_chunk(t)
+
+    def _flush_chunk(self, now: float) -> None:
+        if not self.pending:
+            return
+        records = self.keyframe + self.pending
+        payload = b"".join(RECORD.pack(t, len(b)) + b for t, b in records)
+        comp = zlib.compress(payload, 6)
+        self.f.write(CHUNK_HEADER.pack(self.chunk_start, len(self.keyframe), len(records), len(comp)))
+        self.f.write(comp)
+        self.f.flush()
+        self.pending = []
+        self.chunk_start = now
+        self.keyframe = self.history + sorted(self.latest.values())
+
+    def close(self) -> None:
+        with self.lock:
+            if self.f.closed:
+                return
+            self._flush_chunk(time.monotonic() - self.t0)
+            self.f.close()
+
+
+class ReplayReader:
+    def __init__(self, path: str):
+        self.path = path
+        # index: (t_start, n_key, n_rec, offset, comp_len)
+        self.index: List[Tuple[float, int, int, int, int]] = []
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            magic, ver = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+            if magic != MAGIC or ver != FORMAT_VERSION:
+                raise ValueError("not a replay file")
+            while True:
+                hdr = f.read(CHUNK_HEADER.size)
+                if len(hdr) < CHUNK_HEADER.size:
+                    break
+                t_start, n_key, n_rec, comp_len = CHUNK_HEADER.unpack(hdr)
+                offset = f.tell()
+                if offset + comp_len > size:
+                    break  # 最後一個 chunk 沒寫完 (server 當機)
+                f.seek(comp_len, os.SEEK_CUR)
+                self.index.append((t_start, n_key, n_rec, offset, comp_len))
+
+    def duration(self) -> float:
+        if not self.index:
+            return 0.0
+        last = self.index[-1]
+        recs = self._records(last)
+        return recs[-1][0] if recs else last[0]
+
+    def _records(self, entry) -> List[Tuple[float, bytes]]:
+        _, _, n_rec, offset, comp_len = entry
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            payload = zlib.decompress(f.read(comp_len))
+        out, pos = [], 0
+        for _ in range(n_rec):
+            t, ln = RECORD.unpack_from(payload, pos)
+            pos += RECORD.size
+            out.append((t, payload[pos:pos + ln]))
+            pos += ln
+        return out
+
+    def frames(self, seek: float = 0.0) -> Iterator[Tuple[float, Dict[str, Any]]]:
+        """依時間順序產生 (t, msg)。t < seek 的部分 (含 keyframe) 以 t=seek 立即送出。"""
+        start = 0
+        for i, entry in enumerate(self.index):
+            if entry[0] <= seek:
+                start = i
+        for i in range(start, len(self.index)):
+            entry = self.index[i]
+            recs = self._records(entry)
+            n_key = entry[1]
+            if i != start:
+                recs = recs[n_key:]  # 之後的 chunk 直接接續播放，不需要 keyframe
+            for t, body in recs:
+                yield max(t, seek), json.loads(body.decode("utf-8"))
+
+
+class ReplayConnection(Dispatcher):
+    """
+    與 GameConnection 相同介面，但資料來自本地 replay 檔 (不經過網路)。
+    遊戲 client 只要把 GameConnection 換成它即可重播；身分固定為 Spectator。
+    """
+
+    def __init__(self, path: str, speed: float = 1.0, seek: float = 0.0):
+        super().__init__()
+        self.reader = ReplayReader(path)
+        self.speed = max(speed, 0.01)
+        self.seek = seek
+        self.running = False
+        self._post: Optional[Handler] = None
+
+    def connect(self) -> bool:
+        return bool(self.reader.index)
+
+    def start(self, post: Optional[Handler] = None) -> None:
+        self._post = post
+        self.running = True
+        threading.Thread(target=self._play, daemon=True).start()
+
+    def send(self, obj: Dict[str, Any]) -> None:
+        pass  # 重播時忽略所有輸入
+
+    def report_result(self, winners: List[str], player: str) -> None:
+        pass
+
+    def close(self) -> None:
+        self.running = False
+
+    def _deliver(self, msg: Dict[str, Any]) -> None:
+        if self._post:
+            self._post(msg)
+        else:
+            self.dispatch(msg)
+
+    def _play(self) -> None:
+        self._deliver({"type": "init", "role": "Spectator", "msg": "Replay"})
+        wall0 = time.monotonic()
+        for t, msg in self.reader.frames(self.seek):
+            if not self.running:
+                return
+            delay = (t - self.seek) / self.speed - (time.monotonic() - wall0)
+            if delay > 0:
+                time.sleep(delay)
+            self._deliver(msg)
+        if self.running:
+            self._deliver({"type": REPLAY_END})
+
+
+def open_connection(host: str, port: Optional[int], replay: Optional[str] = None,
+                    speed: float = 1.0, seek: float = 0.0) -> Dispatcher:
+    """遊戲 client 的統一入口：有 replay 檔就本地重播，否則連線到 Server。"""
+    if replay:
+        return ReplayConnection(replay, speed=speed, seek=seek)
+    return GameConnection(host, port, auto_reconnect=True)
@@ -10,15 +10,18 @@ from typing import Any, Dict, Optional
 
 HEADER_SIZE = 4  # 4 bytes length header
 
+def encode_frame(obj: Dict[str, Any]) -> bytes:
+    """Python dict -> 4 bytes big-endian 長度 + JSON bytes (同一份可送給多個 socket)"""
+    data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+    return struct.pack("!I", len(data)) + data
+
 def send_frame(sock: socket.socket, obj: Dict[str, Any]) -> None:
     """
     將 Python dict -> JSON bytes，
     前面加 4 bytes big-endian 長度後送出。
     """
     try:
-        data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
-        header = struct.pack("!I", len(data))
-        sock.sendall(header + data)
+        sock.sendall(encode_frame(obj))
     except Exception as e:
         # print(f"[Protocol] Send error: {e}")
         pass
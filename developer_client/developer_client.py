@@ -2,6 +2,8 @@
 
 import socket
 import sys
+import threading
+import time
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 import os
@@ -10,11 +12,13 @@ ROOT = Path(__file__).resolve().parent.parent
 if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))
 
-from common.protocol import send_frame, recv_frame, send_file
+from common.protocol import send_frame, recv_frame, send_file, encode_frame
 from common.utils import input_int  
 
 SERVER_HOST = "140.113.17.11"
 SERVER_PORT = 9800
+HEARTBEAT_INTERVAL = 10.0
+HEARTBEAT_FRAME = encode_frame({"action": "heartbeat", "data": {}})
 
 # ==========================================
 #      內建遊戲範本 (Template Content)
@@ -22,44 +26,16 @@ SERVER_PORT = 9800
 GAME_TEMPLATE_CONTENT = r'''
 import pygame
 import sys
-import socket
-import json
-import threading
-import struct
 import argparse
-import time
-import os
+from pathlib import Path
 
-# --- Helper: 強健接收 ---
-def recv_exact(sock, n):
-    data = b''
-    try:
-        while len(data) < n:
-            chunk = sock.recv(n - len(data))
-            if not chunk: return None
-            data += chunk
-        return data
-    except:
-        return None
-
-def recv_frame(sock):
-    try:
-        header = recv_exact(sock, 4)
-        if not header: return None
-        (length,) = struct.unpack("!I", header)
-        body = recv_exact(sock, length)
-        if not body: return None
-        return json.loads(body.decode("utf-8"))
-    except:
-        return None
-
-def send_frame(sock, obj):
-    try:
-        data = json.dumps(obj).encode("utf-8")
-        header = struct.pack("!I", len(data))
-        sock.sendall(header + data)
-    except Exception as e:
-        print(f"[Net] Send Error: {e}")
+# --- 網路: 共用 gamesdk (Lobby 下載遊戲時會放在 main.py 旁邊) ---
+try:
+    from gamesdk import GameConnection, DISCONNECTED
+except ImportError:
+    # 直接在專案 repo 內執行時，從 common/ 載入
+    sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+    from gamesdk import GameConnection, DISCONNECTED
 
 # --- 遊戲參數 ---
 WINDOW_WIDTH = 800
@@ -67,12 +43,15 @@ WINDOW_HEIGHT = 600
 BG_COLOR = (50, 50, 50)
 TEXT_COLOR = (255, 255, 255)
 
+# 網路訊息以自訂事件進入 pygame 佇列，主迴圈阻塞等待事件 (不再固定 FPS 空轉)
+NET_EVENT = pygame.USEREVENT + 1
+
 class GameClient:
     def __init__(self, host, port, username):
         self.host = host
         self.port = port
         self.username = username
-        self.sock = None
+        self.conn = None
         self.running = True
         
         self.my_role = "Spectator"
@@ -85,49 +64,36 @@ class GameClient:
 
     def connect(self):
         print(f"[Game] Connecting to {self.host}:{self.port}...")
-        retry_count = 10
-        for i in range(retry_count):
-            try:
-                self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.sock.connect((self.host, self.port))
-                print("[Game] Connected! Starting receiver thread...")
-                t = threading.Thread(target=self.network_loop, daemon=True)
-                t.start()
-                return
-            except ConnectionRefusedError:
-                print(f"[Game] Retry ({i+1}/{retry_count})...")
-                time.sleep(0.5)
-            except Exception as e:
-                self.status = f"Error: {e}"
-                return
-        self.status = "Connect Failed"
+        # auto_reconnect: 短暫斷線時自動重連並補回錯過的訊息
+        self.conn = GameConnection(self.host, self.port, auto_reconnect=True)
+        # 依訊息 type 註冊 handler；[TODO] 加入你自己的訊息，例如 self.conn.on("move", self.on_move)
+        self.conn.on("init", self.on_init)
+        self.conn.on("gamestart", self.on_gamestart)
+        self.conn.on("error", self.on_error)
+        self.conn.on(DISCONNECTED, self.on_disconnected)
+        self.conn.on_default(lambda msg: print(f"[Net] Recv: {msg}"))
+        if not self.conn.connect():
+            self.status = "Connect Failed"
+            return
+        print("[Game] Connected! Starting receiver thread...")
+        # 收到的訊息以 NET_EVENT 丟進 pygame 佇列，在主迴圈中 dispatch
+        self.conn.start(post=lambda msg: pygame.event.post(pygame.event.Event(NET_EVENT, msg=msg)))
 
-    def network_loop(self):
-        print("[Net] Receiver started.")
-        while self.running:
-            msg = recv_frame(self.sock)
-            if not msg:
-                self.status = "Disconnected"
-                break
-            
-            type_ = msg.get("type")
-            if type_ == "ping": continue
-            
-            print(f"[Net] Recv: {msg}") 
-            sys.stdout.flush()
-            
-            if type_ == "init":
-                self.my_role = msg.get("role")
-                self.status = f"Role: {self.my_role}. Waiting..."
-                if self.screen:
-                    pygame.display.set_caption(f"Game - {self.username} ({self.my_role})")
-            
-            elif type_ == "gamestart":
-                self.status = "Game Started!"
-            
-            elif type_ == "error":
-                self.status = f"Error: {msg.get('msg')}"
-                self.running = False
+    def on_init(self, msg):
+        self.my_role = msg.get("role")
+        self.status = f"Role: {self.my_role}. Waiting..."
+        if self.screen:
+            pygame.display.set_caption(f"Game - {self.username} ({self.my_role})")
+
+    def on_gamestart(self, msg):
+        self.status = "Game Started!"
+
+    def on_error(self, msg):
+        self.status = f"Error: {msg.get('msg')}"
+        self.running = False
+
+    def on_disconnected(self, msg):
+        self.status = "Disconnected"
 
     def draw(self):
         if not self.screen: return 
@@ -140,23 +106,27 @@ class GameClient:
         pygame.display.flip()
 
     def run(self):
-        self.connect()
+        # 先初始化 pygame，網路執行緒才能 post 事件
         print("[Game] Init Window...")
         pygame.init()
         self.screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
         pygame.display.set_caption(f"Game - {self.username}")
         self.font = pygame.font.SysFont("Arial", 24)
+        self.connect()
+        self.draw()
         
-        clock = pygame.time.Clock()
         while self.running:
-            clock.tick(60)
-            for event in pygame.event.get():
+            # [TODO] 需要動畫時改用 pygame.event.wait(毫秒) 設定下一個期限
+            events = [pygame.event.wait()] + pygame.event.get()
+            for event in events:
                 if event.type == pygame.QUIT:
                     self.running = False
+                elif event.type == NET_EVENT:
+                    self.conn.dispatch(event.msg)
                 # [TODO] 加入按鍵偵測
             self.draw()
         
-        if self.sock: self.sock.close()
+        if self.conn: self.conn.close()
         pygame.quit()
         sys.exit()
 
@@ -212,15 +182,54 @@ class DevClient:
         except Exception as e:
             print(f"無法連線至 Server: {e}")
             sys.exit(1)
+        self.closed = False
+        self.token: Optional[str] = None  # login / resume 回傳的 session token
+        # request / 上傳與背景 heartbeat 共用同一條連線，送出時要持有這把鎖
+        self.lock = threading.RLock()
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+
+    def _heartbeat(self):
+        # Server 不回覆 heartbeat；定期送才不會被當成斷線
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self.lock:
+                if self.closed: continue
+                # send_frame 會吞掉錯誤，這裡要直接 sendall 才知道連線已經斷了
+                try: self.sock.sendall(HEARTBEAT_FRAME)
+                except OSError: self.closed = True  # 下一個 request 會重連
 
     def send_req(self, action: str, data: Dict[str, Any] = None) -> Dict[str, Any]:
         if data is None: data = {}
+        # 上一個 request 發現斷線：先重連，登入過就用 token 接回身分
+        if self.closed and action != "resume" and not self._reconnect():
+            return {"status": "error", "error": "server closed connection"}
         try:
-            send_frame(self.sock, {"action": action, "data": data})
-            resp = recv_frame(self.sock)
-            return resp or {"status": "error", "error": "server closed connection"}
-        except Exception as e:
-            return {"status": "error", "error": str(e)}
+            with self.lock:
+                send_frame(self.sock, {"action": action, "data": data, "trace": os.urandom(8).hex()})
+                resp = recv_frame(self.sock)
+        except Exception:
+            resp = None
+        if resp is None:
+            self.closed = True
+            return {"status": "error", "error": "server closed connection"}
+        if action in ("login", "resume") and resp.get("token"): self.token = resp["token"]
+        elif action == "logout": self.token = None
+        return resp
+
+    def _reconnect(self) -> bool:
+        try:
+            self.sock = socket.create_connection((SERVER_HOST, SERVER_PORT), timeout=5)
+            self.sock.settimeout(None)
+        except OSError:
+            return False
+        self.closed = False
+        print(f"已重新連線至 {SERVER_HOST}:{SERVER_PORT}")
+        if self.token:
+            resp = self.send_req("resume", {"token": self.token})
+            if resp.get("status") != "ok":
+                self.token = None
+                print(f"無法恢復登入狀態: {resp.get('error')}")
+        return True
 
     def upload_game(self, game_id: str):
         print("\n--- 開始上傳遊戲檔案 ---")
@@ -235,27 +244,29 @@ class DevClient:
 
         print(f"準備上傳 {filename} ({file_size} bytes)...")
         
-        # 1. Send Init
-        resp = self.send_req("dev_upload_init", {
-            "game_id": game_id, 
-            "file_size": file_size, 
-            "filename": filename
-        })
+        # 上傳期間 heartbeat 不可插進檔案內容之間
+        with self.lock:
+            # 1. Send Init
+            resp = self.send_req("dev_upload_init", {
+                "game_id": game_id, 
+                "file_size": file_size, 
+                "filename": filename
+            })
         
-        if resp.get("status") != "ready_to_recv":
-            print("Server 拒絕上傳:", resp.get("error"))
-            return
+            if resp.get("status") != "ready_to_recv":
+                print("Server 拒絕上傳:", resp.get("error"))
+                return
             
-        # 2. Send File
-        print("正在傳輸檔案...")
-        try:
-            send_file(self.sock, str(path_obj))
-        except Exception as e:
-            print(f"傳輸失敗: {e}")
-            return
+            # 2. Send File
+            print("正在傳輸檔案...")
+            try:
+                send_file(self.sock, str(path_obj))
+            except Exception as e:
+                print(f"傳輸失敗: {e}")
+                return
         
-        # 3. Recv Final Result
-        final_resp = recv_frame(self.sock)
+            # 3. Recv Final Result
+            final_resp = recv_frame(self.sock)
         print("上傳結果:", final_resp.get("result") or final_resp.get("error"))
         
     def close(self):
@@ -6,46 +6,17 @@
 
 import pygame
 import sys
-import socket
-import json
-import threading
-import struct
 import argparse
 import time
 import random
-import queue
-
-# --- 網路底層 ---
-SOCK_LOCK = threading.Lock()
-
-def recv_exact(sock, n):
-    data = b''
-    try:
-        while len(data) < n:
-            chunk = sock.recv(n - len(data))
-            if not chunk: return None
-            data += chunk
-        return data
-    except: return None
-
-def recv_frame(sock):
-    try:
-        header = recv_exact(sock, 4)
-        if not header: return None
-        (length,) = struct.unpack("!I", header)
-        body = recv_exact(sock, length)
-        if not body: return None
-        return json.loads(body.decode("utf-8"))
-    except: return None
-
-def send_frame(sock, obj):
-    with SOCK_LOCK:
-        try:
-            data = json.dumps(obj).encode("utf-8")
-            header = struct.pack("!I", len(data))
-            sock.sendall(header + data)
-        except Exception as e:
-            print(f"[Net] Send Error: {e}")
+from pathlib import Path
+
+# gamesdk 由 Lobby 放在遊戲旁邊；直接在 repo 內執行時改從 common/ 載入
+try:
+    from gamesdk import open_connection, DISCONNECTED, RECONNECTED, REPLAY_END
+except ImportError:
+    sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+    from gamesdk import open_connection, DISCONNECTED, RECONNECTED, REPLAY_END
 
 # --- 遊戲設定 ---
 WIDTH, HEIGHT = 600, 400
@@ -58,16 +29,23 @@ COLOR_RUNNER = (50, 255, 50)   # 綠色 (人)
 COLOR_DEAD   = (100, 100, 100) # 灰色 (死)
 COLOR_SELF   = (255, 255, 0)   # 黃色 (自己邊框)
 
+# 網路訊息以自訂事件進入 pygame 佇列；主迴圈只在 輸入 / 網路 / 下一個動畫期限 時醒來
+NET_EVENT = pygame.USEREVENT + 1
+FRAME_INTERVAL = 1 / 60   # 按住方向鍵時的移動頻率
+SYNC_INTERVAL = 0.1       # 位置同步 & 計時器刷新週期
+
 class ChaseGame:
-    def __init__(self, host, port, username):
+    def __init__(self, host, port, username, replay=None, speed=1.0, seek=0.0):
         self.host = host
         self.port = port
         self.username = username
-        self.sock = None
+        # 有 replay 檔時改為本地重播 (不連線)
+        self.replay = replay
+        self.speed = speed
+        self.seek = seek
+        self.conn = None
         self.running = True
         
-        self.msg_queue = queue.Queue()
-        
         self.my_role = None
         self.status = "Connecting..."
         self.am_i_alive = True
@@ -90,74 +68,82 @@ class ChaseGame:
 
     def connect(self):
         print(f"[Game] Connecting to {self.host}:{self.port}...")
-        for i in range(10):
-            try:
-                self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.sock.connect((self.host, self.port))
-                threading.Thread(target=self.network_loop, daemon=True).start()
-                return
-            except:
-                time.sleep(0.5)
-        self.status = "Connect Failed"
-
-    def network_loop(self):
-        while self.running:
-            msg = recv_frame(self.sock)
-            if not msg:
-                self.msg_queue.put({"type": "system", "msg": "Disconnected"})
-                break
-            self.msg_queue.put(msg)
-
-    def process_queue(self):
-        while not self.msg_queue.empty():
-            try:
-                msg = self.msg_queue.get_nowait()
-            except queue.Empty:
-                break
-            
-            type_ = msg.get("type")
-            if type_ == "ping": continue
-
-            if type_ == "init":
-                self.my_role = msg.get("role")
-                if self.my_role == "P1":
-                    self.status = "You are CHASER (Red). Waiting..."
-                else:
-                    self.status = f"You are RUNNER {self.my_role} (Green). Waiting..."
-                
-                if self.screen:
-                    pygame.display.set_caption(f"Chase - {self.username} ({self.my_role})")
-
-            elif type_ == "gamestart":
-                self.status = "GAME START! SURVIVE 30s!" if self.my_role != "P1" else "GAME START! CATCH THEM ALL!"
-                self.game_started = True
-                self.start_time = time.time()
-                self.send_pos() 
-
-            elif type_ == "update":
-                role = msg["role"]
-                if role != self.my_role:
-                    if role not in self.players:
-                        # 新發現玩家，預設活著
-                        self.players[role] = {"x": 0, "y": 0, "alive": True}
-                    self.players[role]["x"] = msg["x"]
-                    self.players[role]["y"] = msg["y"]
-            
-            elif type_ == "kill":
-                victim = msg["target"]
-                if victim == self.my_role:
-                    self.am_i_alive = False
-                    self.status = "YOU DIED!"
-                elif victim in self.players:
-                    self.players[victim]["alive"] = False
+        self.conn = open_connection(self.host, self.port, self.replay, self.speed, self.seek)
+        self.conn.on_default(self.handle_message)
+        if not self.conn.connect():
+            self.status = "Connect Failed"
+            return
+        self.conn.start(post=lambda msg: pygame.event.post(pygame.event.Event(NET_EVENT, msg=msg)))
+
+    def handle_message(self, msg):
+        type_ = msg.get("type")
+
+        if type_ == "init":
+            self.my_role = msg.get("role")
+            if self.my_role == "P1":
+                self.status = "You are CHASER (Red). Waiting..."
+            elif self.is_spectator():
+                self.status = "Spectating..."
+            else:
+                self.status = f"You are RUNNER {self.my_role} (Green). Waiting..."
             
-            elif type_ == "system":
-                self.status = "Disconnected"
-                self.running = False
+            if self.screen:
+                pygame.display.set_caption(f"Chase - {self.username} ({self.my_role})")
+
+        elif type_ == "reset":
+            # 觀戰跟不上：Server 接著會重送完整 snapshot，先清掉已知的玩家
+            self.players = {}
+            self.game_over = False
+            self.winner_text = ""
+
+        elif type_ == "gamestart":
+            if self.is_spectator(): self.status = "GAME START!"
+            else: self.status = "GAME START! SURVIVE 30s!" if self.my_role != "P1" else "GAME START! CATCH THEM ALL!"
+            self.game_started = True
+            self.start_time = time.time()
+            self.send_pos() 
+
+        elif type_ == "update":
+            role = msg["role"]
+            if role != self.my_role:
+                if role not in self.players:
+                    # 新發現玩家，預設活著
+                    self.players[role] = {"x": 0, "y": 0, "alive": True}
+                self.players[role]["x"] = msg["x"]
+                self.players[role]["y"] = msg["y"]
+        
+        elif type_ == "kill":
+            victim = msg["target"]
+            if victim == self.my_role:
+                self.am_i_alive = False
+                self.status = "YOU DIED!"
+            elif victim in self.players:
+                self.players[victim]["alive"] = False
+        
+        elif type_ == "player_disconnected":
+            # 斷線的玩家先標示為灰色，重連後恢復
+            if msg.get("role") in self.players: self.players[msg["role"]]["away"] = True
+
+        elif type_ == "player_reconnected":
+            if msg.get("role") in self.players: self.players[msg["role"]]["away"] = False
+
+        elif type_ == RECONNECTED:
+            self.send_pos()
+
+        elif type_ == REPLAY_END:
+            self.game_over = True
+            if not self.winner_text: self.status = "Replay finished"
+
+        elif type_ == DISCONNECTED:
+            self.status = "Disconnected"
+            self.running = False
+
+    def is_spectator(self):
+        return self.my_role == "Spectator"
 
     def send_pos(self):
-        if self.sock and self.my_role and self.am_i_alive and not self.game_over:
-            send_frame(self.sock, {
+        if self.conn and self.my_role and not self.is_spectator() and self.am_i_alive and not self.game_over:
+            self.conn.send({
                 "type": "update", 
                 "role": self.my_role,
                 "x": self.x, 
@@ -165,14 +151,14 @@ class ChaseGame:
             })
 
     def send_kill(self, target_role):
-        if self.sock:
-            send_frame(self.sock, {"type": "kill", "target": target_role})
+        if self.conn:
+            self.conn.send({"type": "kill", "target": target_role})
 
     def get_alive_runners(self):
         """計算目前存活的跑者數量 (扣除 P1 鬼)"""
         count = 0
         # 1. 檢查自己
-        if self.my_role != "P1" and self.am_i_alive:
+        if self.my_role not in (None, "P1", "Spectator") and self.am_i_alive:
             count += 1
         # 2. 檢查別人
         for role, p in self.players.items():
@@ -194,12 +180,18 @@ class ChaseGame:
             self.game_over = True
             self.winner_text = "CHASER WINS!"
             self.status = "All Runners Caught!"
+            self.report_result(["P1"])
 
         # 條件 2: 人贏 (時間到且還有人活著)
         elif remaining == 0:
             self.game_over = True
             self.winner_text = "RUNNERS WIN!"
             self.status = "Time Up! Survivors Win!"
+            self.report_result([r for r in [self.my_role, *self.players] if r != "P1"])
+
+    def report_result(self, winners):
+        """回報勝負給 Server (用來調整配對 rating)；重播時 conn.report_result 什麼都不做"""
+        if self.my_role and self.my_role != "Spectator": self.conn.report_result(sorted(winners), self.username)
 
     def check_collisions(self):
         """鬼 (P1) 負責偵測碰撞"""
@@ -222,7 +214,7 @@ class ChaseGame:
         
         # 1. 畫別人
         for role, p in self.players.items():
-            if not p.get("alive", True): c = COLOR_DEAD
+            if not p.get("alive", True) or p.get("away"): c = COLOR_DEAD
             elif role == "P1": c = COLOR_CHASER
             else: c = COLOR_RUNNER
             
@@ -232,8 +224,8 @@ class ChaseGame:
                 lbl = self.font.render(role, True, (255, 255, 255))
                 self.screen.blit(lbl, (p["x"]-10, p["y"]-40))
 
-        # 2. 畫自己
-        if self.my_role:
+        # 2. 畫自己 (觀眾沒有自己的角色)
+        if self.my_role and not self.is_spectator():
             if not self.am_i_alive: my_c = COLOR_DEAD
             elif self.my_role == "P1": my_c = COLOR_CHASER
             else: my_c = COLOR_RUNNER
@@ -274,30 +266,56 @@ class ChaseGame:
 
         pygame.display.flip()
 
+    def arrow_held(self):
+        keys = pygame.key.get_pressed()
+        return keys[pygame.K_LEFT] or keys[pygame.K_RIGHT] or keys[pygame.K_UP] or keys[pygame.K_DOWN]
+
+    def wait_timeout_ms(self, last_sync, last_frame):
+        """距離下一個動畫期限的毫秒數；回傳 None 代表沒有期限，可以一直阻塞。"""
+        deadlines = []
+        if self.am_i_alive and not self.game_over and not self.is_spectator() and self.arrow_held():
+            deadlines.append(last_frame + FRAME_INTERVAL)
+        if self.game_started and not self.game_over:
+            # 計時器顯示、勝負判定與位置同步
+            deadlines.append(last_sync + SYNC_INTERVAL)
+        if not deadlines:
+            return None
+        return max(1, int((min(deadlines) - time.time()) * 1000))
+
+    def wait_events(self, timeout_ms):
+        first = pygame.event.wait() if timeout_ms is None else pygame.event.wait(timeout_ms)
+        return [first] + pygame.event.get()
+
     def run(self):
-        self.connect()
+        # 先初始化 pygame，網路執行緒才能 post 事件
         print("[Game] Init Window...")
         pygame.init()
         self.screen = pygame.display.set_mode((WIDTH, HEIGHT))
         pygame.display.set_caption(f"Chase - {self.username}")
+        pygame.event.set_blocked(pygame.MOUSEMOTION)
         self.font = pygame.font.SysFont("Arial", 24)
         self.big_font = pygame.font.SysFont("Arial", 64, bold=True)
+        self.connect()
         
-        clock = pygame.time.Clock()
-        last_sync = time.time()
+        last_sync = last_frame = time.time()
+        self.draw()
         
         while self.running:
-            clock.tick(60)
-            
-            # 1. 處理網路
-            self.process_queue()
+            # 1. 阻塞直到 輸入 / 網路 / 下一個期限
+            for event in self.wait_events(self.wait_timeout_ms(last_sync, last_frame)):
+                if event.type == pygame.QUIT:
+                    self.running = False
+                elif event.type == NET_EVENT:
+                    self.conn.dispatch(event.msg)
             
             # 2. 檢查勝負
             self.check_win_condition()
 
-            # 3. 輸入與移動 (活著且遊戲進行中)
+            # 3. 輸入與移動 (活著且遊戲進行中)，只在 frame 期限到時走一步，速度才不受網路事件影響
+            now = time.time()
             moved = False
-            if self.am_i_alive and not self.game_over:
+            if self.am_i_alive and not self.game_over and not self.is_spectator() and now - last_frame >= FRAME_INTERVAL:
+                last_frame = now
                 keys = pygame.key.get_pressed()
                 speed = 5
                 if self.my_role == "P1": speed = 6 # 鬼跑快一點
@@ -309,29 +327,30 @@ class ChaseGame:
                 
                 self.x = max(RADIUS, min(WIDTH-RADIUS, self.x))
                 self.y = max(RADIUS, min(HEIGHT-RADIUS, self.y))
-
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.running = False
             
-            if self.am_i_alive and not self.game_over and (moved or (time.time() - last_sync > 0.1)):
+            if self.game_started and (moved or now - last_sync >= SYNC_INTERVAL):
                 self.send_pos()
-                last_sync = time.time()
+                last_sync = now
 
             # 4. 碰撞 (只有鬼)
             self.check_collisions()
 
             self.draw()
         
-        if self.sock: self.sock.close()
+        if self.conn: self.conn.close()
         pygame.quit()
         sys.exit()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--host", default="140.113.17.11")
-    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--port", type=int)
     parser.add_argument("--player", default="Guest")
     parser.add_argument("--room", help="Room ID") 
+    parser.add_argument("--replay", help="本地 replay 檔 (.rpl)，指定時不連線")
+    parser.add_argument("--speed", type=float, default=1.0, help="重播倍速")
+    parser.add_argument("--seek", type=float, default=0.0, help="從第幾秒開始重播")
     args = parser.parse_args()
-    ChaseGame(args.host, args.port, args.player).run()
\ No newline at end of file
+    if args.port is None and not args.replay:
+        parser.error("--port or --replay is required")
+    ChaseGame(args.host, args.port, args.player, args.replay, args.speed, args.seek).run()
\ No newline at end of file
@@ -3,44 +3,15 @@
 
 import pygame
 import sys
-import socket
-import json
-import threading
-import struct
 import argparse
-import time
-import os
-
-# --- Helper: Robust Receive ---
-def recv_exact(sock, n):
-    data = b''
-    try:
-        while len(data) < n:
-            chunk = sock.recv(n - len(data))
-            if not chunk: return None
-            data += chunk
-        return data
-    except:
-        return None
-
-def recv_frame(sock):
-    try:
-        header = recv_exact(sock, 4)
-        if not header: return None
-        (length,) = struct.unpack("!I", header)
-        body = recv_exact(sock, length)
-        if not body: return None
-        return json.loads(body.decode("utf-8"))
-    except:
-        return None
-
-def send_frame(sock, obj):
-    try:
-        data = json.dumps(obj).encode("utf-8")
-        header = struct.pack("!I", len(data))
-        sock.sendall(header + data)
-    except Exception as e:
-        print(f"[Net] Send Error: {e}")
+from pathlib import Path
+
+# gamesdk 由 Lobby 放在遊戲旁邊；直接在 repo 內執行時改從 common/ 載入
+try:
+    from gamesdk import open_connection, DISCONNECTED, RECONNECTED, REPLAY_END
+except ImportError:
+    sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+    from gamesdk import open_connection, DISCONNECTED, RECONNECTED, REPLAY_END
 
 # --- Game Constants ---
 BOARD_SIZE = 15
@@ -52,12 +23,19 @@ LINE_COLOR = (0, 0, 0)
 BLACK_COLOR = (0, 0, 0)
 WHITE_COLOR = (255, 255, 255)
 
+# 網路執行緒收到的 frame 以自訂事件丟進 pygame 事件佇列，主迴圈只在有事時醒來
+NET_EVENT = pygame.USEREVENT + 1
+
 class GomokuClient:
-    def __init__(self, host, port, username):
+    def __init__(self, host, port, username, replay=None, speed=1.0, seek=0.0):
         self.host = host
         self.port = port
         self.username = username
-        self.sock = None
+        # 有 replay 檔時改為本地重播 (不連線)
+        self.replay = replay
+        self.speed = speed
+        self.seek = seek
+        self.conn = None
         self.running = True
         
         self.board = [[None for _ in range(BOARD_SIZE)] for _ in range(BOARD_SIZE)]
@@ -71,53 +49,61 @@ class GomokuClient:
 
     def connect(self):
         print(f"[Game] Connecting to {self.host}:{self.port}...")
-        retry_count = 10
-        for i in range(retry_count):
-            try:
-                self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.sock.connect((self.host, self.port))
-                print("[Game] Connected! Starting receiver thread...")
-                t = threading.Thread(target=self.network_loop, daemon=True)
-                t.start()
-                return
-            except Exception as e:
-                time.sleep(0.5)
-        self.status = "Connection Failed"
-
-    def network_loop(self):
-        while self.running:
-            msg = recv_frame(self.sock)
-            if not msg:
-                self.status = "Disconnected"
-                break
-            
-            type_ = msg.get("type")
-            if type_ == "ping": continue
-            
-            if type_ == "init":
-                self.my_role = msg.get("role")
-                # [UI] English Role Description
-                role_en = "Black (First)" if self.my_role == "black" else "White (Second)"
-                self.status = f"You are: {role_en}. Waiting..."
-                
-                if self.screen:
-                    pygame.display.set_caption(f"Gomoku - {self.username} [{role_en}]")
-            
-            elif type_ == "gamestart":
-                self.status = "Game Start! Black goes first."
-            
-            elif type_ == "move":
-                r, c, color = msg["row"], msg["col"], msg["color"]
-                if self.board[r][c] is None:
-                    self.board[r][c] = color
-                    self.turn = "white" if color == "black" else "black"
-                    self.check_win(r, c, color)
-                    if not self.winner:
-                        self.update_status()
-            
-            elif type_ == "error":
-                self.status = f"Error: {msg.get('msg')}"
-                self.running = False
+        self.conn = open_connection(self.host, self.port, self.replay, self.speed, self.seek)
+        self.conn.on_default(self.handle_message)
+        if not self.conn.connect():
+            self.status = "Connection Failed"
+            return
+        print("[Game] Connected! Starting receiver thread...")
+        self.conn.start(post=lambda msg: pygame.event.post(pygame.event.Event(NET_EVENT, msg=msg)))
+
+    def handle_message(self, msg):
+        type_ = msg.get("type")
+        if type_ == DISCONNECTED:
+            self.status = "Disconnected"
+
+        elif type_ == RECONNECTED:
+            if not self.winner: self.update_status()
+
+        elif type_ == "player_disconnected":
+            if not self.winner: self.status = "Opponent disconnected, waiting..."
+
+        elif type_ == "player_reconnected":
+            if not self.winner: self.update_status()
+
+        elif type_ == REPLAY_END:
+            if not self.winner: self.status = "Replay finished"
+
+        elif type_ == "init":
+            self.my_role = msg.get("role")
+            # [UI] English Role Description
+            role_en = {"black": "Black (First)", "white": "White (Second)"}.get(self.my_role, "Spectator")
+            self.status = f"You are: {role_en}. Waiting..."
+
+            if self.screen:
+                pygame.display.set_caption(f"Gomoku - {self.username} [{role_en}]")
+
+        elif type_ == "reset":
+            # 觀戰跟不上：Server 接著會重送完整 snapshot，先清空盤面
+            self.board = [[None for _ in range(BOARD_SIZE)] for _ in range(BOARD_SIZE)]
+            self.turn = 'black'
+            self.winner = None
+
+        elif type_ == "gamestart":
+            self.status = "Game Start! Black goes first."
+
+        elif type_ == "move":
+            r, c, color = msg["row"], msg["col"], msg["color"]
+            if self.board[r][c] is None:
+                self.board[r][c] = color
+                self.turn = "white" if color == "black" else "black"
+                self.check_win(r, c, color)
+                if not self.winner:
+                    self.update_status()
+
+        elif type_ == "error":
+            self.status = f"Error: {msg.get('msg')}"
+            self.running = False
 
     def update_status(self):
         # Update status text in English
@@ -140,11 +126,12 @@ class GomokuClient:
                 self.winner = color
                 winner_en = "Black" if color == "black" else "White"
                 self.status = f"Game Over! {winner_en} Wins!"
+                if self.my_role in ("black", "white"): self.conn.report_result([color], self.username)
                 return
 
     def send_move(self, row, col):
-        if self.sock:
-            send_frame(self.sock, {
+        if self.conn:
+            self.conn.send({
                 "type": "move", "row": row, "col": col, "color": self.my_role
             })
 
@@ -187,26 +174,32 @@ class GomokuClient:
         pygame.display.flip()
 
     def run(self):
-        self.connect()
+        # 先初始化 pygame，網路執行緒才能 post 事件
         print("[Game] Initializing Pygame Window...")
         pygame.init()
         self.screen = pygame.display.set_mode((WINDOW_SIZE, WINDOW_SIZE))
         pygame.display.set_caption(f"Gomoku - {self.username}")
-        
+        # 滑鼠移動不影響畫面，不必為它喚醒
+        pygame.event.set_blocked(pygame.MOUSEMOTION)
+
         # Use system default font (English is safe)
         self.font = pygame.font.SysFont("Arial", 24)
-        
-        clock = pygame.time.Clock()
-        
+
+        self.connect()
+        self.draw()
+
         while self.running:
-            clock.tick(30)
-            for event in pygame.event.get():
+            # 回合制不需要動畫：阻塞到有輸入或網路訊息為止
+            events = [pygame.event.wait()] + pygame.event.get()
+            for event in events:
                 if event.type == pygame.QUIT:
                     self.running = False
+                elif event.type == NET_EVENT:
+                    self.conn.dispatch(event.msg)
                 elif event.type == pygame.MOUSEBUTTONDOWN and not self.winner:
                     # Check turn and game status
                     if self.my_role == self.turn and ("Start" in self.status or "Turn" in self.status):
-                        mx, my = pygame.mouse.get_pos()
+                        mx, my = event.pos
                         if my < MARGIN: continue
                         
                         c = round((mx - MARGIN) / CELL_SIZE)
@@ -222,15 +215,20 @@ class GomokuClient:
             
             self.draw()
         
-        if self.sock: self.sock.close()
+        if self.conn: self.conn.close()
         pygame.quit()
         sys.exit()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--host", default="140.113.17.11")
-    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--port", type=int)
     parser.add_argument("--player", default="Guest")
     parser.add_argument("--room", help="Room ID") 
+    parser.add_argument("--replay", help="本地 replay 檔 (.rpl)，指定時不連線")
+    parser.add_argument("--speed", type=float, default=1.0, help="重播倍速")
+    parser.add_argument("--seek", type=float, default=0.0, help="從第幾秒開始重播")
     args = parser.parse_args()
-    GomokuClient(args.host, args.port, args.player).run()
\ No newline at end of file
+    if args.port is None and not args.replay:
+        parser.error("--port or --replay is required")
+    GomokuClient(args.host, args.port, args.player, args.replay, args.speed, args.seek).run()
\ No newline at end of file
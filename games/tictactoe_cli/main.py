@@ -2,53 +2,31 @@
 # 井字遊戲 (CLI) - Level A
 
 
-import socket
-import json
 import threading
-import struct
 import argparse
 import sys
-import time
+from pathlib import Path
 
-# ==========================================
-#      網路底層 Helper
-# ==========================================
-def recv_exact(sock, n):
-    data = b''
-    try:
-        while len(data) < n:
-            chunk = sock.recv(n - len(data))
-            if not chunk: return None
-            data += chunk
-        return data
-    except: return None
-
-def recv_frame(sock):
-    try:
-        header = recv_exact(sock, 4)
-        if not header: return None
-        (length,) = struct.unpack("!I", header)
-        body = recv_exact(sock, length)
-        if not body: return None
-        return json.loads(body.decode("utf-8"))
-    except: return None
-
-def send_frame(sock, obj):
-    try:
-        data = json.dumps(obj).encode("utf-8")
-        header = struct.pack("!I", len(data))
-        sock.sendall(header + data)
-    except: pass
+# gamesdk 由 Lobby 放在遊戲旁邊；直接在 repo 內執行時改從 common/ 載入
+try:
+    from gamesdk import open_connection, DISCONNECTED, RECONNECTED, REPLAY_END
+except ImportError:
+    sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+    from gamesdk import open_connection, DISCONNECTED, RECONNECTED, REPLAY_END
 
 # ==========================================
 #      遊戲邏輯 (CLI)
 # ==========================================
 class TicTacToe:
-    def __init__(self, host, port, username):
+    def __init__(self, host, port, username, replay=None, speed=1.0, seek=0.0):
         self.host = host
         self.port = port
         self.username = username
-        self.sock = None
+        # 有 replay 檔時改為本地重播 (不連線)
+        self.replay = replay
+        self.speed = speed
+        self.seek = seek
+        self.conn = None
         self.running = True
         
         # 遊戲狀態
@@ -57,18 +35,27 @@ class TicTacToe:
         self.turn = "black" # black 先手 (代表 X)
         self.symbol = "?"   # 自己是 X 還是 O
         self.game_started = False
+        # 網路執行緒每次改變狀態就 set，主執行緒在非自己回合時阻塞在這裡 (不再 sleep 輪詢)
+        self.state_changed = threading.Event()
 
     def connect(self):
         print(f"正在連線至 {self.host}:{self.port}...")
-        try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.connect((self.host, self.port))
-            # 啟動接收執行緒
-            threading.Thread(target=self.network_loop, daemon=True).start()
-        except Exception as e:
-            print(f"連線失敗: {e}")
+        self.conn = open_connection(self.host, self.port, self.replay, self.speed, self.seek)
+        self.conn.on("init", self.on_init)
+        self.conn.on("reset", self.on_reset)
+        self.conn.on("gamestart", self.on_gamestart)
+        self.conn.on("move", self.on_move)
+        self.conn.on(DISCONNECTED, self.on_disconnected)
+        self.conn.on(REPLAY_END, self.on_replay_end)
+        self.conn.on(RECONNECTED, lambda msg: print("\n[系統] 已重新連線", flush=True))
+        self.conn.on("player_disconnected", lambda msg: print("\n[系統] 對手斷線，等待重新連線...", flush=True))
+        self.conn.on("player_reconnected", lambda msg: print("\n[系統] 對手已重新連線", flush=True))
+        if not self.conn.connect():
+            print("連線失敗")
             input("按 Enter 離開...") # 連線失敗也停住
             sys.exit(1)
+        # 啟動接收執行緒 (handler 都在該執行緒執行)
+        self.conn.start()
 
     def print_board(self):
         """畫出棋盤"""
@@ -90,60 +77,76 @@ class TicTacToe:
 
     def handle_game_over(self, winner):
         """統一處理遊戲結束顯示"""
+        if self.my_role in ("black", "white"):
+            self.conn.report_result([] if winner == "DRAW" else ["black" if winner == "X" else "white"], self.username)
         if winner == "DRAW":
             print(f"\n[結束] 遊戲結束！結果: 平局 (Draw)")
         else:
             print(f"\n[結束] 遊戲結束！贏家: {winner}")
         self.running = False
+        self.state_changed.set()
 
-    def network_loop(self):
-        """接收 Server 訊息"""
-        while self.running:
-            msg = recv_frame(self.sock)
-            if not msg:
-                print("\n[系統] 與伺服器斷線")
-                self.running = False
-                break
-            
-            type_ = msg.get("type")
-            if type_ == "ping": continue
-
-            if type_ == "init":
-                self.my_role = msg.get("role")
-                # black 是 X (先手), white 是 O (後手)
-                self.symbol = "X" if self.my_role == "black" else "O"
-                print(f"\n[系統] 你的角色: {self.my_role} (符號: {self.symbol})")
-                print("[系統] 等待對手加入...")
-
-            elif type_ == "gamestart":
-                self.game_started = True
-                print("\n[系統] 遊戲開始！黑棋 (X) 先攻")
-                self.print_board()
-                if self.my_role == "black":
-                    print(">>> 輪到你了！請輸入位置 (0-8): ", end="", flush=True)
-
-            elif type_ == "move":
-                # 收到對手下棋
-                idx = msg["index"]
-                symbol = msg["symbol"]
-                self.board[idx] = symbol
-                self.print_board()
-                
-                winner = self.check_win()
-                if winner:
-                    self.handle_game_over(winner)
-                else:
-                    # 切換回合
-                    self.turn = "white" if self.turn == "black" else "black"
-                    if self.turn == self.my_role:
-                        print(">>> 輪到你了！請輸入位置 (0-8): ", end="", flush=True)
-                    else:
-                        print("等待對手下棋...", flush=True)
+    # --- 接收 Server 訊息 (由 gamesdk 依 type 分派) ---
+    def on_disconnected(self, msg):
+        print("\n[系統] 與伺服器斷線")
+        self.running = False
+        self.state_changed.set()
+
+    def on_replay_end(self, msg):
+        print("\n[系統] 重播結束")
+        self.running = False
+        self.state_changed.set()
+
+    def on_init(self, msg):
+        self.my_role = msg.get("role")
+        # black 是 X (先手), white 是 O (後手)
+        if self.my_role == "Spectator":
+            print("\n[系統] 觀戰模式")
+        else:
+            self.symbol = "X" if self.my_role == "black" else "O"
+            print(f"\n[系統] 你的角色: {self.my_role} (符號: {self.symbol})")
+            print("[系統] 等待對手加入...")
+        self.state_changed.set()
+
+    def on_reset(self, msg):
+        # 觀戰跟不上：Server 接著會重送完整 snapshot，先清空盤面
+        self.board = [" "] * 9
+        self.turn = "black"
+        self.game_started = False
+
+    def on_gamestart(self, msg):
+        self.game_started = True
+        print("\n[系統] 遊戲開始！黑棋 (X) 先攻")
+        self.print_board()
+        if self.my_role == "black":
+            print(">>> 輪到你了！請輸入位置 (0-8): ", end="", flush=True)
+        self.state_changed.set()
+
+    def on_move(self, msg):
+        # 收到對手下棋
+        idx = msg["index"]
+        symbol = msg["symbol"]
+        self.board[idx] = symbol
+        self.print_board()
+        
+        winner = self.check_win()
+        if winner:
+            self.handle_game_over(winner)
+        else:
+            # 切換回合
+            self.turn = "white" if self.turn == "black" else "black"
+            if self.turn == self.my_role:
+                print(">>> 輪到你了！請輸入位置 (0-8): ", end="", flush=True)
+            elif self.my_role != "Spectator":
+                print("等待對手下棋...", flush=True)
+        self.state_changed.set()
 
     def run(self):
         self.connect()
         # 主迴圈處理輸入
         while self.running:
+            # 先 clear 再檢查狀態：檢查之後才發生的變化會讓 wait() 立即返回，不會漏掉
+            self.state_changed.clear()
             # 只有輪到自己且遊戲開始時才讀取輸入
             if self.game_started and self.turn == self.my_role:
                 try:
@@ -159,7 +162,7 @@ class TicTacToe:
                         self.board[idx] = self.symbol
                         self.print_board()
                         # 2. 發送給對手
-                        send_frame(self.sock, {"type": "move", "index": idx, "symbol": self.symbol})
+                        self.conn.send({"type": "move", "index": idx, "symbol": self.symbol})
                         
                         # 3. 檢查勝負
                         winner = self.check_win()
@@ -172,12 +175,12 @@ class TicTacToe:
                         print("無效的位置，請重試: ", end="", flush=True)
                 except:
                     break
-            else:
-                # 沒輪到自己就休息一下，避免 CPU 飆高
-                time.sleep(0.1)
+            elif self.running:
+                # 沒輪到自己就阻塞到網路執行緒通知，等待期間不耗 CPU
+                self.state_changed.wait()
         
         #  遊戲迴圈結束後，不要馬上關閉視窗
-        if self.sock: self.sock.close()
+        if self.conn: self.conn.close()
         print("\n-------------------------")
         input("遊戲已結束，請按 Enter 鍵離開視窗...") 
         sys.exit(0)
@@ -185,8 +188,13 @@ class TicTacToe:
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--host", default="140.113.17.11")
-    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--port", type=int)
     parser.add_argument("--player", default="Guest")
     parser.add_argument("--room", help="Room ID") 
+    parser.add_argument("--replay", help="本地 replay 檔 (.rpl)，指定時不連線")
+    parser.add_argument("--speed", type=float, default=1.0, help="重播倍速")
+    parser.add_argument("--seek", type=float, default=0.0, help="從第幾秒開始重播")
     args = parser.parse_args()
-    TicTacToe(args.host, args.port, args.player).run()
\ No newline at end of file
+    if args.port is None and not args.replay:
+        parser.error("--port or --replay is required")
+    TicTacToe(args.host, args.port, args.player, args.replay, args.speed, args.seek).run()
\ No newline at end of file
@@ -4,21 +4,39 @@
 import socket
 import sys
 import subprocess
+import threading
+import queue
+import time
+import collections
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional, Set
 import os
+import re
 import json
+import shutil
 
 # 設定專案根目錄，確保能 import common
 ROOT = Path(__file__).resolve().parent.parent
 if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))
 
-from common.protocol import send_frame, recv_frame, recv_file
+from common.protocol import send_frame, recv_frame, recv_file, encode_frame
 from common.utils import input_int
 
 SERVER_HOST = "140.113.17.11"
 SERVER_PORT = 9800
+HEARTBEAT_INTERVAL = 10.0  # 定期送 heartbeat，Server 才分得出「閒置」與「已斷線」
+HEARTBEAT_FRAME = encode_frame({"action": "heartbeat", "data": {}})
+# 遊戲共用的網路 SDK，下載遊戲時複製到 main.py 旁邊
+SDK_DIR = ROOT / "common" / "gamesdk"
+
+def sdk_version(sdk_dir: Path) -> Optional[str]:
+    """讀取 gamesdk/__init__.py 的 __version__ (不 import，避免載到錯的版本)。"""
+    try:
+        m = re.search(r'__version__\s*=\s*"([^"]+)"', (sdk_dir / "__init__.py").read_text(encoding="utf-8"))
+        return m.group(1) if m else None
+    except OSError:
+        return None
 
 # --- Plugin 定義 ---
 AVAILABLE_PLUGINS = {
@@ -26,6 +44,12 @@ AVAILABLE_PLUGINS = {
 }
 
 class LobbyClient:
+    """
+    Lobby 連線。背景讀取執行緒把收到的 frame 分流：
+      - 帶 "status" 的是 request 的回應 (依送出順序)，交給 send_req
+      - 帶 "type" 的是 Server 推播 (訂閱事件、配對結果)，更新本地快取或印出通知
+    連線斷掉後，下一個 request 會先重連；登入過就用 token 送 resume 接回身分並補回訂閱
+    """
     def __init__(self):
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -36,50 +60,222 @@ class LobbyClient:
         except Exception as e:
             print(f"無法連線至 Server: {e}")
             sys.exit(1)
-
-    def send_req(self, action: str, data: Dict[str, Any] = None) -> Dict[str, Any]:
+        self.closed = False
+        self.token: Optional[str] = None  # login / resume 回傳的 session token
+        self._send_lock = threading.Lock()
+        self._pending: "collections.deque[Optional[Callable]]" = collections.deque()  # 每個 request 的 sink
+        self._replies: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self._matches: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self.subscribed: Set[str] = set()
+        self.rooms: Dict[int, Dict[str, Any]] = {}  # 訂閱 "rooms" 後由事件維護
+        threading.Thread(target=self._reader, daemon=True).start()
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+
+    def send_req(self, action: str, data: Dict[str, Any] = None,
+                 sink: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        送出 request 並等待回應。
+        sink(resp) 會在讀取執行緒、讀下一個 frame 之前執行，用來接收緊接在回應後的檔案內容。
+        """
         if data is None: data = {}
+        if self.closed and action != "resume": self._reconnect()
+        with self._send_lock:
+            if self.closed: return {"status": "error", "error": "server closed connection"}
+            self._pending.append(sink)
+            # trace：server 帶 --trace-file 時，用它把這個 request 在 lobby / DB 的處理時間串起來
+            send_frame(self.sock, {"action": action, "data": data, "trace": os.urandom(8).hex()})
+        resp = self._replies.get()
+        if action in ("login", "resume") and resp.get("token"): self.token = resp["token"]
+        elif action == "logout": self.token = None
+        return resp
+
+    def _reconnect(self) -> bool:
         try:
-            send_frame(self.sock, {"action": action, "data": data})
-            resp = recv_frame(self.sock)
-            return resp or {"status": "error", "error": "server closed connection"}
-        except Exception as e:
-            return {"status": "error", "error": str(e)}
+            sock = socket.create_connection((SERVER_HOST, SERVER_PORT), timeout=5)
+        except OSError:
+            return False
+        sock.settimeout(None)
+        with self._send_lock:
+            self.sock, self.closed = sock, False
+        threading.Thread(target=self._reader, daemon=True).start()
+        print(f"已重新連線至 {SERVER_HOST}:{SERVER_PORT}")
+        if self.token:
+            resp = self.send_req("resume", {"token": self.token})
+            if resp.get("status") != "ok":
+                self.token = None
+                print(f"無法恢復登入狀態: {resp.get('error')}")
+        if self.subscribed: self.subscribe(*self.subscribed)
+        return True
+
+    def _heartbeat(self):
+        # Server 不回覆 heartbeat，不佔用 _pending 的順序
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self._send_lock:
+                if self.closed: continue
+                # send_frame 會吞掉錯誤，這裡要直接 sendall 才知道連線已經斷了
+                try: self.sock.sendall(HEARTBEAT_FRAME)
+                except OSError: self.closed = True  # 下一個 request 會重連
+
+    def _reader(self):
+        sock = self.sock
+        while True:
+            msg = recv_frame(sock)
+            if msg is None: break
+            if "status" not in msg:
+                self._on_push(msg)
+                continue
+            sink = self._pending.popleft() if self._pending else None
+            if sink and msg.get("status") == "ok":
+                try:
+                    sink(msg)
+                except Exception as e:
+                    msg = {"status": "error", "error": f"傳輸中斷或失敗: {e}"}
+            self._replies.put(msg)
+        with self._send_lock:
+            self.closed = True
+            for _ in self._pending:
+                self._replies.put({"status": "error", "error": "server closed connection"})
+            self._pending.clear()
+        self._matches.put({"type": "match_failed", "error": "server closed connection"})
+
+    def _on_push(self, msg: Dict[str, Any]) -> None:
+        if msg.get("type") in ("match_found", "match_failed"):
+            self._matches.put(msg)
+            return
+        if msg.get("type") != "event": return
+        topic, event, data = msg.get("topic", ""), msg.get("event"), msg.get("data") or {}
+        if topic == "rooms":
+            if event == "room_closed": self.rooms.pop(data["id"], None)
+            else: self.rooms[data["id"]] = data
+        elif topic.startswith("room:"):
+            if event == "room_updated":
+                print(f"\n[通知] 房間 {data['id']} 玩家: {', '.join(data['players'])} ({len(data['players'])}/{data.get('max_players', 2)})")
+            elif event == "room_closed":
+                self.subscribed.discard(topic)
+                print(f"\n[通知] 房間 {data['id']} 已關閉")
+        elif topic.startswith("game:"):
+            if event == "game_updated":
+                print(f"\n[通知] 遊戲 {data.get('name')} 已更新至 v{data.get('version')}，下次開房/加入時會自動更新")
+            elif event == "game_deleted":
+                self.subscribed.discard(topic)
+                print(f"\n[通知] 遊戲 {data['id']} 已下架")
+
+    # --- 訂閱 ---
+    def subscribe(self, *topics: str) -> Dict[str, Any]:
+        """訂閱 topic；快照在讀取執行緒套用，確保排在之後的事件之前。"""
+        def apply(resp):
+            for topic, snap in resp["result"].items():
+                if snap is None: continue
+                self.subscribed.add(topic)
+                if topic == "rooms": self.rooms = {r["id"]: r for r in snap}
+        return self.send_req("subscribe", {"topics": list(topics)}, sink=apply)
+
+    def unsubscribe(self, *topics: str) -> Dict[str, Any]:
+        self.subscribed.difference_update(topics)
+        if "rooms" in topics: self.rooms = {}
+        return self.send_req("unsubscribe", {"topics": list(topics)})
+
+    def list_rooms(self) -> List[Dict[str, Any]]:
+        """有訂閱 "rooms" 就直接用本地快取，不必再問 Server。"""
+        if "rooms" in self.subscribed:
+            return sorted(list(self.rooms.values()), key=lambda r: r["id"])
+        return self.send_req("player_list_rooms").get("result", [])
+
+    # --- 快速配對 ---
+    def queue_match(self, game_id: str) -> Dict[str, Any]:
+        while not self._matches.empty(): self._matches.get_nowait()  # 丟掉上一輪殘留的結果
+        return self.send_req("player_queue", {"game_id": game_id})
+
+    def wait_match(self) -> Dict[str, Any]:
+        """等待 Server 推播 match_found / match_failed；Ctrl+C 取消配對。"""
+        try:
+            while True:
+                try:
+                    msg = self._matches.get(timeout=0.5)
+                    break
+                except queue.Empty:
+                    continue
+        except KeyboardInterrupt:
+            if self.send_req("player_dequeue").get("result") is not False:
+                return {"status": "error", "error": "已取消配對"}
+            # 已經從佇列被取出：Server 正在開房，結果馬上會推過來
+            try:
+                msg = self._matches.get(timeout=5)
+            except queue.Empty:
+                return {"status": "error", "error": "已取消配對"}
+        if msg.get("type") == "match_found": return {"status": "ok", "result": msg["result"]}
+        return {"status": "error", "error": msg.get("error")}
 
     def download_game(self, game_id: str, username: str) -> bool:
         print(f"正在請求下載遊戲 {game_id} ...")
-        resp = self.send_req("player_download_req", {"game_id": game_id})
-        
+        user_game_dir = self.download_root / username / game_id
+
+        def receive(resp):
+            file_size = resp["file_size"]
+            filename = resp.get("filename", "game.py")
+            save_path = user_game_dir / filename
+            temp_path = user_game_dir / (filename + ".tmp")
+            user_game_dir.mkdir(parents=True, exist_ok=True)
+            print(f"正在接收 {filename} ({file_size} bytes)...")
+            try:
+                recv_file(self.sock, str(temp_path), file_size)
+                # 原子操作：下載成功才改名，避免壞檔
+                if save_path.exists():
+                    os.remove(save_path)
+                os.rename(temp_path, save_path)
+                print(f"下載完成！位置: {save_path}")
+            except Exception:
+                if temp_path.exists(): os.remove(temp_path)
+                raise
+
+        resp = self.send_req("player_download_req", {"game_id": game_id}, sink=receive)
         if resp.get("status") != "ok":
             print("下載失敗:", resp.get("error"))
             return False
-            
-        file_size = resp["file_size"]
-        filename = resp.get("filename", "game.py")
-        
-        user_game_dir = self.download_root / username / game_id
-        save_path = user_game_dir / filename
-        temp_path = user_game_dir / (filename + ".tmp")
-        
-        user_game_dir.mkdir(parents=True, exist_ok=True)
-        
-        print(f"正在接收 {filename} ({file_size} bytes)...")
-        try:
-            recv_file(self.sock, str(temp_path), file_size)
-            # 原子操作：下載成功才改名，避免壞檔
-            if save_path.exists():
-                os.remove(save_path)
-            os.rename(temp_path, save_path)
-            print(f"下載完成！位置: {save_path}")
-        except Exception as e:
-            print("傳輸中斷或失敗:", e)
-            if temp_path.exists(): os.remove(temp_path)
-            return False
+
+        self.install_sdk(user_game_dir)
 
         print("更新版本紀錄...")
         self.send_req("player_download_game_update_db", {"game_id": game_id})
+        # 之後有新版本或下架時由 Server 推播通知
+        if f"game:{game_id}" not in self.subscribed: self.subscribe(f"game:{game_id}")
         return True
 
+    def download_replay(self, replay_id: str, username: str) -> Optional[Dict[str, Any]]:
+        """下載 replay 檔到 downloads/<user>/replays/；成功回傳 {"path", "game_id"}。"""
+        replay_dir = self.download_root / username / "replays"
+
+        def receive(resp):
+            recv_file(self.sock, str(replay_dir / resp["filename"]), resp["file_size"])
+
+        resp = self.send_req("player_replay", {"replay_id": replay_id}, sink=receive)
+        if resp.get("status") != "ok":
+            print("下載失敗:", resp.get("error"))
+            return None
+        return {"path": replay_dir / resp["filename"], "game_id": str(resp["game_id"])}
+
+    def launch_replay(self, game_id: str, username: str, replay_path: Path, speed: float):
+        """用已下載的遊戲 client 在本地播放 replay (不經過網路)。"""
+        user_game_dir = self.download_root / username / game_id
+        py_files = list(user_game_dir.glob("*.py")) if user_game_dir.exists() else []
+        if not py_files:
+            print("錯誤：找不到遊戲檔案，請先下載此遊戲")
+            return
+        self.install_sdk(user_game_dir)
+        cmd = [
+            sys.executable, str(py_files[0]),
+            "--player", str(username),
+            "--replay", str(replay_path.resolve()),
+            "--speed", str(speed)
+        ]
+        try:
+            game_flags = subprocess.CREATE_NEW_CONSOLE if sys.platform == "win32" else 0
+            subprocess.Popen(cmd, creationflags=game_flags, close_fds=True, shell=False)
+            print("[Lobby] 重播視窗已開啟。")
+        except Exception as e:
+            print(f"啟動失敗: {e}")
+
     def launch_game(self, game_id: str, context: Dict[str, Any]):
         username = context.get("username")
         
@@ -104,6 +300,8 @@ class LobbyClient:
             return
         
         game_script_path = py_files[0]
+        # 舊版下載的遊戲可能還沒有 SDK，啟動前補上
+        self.install_sdk(user_game_dir)
 
         # 3. [Plugin] 啟動獨立聊天室 (如果有安裝且 Server 支援)
         if self.is_plugin_installed(username, "chat") and chat_port:
@@ -146,6 +344,20 @@ class LobbyClient:
             print("[Lobby] 遊戲視窗已開啟。")
         except Exception as e:
             print(f"啟動失敗: {e}")
+
+    def install_sdk(self, game_dir: Path) -> None:
+        """把 gamesdk 放到遊戲目錄 (子資料夾，不影響 *.py 主程式的搜尋)；版本相同就略過。"""
+        target = game_dir / "gamesdk"
+        latest = sdk_version(SDK_DIR)
+        if latest and sdk_version(target) == latest:
+            return
+        try:
+            shutil.rmtree(target, ignore_errors=True)
+            shutil.copytree(SDK_DIR, target, ignore=shutil.ignore_patterns("__pycache__"))
+            print(f"[System] 已安裝 gamesdk {latest}")
+        except OSError as e:
+            print(f"[System] gamesdk 安裝失敗: {e}")
+
     # --- Plugin 管理功能 ---
     def get_plugin_file(self, username: str) -> Path:
         return self.download_root / username / "plugins.json"
@@ -270,8 +482,9 @@ def menu_store(client: LobbyClient, username: str):
         print("2. 檢視遊戲詳細資訊")
         print("3. 下載 / 更新遊戲")
         print("4. 對遊戲評分與留言")
-        print("5. 返回主選單")
-        choice = input_int("請選擇 (1-5): ", 1, 5)
+        print("5. 觀看對局重播")
+        print("6. 返回主選單")
+        choice = input_int("請選擇 (1-6): ", 1, 6)
 
         if choice == 1: # 瀏覽
             resp = client.send_req("player_list_games")
@@ -335,22 +548,51 @@ def menu_store(client: LobbyClient, username: str):
             else:
                 print(f"評分失敗: {resp.get('error')}")
 
-        elif choice == 5:
+        elif choice == 5: # 重播
+            gid = input("遊戲 ID (按 Enter 列出全部): ").strip()
+            resp = client.send_req("player_list_replays", {"game_id": gid} if gid else {})
+            replays = resp.get("result", [])
+            if not replays:
+                print("目前沒有重播紀錄")
+                continue
+            print("ID | 遊戲 | 玩家")
+            print("-------------------------------------")
+            for r in replays:
+                print(f'{r["id"]} | {r["game_id"]} | {", ".join(r.get("players", []))}')
+            rid = input("要觀看的重播 ID: ").strip()
+            speed = input("播放倍速 (預設 1): ").strip()
+            info = client.download_replay(rid, username)
+            if info:
+                try: speed_val = float(speed) if speed else 1.0
+                except ValueError: speed_val = 1.0
+                client.launch_replay(info["game_id"], username, info["path"], speed_val)
+
+        elif choice == 6:
             return # 返回上一層
 
 # --- 子選單 2: 多人大廳 (Lobby) ---
 def menu_lobby(client: LobbyClient, username: str):
+    # 在大廳期間訂閱房間列表，瀏覽時直接用本地快取 (由 Server 推播更新)
+    client.subscribe("rooms")
+    try:
+        _menu_lobby(client, username)
+    finally:
+        client.unsubscribe("rooms")
+
+def _menu_lobby(client: LobbyClient, username: str):
     while True:
         print("\n=== [子選單] 多人大廳 ===")
         print("1. 瀏覽目前房間")
         print("2. 建立新房間")
         print("3. 加入房間")
-        print("4. 返回主選單")
-        choice = input_int("請選擇 (1-4): ", 1, 4)
+        print("4. 觀戰房間")
+        print("5. 快速配對")
+        print("6. 線上玩家")
+        print("7. 返回主選單")
+        choice = input_int("請選擇 (1-7): ", 1, 7)
 
         if choice == 1: # 瀏覽房間
-            resp = client.send_req("player_list_rooms")
-            rooms = resp.get("result", [])
+            rooms = client.list_rooms()
             show_rooms(rooms)
 
         elif choice == 2: # 建立房間
@@ -373,14 +615,14 @@ def menu_lobby(client: LobbyClient, username: str):
             if resp2.get("status") == "ok":
                 room = resp2["result"]
                 print(f"房間建立成功 (ID: {room['id']})")
+                client.subscribe(f"room:{room['id']}")  # 有人加入時會收到通知
                 context = room.copy(); context["username"] = username
                 client.launch_game(gid, context)
             else:
                 print("錯誤:", resp2.get("error"))
 
         elif choice == 3: # 加入房間
-            resp = client.send_req("player_list_rooms")
-            rooms = resp.get("result", [])
+            rooms = client.list_rooms()
             show_rooms(rooms)
             if not rooms: continue
 
@@ -402,12 +644,75 @@ def menu_lobby(client: LobbyClient, username: str):
                 room = resp2["result"]
                 gid = str(room["game_id"])
                 print(f"已加入房間，遊戲ID: {gid}")
+                client.subscribe(f"room:{room['id']}")
+                context = room.copy(); context["username"] = username
+                client.launch_game(gid, context)
+            else:
+                print("錯誤:", resp2.get("error"))
+
+        elif choice == 4: # 觀戰
+            rooms = client.list_rooms()
+            show_rooms(rooms)
+            if not rooms: continue
+
+            rid = input("要觀戰的房間 ID: ").strip()
+            resp2 = client.send_req("player_spectate_room", {"room_id": rid})
+            if resp2.get("status") == "error" and resp2.get("error") == "UPDATE_REQUIRED":
+                required_gid = str(resp2.get("game_id"))
+                print(f"\n[系統] 版本過舊，開始強制更新...")
+                if client.download_game(required_gid, username):
+                    resp2 = client.send_req("player_spectate_room", {"room_id": rid})
+                else:
+                    print("[系統] 更新失敗。")
+                    continue
+
+            if resp2.get("status") == "ok":
+                room = resp2["result"]
+                gid = str(room["game_id"])
+                print(f"開始觀戰房間 {room['id']}")
+                # 遊戲 client 連到觀戰 port，Server 會給 Spectator 角色
                 context = room.copy(); context["username"] = username
+                context["game_port"] = room.get("spectate_port")
                 client.launch_game(gid, context)
             else:
                 print("錯誤:", resp2.get("error"))
 
-        elif choice == 4:
+        elif choice == 5: # 快速配對
+            resp = client.send_req("player_list_games")
+            if resp.get("status") == "ok": show_games(resp.get("result", []))
+
+            gid = input("要配對的遊戲 ID: ").strip()
+            resp2 = client.queue_match(gid)
+            if resp2.get("status") == "error" and resp2.get("error") == "UPDATE_REQUIRED":
+                print("\n[系統] 版本過舊，開始強制更新...")
+                if client.download_game(gid, username):
+                    resp2 = client.queue_match(gid)
+                else:
+                    print("[系統] 更新失敗。")
+                    continue
+            if resp2.get("status") != "ok":
+                print("錯誤:", resp2.get("error")); continue
+
+            print(f"配對中 (rating {resp2['result']['rating']})... 按 Ctrl+C 取消")
+            resp3 = client.wait_match()
+            if resp3.get("status") == "ok":
+                room = resp3["result"]
+                print(f"配對成功！房間 {room['id']}，玩家: {', '.join(room['players'])}")
+                client.subscribe(f"room:{room['id']}")
+                context = room.copy(); context["username"] = username
+                client.launch_game(gid, context)
+            else:
+                print(resp3.get("error"))
+
+        elif choice == 6: # 線上玩家
+            resp = client.send_req("player_list_online")
+            if resp.get("status") == "ok":
+                names = resp["result"]
+                print(f"線上玩家 ({len(names)}): " + ", ".join(names[:50]) + (" ..." if len(names) > 50 else ""))
+            else:
+                print(resp.get("error"))
+
+        elif choice == 7:
             return
 
 # --- 主選單 ---
@@ -430,6 +735,7 @@ def player_session_menu(client: LobbyClient, username: str) -> None:
             plugin_menu(client, username) # 呼叫先前寫好的 plugin_menu
         else:
             client.send_req("logout")
+            client.subscribed.clear(); client.rooms = {}
             return
 
 def main_menu():
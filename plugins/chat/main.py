@@ -1,39 +1,24 @@
 # plugins/Chat/main.py
 # 獨立聊天室視窗 (Tkinter)
 
-import socket
-import threading
-import struct
-import json
 import argparse
 import sys
 import tkinter as tk
 from tkinter import scrolledtext
 import os
+from pathlib import Path
 
-def send_frame(sock, obj):
-    try:
-        data = json.dumps(obj).encode("utf-8")
-        header = struct.pack("!I", len(data))
-        sock.sendall(header + data)
-    except: pass
+# 共用 gamesdk (取代原本只 recv 一次、長訊息會被截斷的 recv_frame)
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT / "common") not in sys.path:
+    sys.path.append(str(ROOT / "common"))
 
-def recv_frame(sock):
-    try:
-        header = sock.recv(4)
-        if len(header) < 4: return None
-        (length,) = struct.unpack("!I", header)
-        body = sock.recv(length)
-        if len(body) < length: return None
-        return json.loads(body.decode("utf-8"))
-    except: return None
+from gamesdk import GameConnection, DISCONNECTED
 
 class ChatClient:
     def __init__(self, host, port, username):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            self.sock.connect((host, port))
-        except:
+        self.conn = GameConnection(host, port, retries=3)
+        if not self.conn.connect():
             sys.exit(0) # 連不上直接關
             
         self.username = username
@@ -51,7 +36,9 @@ class ChatClient:
         self.entry.bind("<Return>", self.send_msg)
         
         # 啟動接收執行緒
-        threading.Thread(target=self.recv_loop, daemon=True).start()
+        self.conn.on_default(self.on_message)
+        self.conn.on(DISCONNECTED, self.on_disconnected)
+        self.conn.start()
         
         self.root.mainloop()
 
@@ -59,24 +46,20 @@ class ChatClient:
         msg = self.entry.get()
         if msg:
             payload = {"sender": self.username, "msg": msg}
-            send_frame(self.sock, payload)
+            self.conn.send(payload)
             self.entry.delete(0, tk.END)
 
-    def recv_loop(self):
-        while True:
-            data = recv_frame(self.sock)
-            if not data: 
-                break # Server 斷線 -> 跳出迴圈
-            
-            sender = data.get("sender", "Unknown")
-            msg = data.get("msg", "")
-            
-            self.text_area.config(state='normal')
-            self.text_area.insert(tk.END, f"[{sender}]: {msg}\n")
-            self.text_area.see(tk.END)
-            self.text_area.config(state='disabled')
+    def on_message(self, data):
+        sender = data.get("sender", "Unknown")
+        msg = data.get("msg", "")
         
-        # 斷線後，強制殺死整個 Process，關閉視窗
+        self.text_area.config(state='normal')
+        self.text_area.insert(tk.END, f"[{sender}]: {msg}\n")
+        self.text_area.see(tk.END)
+        self.text_area.config(state='disabled')
+
+    def on_disconnected(self, data):
+        # Server 斷線後，強制殺死整個 Process，關閉視窗
         os._exit(0)
 
 if __name__ == "__main__":
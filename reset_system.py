@@ -39,14 +39,15 @@ def reset_system():
     print("=== 開始重置遊戲商城系統 ===")
 
     # 1. 刪除資料庫檔案 (Reset DB)
-    db_file = root /"db_data.json"
-    if db_file.exists():
+    # 含 SQLite 引擎的 db_data.sqlite3* 與 follower 的 db_data.<port>.json
+    db_files = sorted(root.glob("db_data*"))
+    for db_file in db_files:
         try:
             os.remove(db_file)
             print(f"[OK] 資料庫已刪除: {db_file}")
         except Exception as e:
             print(f"[錯誤] 無法刪除資料庫: {e}")
-    else:
+    if not db_files:
         print("[INFO] 未發現資料庫檔案，無需刪除。")
 
     # 2. 清空 Server 端的上架遊戲 (Reset Uploaded Games)
@@ -54,6 +55,9 @@ def reset_system():
     server_storage = root / "server" / "storage"
     clean_directory(server_storage, "Server Storage (上架遊戲庫)")
 
+    # 2.5 清空對局重播紀錄
+    clean_directory(root / "server" / "replays", "Server Replays (對局重播)")
+
     # 3. 清空 Player 端的下載遊戲 (Reset Player Downloads)
 
     player_downloads = root / "downloads"
@@ -66,8 +70,8 @@ def reset_system():
 
 if __name__ == "__main__":
     print("警告：此操作將會永久刪除以下資料：")
-    print("1. 所有使用者帳號、遊戲紀錄、評分 (db_data.json)")
-    print("2. 伺服器端所有已上架的遊戲檔案 (server/storage)")
+    print("1. 所有使用者帳號、遊戲紀錄、評分 (db_data.json / db_data.sqlite3)")
+    print("2. 伺服器端所有已上架的遊戲檔案 (server/storage) 與對局重播 (server/replays)")
     print("3. 玩家端所有已下載的遊戲檔案 (player_client/downloads)")
     print("-" * 40)
     
@@ -0,0 +1,127 @@
+# server/auth.py
+#
+# Lobby 的帳號驗證
+# - 密碼以 PBKDF2-SHA256 + 隨機 salt 存放 ("pbkdf2_sha256$<次數>$<salt>$<hash>")；舊資料的明文密碼仍可登入，
+#   登入成功後由呼叫端換成雜湊 (needs_rehash)
+# - 雜湊在處理該連線的執行緒裡算 (hashlib 計算時會放開 GIL)，HASH_SLOTS 限制同時計算的數量，
+#   大量登入時不會把所有 CPU 都吃掉
+# - 登入成功發一個 HMAC 簽章的 session token，斷線重連時用 resume 接回身分，不必查 DB、也不必再算一次雜湊
+# - UserCache：行程內的 LRU 快取 (帳號 -> 密碼雜湊)，重複登入不必每次都查 DB
+
+import base64
+import collections
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from server import tracing
+
+HASH_ALGO = "pbkdf2_sha256"
+HASH_ITERATIONS = 200_000
+SALT_BYTES = 16
+HASH_SLOTS = threading.BoundedSemaphore(max(1, (os.cpu_count() or 2) // 2))
+TOKEN_TTL = 12 * 3600.0     # token 有效秒數；resume 成功會換發新的
+USER_CACHE_TTL = 300.0
+USER_CACHE_SIZE = 10000
+
+
+def _b64(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _unb64(s: str) -> bytes:
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
+
+@tracing.traced
+def _pbkdf2(password: str, salt: bytes, iterations: int) -> bytes:
+    with HASH_SLOTS:
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+
+
+def hash_password(password: str) -> str:
+    salt = os.urandom(SALT_BYTES)
+    return f"{HASH_ALGO}${HASH_ITERATIONS}${_b64(salt)}${_b64(_pbkdf2(password, salt, HASH_ITERATIONS))}"
+
+
+def verify_password(password: str, stored: str) -> bool:
+    """stored 不是雜湊格式時視為舊資料的明文密碼。"""
+    parts = stored.split("$")
+    if len(parts) != 4 or parts[0] != HASH_ALGO:
+        return hmac.compare_digest(password.encode(), stored.encode())
+    try:
+        iterations, salt, want = int(parts[1]), _unb64(parts[2]), _unb64(parts[3])
+    except ValueError:
+        return False
+    return hmac.compare_digest(_pbkdf2(password, salt, iterations), want)
+
+
+def needs_rehash(stored: str) -> bool:
+    parts = stored.split("$")
+    return len(parts) != 4 or parts[0] != HASH_ALGO or parts[1] != str(HASH_ITERATIONS)
+
+
+def new_session_id() -> str:
+    return secrets.token_hex(8)
+
+
+def new_secret() -> str:
+    return secrets.token_hex(32)
+
+
+def sign_token(secret: bytes, user_type: str, username: str, sid: str, ttl: float = TOKEN_TTL) -> str:
+    """<payload>.<簽章>；payload 是 {"t": 身分, "u": 帳號, "sid": 登入的 session id, "exp": 到期時間}。"""
+    payload = _b64(json.dumps({"t": user_type, "u": username, "sid": sid, "exp": int(time.time() + ttl)},
+                              separators=(",", ":")).encode())
+    return f"{payload}.{_b64(hmac.new(secret, payload.encode(), hashlib.sha256).digest())}"
+
+
+def verify_token(secret: bytes, token: Any) -> Optional[Dict[str, Any]]:
+    """簽章正確且未過期才回傳 payload，否則 None。"""
+    if not isinstance(token, str) or token.count(".") != 1: return None
+    payload, sig = token.split(".")
+    want = _b64(hmac.new(secret, payload.encode(), hashlib.sha256).digest())
+    if not hmac.compare_digest(sig.encode(), want.encode()): return None
+    try:
+        claims = json.loads(_unb64(payload))
+    except ValueError:
+        return None
+    if not isinstance(claims, dict) or claims.get("exp", 0) < time.time(): return None
+    return claims
+
+
+class UserCache:
+    """(身分, 帳號) -> 密碼雜湊，最多 size 筆 (LRU)，每筆 ttl 秒後失效。只快取存在的帳號。"""
+
+    def __init__(self, size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.items: "collections.OrderedDict[Tuple[str, str], Tuple[float, str]]" = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_type: str, username: str) -> Optional[str]:
+        key = (user_type, username)
+        with self.lock:
+            item = self.items.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None: del self.items[key]
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, user_type: str, username: str, stored: str) -> None:
+        key = (user_type, username)
+        with self.lock:
+            self.items[key] = (time.monotonic() + self.ttl, stored)
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
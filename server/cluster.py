@@ -0,0 +1,97 @@
+# server/cluster.py
+#
+# 本機多 Lobby 測試環境：
+#   db_server (9900) + M 個 db follower (9901..) + state_server (9950)
+#   + N 個 main_server (9801..) + round-robin TCP 負載平衡器 (9800)
+# 玩家 / 開發者 client 照舊連 9800，每條連線會被分到不同的 Lobby instance；Lobby 的讀取分散到 db follower。
+#
+#   python server/cluster.py --lobbies 3 --db-replicas 2
+#
+# Ctrl+C 會一併關閉所有子行程。
+
+import argparse
+import itertools
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+BALANCER_PORT = 9800
+FIRST_LOBBY_PORT = 9801
+FIRST_DB_REPLICA_PORT = 9901
+
+
+def pipe(src: socket.socket, dst: socket.socket) -> None:
+    try:
+        while True:
+            data = src.recv(65536)
+            if not data: break
+            dst.sendall(data)
+    except OSError:
+        pass
+    finally:
+        try: dst.shutdown(socket.SHUT_WR)
+        except OSError: pass
+
+
+def run_balancer(port: int, backends) -> None:
+    """每條新連線輪流轉給下一個 Lobby (連不上就換下一個)。"""
+    ring = itertools.cycle(backends)
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(("0.0.0.0", port))
+        s.listen(128)
+        print(f"[Cluster] balancer on :{port} -> {', '.join(str(p) for p in backends)}")
+        while True:
+            client, _ = s.accept()
+            for _ in range(len(backends)):
+                backend_port = next(ring)
+                try:
+                    upstream = socket.create_connection(("127.0.0.1", backend_port))
+                    break
+                except OSError:
+                    continue
+            else:
+                client.close()
+                continue
+            threading.Thread(target=pipe, args=(client, upstream), daemon=True).start()
+            threading.Thread(target=pipe, args=(upstream, client), daemon=True).start()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lobbies", type=int, default=2)
+    parser.add_argument("--db-replicas", type=int, default=0)
+    parser.add_argument("--port", type=int, default=BALANCER_PORT)
+    args = parser.parse_args()
+
+    py = sys.executable
+    procs = [subprocess.Popen([py, str(ROOT / "server" / "db_server.py")], cwd=ROOT),
+             subprocess.Popen([py, str(ROOT / "server" / "state_server.py")], cwd=ROOT)]
+    time.sleep(0.5)
+    replica_args = []
+    for i in range(args.db_replicas):
+        p = FIRST_DB_REPLICA_PORT + i
+        procs.append(subprocess.Popen([py, str(ROOT / "server" / "db_server.py"), "--port", str(p),
+                                       "--follow", "127.0.0.1"], cwd=ROOT))
+        replica_args += ["--db-replica", f"127.0.0.1:{p}"]
+    backends = [FIRST_LOBBY_PORT + i for i in range(args.lobbies)]
+    for p in backends:
+        procs.append(subprocess.Popen([py, str(ROOT / "server" / "main_server.py"), "--port", str(p),
+                                       "--state", "127.0.0.1"] + replica_args, cwd=ROOT))
+    time.sleep(1.0)
+    try:
+        run_balancer(args.port, backends)
+    except KeyboardInterrupt:
+        print("\n[Cluster] stopping...")
+    finally:
+        for p in procs: p.terminate()
+        for p in procs: p.wait()
+
+
+if __name__ == "__main__":
+    main()
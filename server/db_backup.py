@@ -0,0 +1,156 @@
+# server/db_backup.py
+#
+# db_server 線上備份的操作工具
+# - backup  : 請執行中的 db_server 做一次備份 (預設增量；--full 強制完整快照)，不需停機
+# - list    : 列出備份目錄裡的 base / ops
+# - restore : 從備份目錄還原出一個資料檔：取時間點之前最後一份 base，再依序重放之後的 mutation log，
+#             停在 --to 指定的時間 (省略則還原到最後一筆)。輸出 json 或 sqlite 引擎的資料檔
+# - 還原前請先停掉 db_server (或輸出到別的路徑再換過去)
+#
+#   python server/db_backup.py backup [--full] [--host 127.0.0.1] [--port 9900]
+#   python server/db_backup.py list [--dir backups]
+#   python server/db_backup.py restore [--dir backups] [--to "2026-10-19 12:00:00"] [--engine json|sqlite] [--dst PATH] [--force]
+
+import argparse
+import json
+import os
+import socket
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from common.protocol import send_frame, recv_frame  # type: ignore
+from server.db_server import BACKUP_DIR, DB_FILE, PORT, SQLITE_FILE, SimpleDB, SQLiteDB, read_manifest
+
+
+def _parse_time(s: str) -> float:
+    """epoch 秒數，或 ISO 格式的本地時間 (2026-10-19 12:00:00)。"""
+    try:
+        return float(s)
+    except ValueError:
+        return datetime.fromisoformat(s).timestamp()
+
+
+def _fmt(ts: float) -> str:
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+
+def _read_lines(path: Path) -> Iterator[Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip(): yield json.loads(line)
+
+
+def plan(entries: List[Dict[str, Any]], until: Optional[float]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """選出時間點之前最後一份 base，以及接在它後面、seq 連續的 ops。"""
+    bases = [i for i, e in enumerate(entries) if e["type"] == "base" and (until is None or e["time"] <= until)]
+    if not bases:
+        raise SystemExit("[Restore] 找不到該時間點之前的完整快照 (base)")
+    base = entries[bases[-1]]
+    chain, seq = [], base["seq"]
+    for e in entries[bases[-1] + 1:]:
+        if e["epoch"] != base["epoch"] or e["type"] != "ops": break  # 之後換了 epoch (重啟 / 升級)，另有新的 base
+        if until is not None and e["first_ts"] > until: break
+        if e["from_seq"] != seq + 1:
+            print(f"[Restore] ops 不連續 (預期 seq {seq + 1}，{e['file']} 從 {e['from_seq']} 開始)，只還原到 seq {seq}")
+            break
+        chain.append(e)
+        seq = e["seq"]
+    return base, chain
+
+
+def restore(backup_dir: str, until: Optional[float], engine: str, dst: str) -> Dict[str, Any]:
+    src = Path(backup_dir)
+    base, chain = plan(read_manifest(src), until)
+    lines = _read_lines(src / base["file"])
+    next(lines)  # header
+    data: Dict[str, Any] = {}
+    for d in lines:
+        data.setdefault(d["col"], {}).update(d["records"])
+
+    # 在記憶體裡用 SimpleDB 重放 (與 follower 套用 mutation 的方式相同)
+    work = dst + ".restoring"
+    if os.path.exists(work): os.remove(work)
+    db = SimpleDB(work)
+    db.set_durability("async")
+    db.replace_all(data)
+    applied, last_ts = 0, base["time"]
+    for e in chain:
+        for seq, op in _read_lines(src / e["file"]):
+            if until is not None and op["ts"] > until: break
+            db.apply(op)
+            applied, last_ts = applied + 1, op["ts"]
+        else:
+            continue
+        break
+
+    if engine == "sqlite":
+        out = SQLiteDB(dst)
+        try: out.import_data(db.dump())
+        finally: out.close()
+    else:
+        db.save()
+        os.replace(work, dst)
+    return {"base": base["file"], "base_seq": base["seq"], "ops": applied, "seq": base["seq"] + applied, "as_of": last_ts}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("backup", help="請執行中的 db_server 做一次線上備份")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=PORT)
+    p.add_argument("--full", action="store_true", help="強制完整快照")
+    p = sub.add_parser("list", help="列出備份")
+    p.add_argument("--dir", default=str(BACKUP_DIR))
+    p = sub.add_parser("restore", help="還原到某個時間點")
+    p.add_argument("--dir", default=str(BACKUP_DIR))
+    p.add_argument("--to", default=None, help="epoch 秒數或 ISO 時間；省略 = 最後一筆")
+    p.add_argument("--engine", choices=("json", "sqlite"), default="json")
+    p.add_argument("--dst", default=None, help="輸出的資料檔 (預設 db_data.json / db_data.sqlite3)")
+    p.add_argument("--force", action="store_true", help="目的檔已存在時先刪除")
+    args = parser.parse_args()
+
+    if args.cmd == "backup":
+        with socket.create_connection((args.host, args.port), timeout=600) as s:
+            send_frame(s, {"action": "backup", "full": args.full})
+            resp = recv_frame(s)
+        if not resp or resp.get("status") != "ok":
+            sys.exit(f"[Backup] failed: {resp}")
+        r = resp["result"]
+        if r["type"] == "none":
+            print(f"[Backup] nothing new since last backup (seq {r['seq']})")
+        else:
+            print(f"[Backup] {r['file']}: {r['count']} {'records' if r['type'] == 'base' else 'ops'}, "
+                  f"lock held {r['lock_ms']:.1f}ms, total {r['elapsed_ms']:.0f}ms")
+        return
+
+    if args.cmd == "list":
+        for e in read_manifest(args.dir):
+            if e["type"] == "base":
+                print(f"base  {_fmt(e['time'])}  epoch {e['epoch'][:8]}  seq {e['seq']:<8}  {e['file']}")
+            else:
+                print(f"ops   {_fmt(e['first_ts'])} ~ {_fmt(e['last_ts'])}  seq {e['from_seq']}-{e['seq']}  {e['file']}")
+        return
+
+    dst = args.dst or str(SQLITE_FILE if args.engine == "sqlite" else DB_FILE)
+    if os.path.exists(dst):
+        if not args.force:
+            sys.exit(f"[Restore] 目的檔 {dst} 已存在 (加 --force 覆蓋)")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(dst + suffix): os.remove(dst + suffix)
+    t0 = time.perf_counter()
+    r = restore(args.dir, _parse_time(args.to) if args.to else None, args.engine, dst)
+    print(f"[Restore] {r['base']} + {r['ops']} ops -> seq {r['seq']} (as of {_fmt(r['as_of'])})")
+    print(f"[Restore] done in {time.perf_counter() - t0:.2f}s -> {dst}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# server/db_migrate.py
+#
+# 把 json 引擎的資料檔 (db_data.json) 轉成 sqlite 引擎的資料檔 (db_data.sqlite3)
+# - id 與 _counters 原樣保留，轉完即可用 `python server/db_server.py --engine sqlite` 啟動
+# - 舊資料若有違反唯一索引的重複紀錄，只保留第一筆 (與 SimpleDB 載入時的行為相同)
+# - 轉換前請先停掉 db_server
+#
+#   python server/db_migrate.py [--src db_data.json] [--dst db_data.sqlite3] [--force]
+
+import argparse
+import json
+import os
+import time
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from server.db_server import DB_FILE, SQLITE_FILE, SQLiteDB
+
+
+def migrate(src: str, dst: str) -> dict:
+    with open(src, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    db = SQLiteDB(dst)
+    try:
+        return db.import_data(data)
+    finally:
+        db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--src", default=str(DB_FILE))
+    parser.add_argument("--dst", default=str(SQLITE_FILE))
+    parser.add_argument("--force", action="store_true", help="目的檔已存在時先刪除")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.src):
+        sys.exit(f"[Migrate] 找不到來源檔 {args.src}")
+    if os.path.exists(args.dst):
+        if not args.force:
+            sys.exit(f"[Migrate] 目的檔 {args.dst} 已存在 (加 --force 覆蓋)")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.dst + suffix): os.remove(args.dst + suffix)
+
+    t0 = time.perf_counter()
+    counts = migrate(args.src, args.dst)
+    for col, n in counts.items():
+        print(f"[Migrate] {col}: {n} records")
+    print(f"[Migrate] done in {time.perf_counter() - t0:.2f}s -> {args.dst}")
+
+
+if __name__ == "__main__":
+    main()
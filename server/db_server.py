@@ -3,13 +3,43 @@
 # 簡易 Database Server（獨立行程）
 # - TCP + JSON + Length-Prefixed Framing
 # - 所有資料操作一律走 Socket API
-# - 底層用單一 JSON 檔持久化
+# - 儲存引擎二選一 (--engine)：
+#   json   : SimpleDB，單一 JSON 檔，啟動時整份載入記憶體 (預設)
+#   sqlite : SQLiteDB，SQLite WAL 模式，每個 collection 一張表，資料留在磁碟上
+#   舊的 JSON 檔可用 server/db_migrate.py 轉成 SQLite
+# - 持久化策略 (--durability)：
+#   sync  : 每個寫入在 LOCK 內落地 (fsync) 後才回覆
+#   group : 寫入只改記憶體，GroupCommitter 每 --group-ms 毫秒或累積 --group-ops 筆就一起落地一次，
+#           同一批的所有寫入都等這次落地完成才回覆 (預設；與 sync 一樣不會回覆了卻沒存到)
+#   async : 同 group 的批次落地，但不等落地就回覆 (當機可能遺失最後一批)
+# - 複寫 (--follow host[:port])：follower 向 primary 送 replicate，先收一份完整 snapshot，
+#   之後持續收 mutation log (同樣走 Length-Prefixed Framing)，在記憶體保留一份即時副本，只服務 read / list / query。
+#   primary 掛掉時可送 {"action": "promote"} (或 --auto-promote 秒數) 把 follower 升為 primary
+# - 線上備份 ({"action": "backup"} 或 --backup-every 秒數)：完整快照 + 之後的 mutation log 增量，寫到 --backup-dir；
+#   取快照只在 LOCK 內複製對照表 (copy-on-write)，寫檔期間照常服務。server/db_backup.py restore 可還原到任一時間點
+# - 指標 (--metrics-port)：各 action 的處理時間、等 LOCK 的時間、等落地的時間與連線數，
+#   在 127.0.0.1:<port>/metrics 以文字輸出 (server/metrics.py)；沒指定就不收集
+# - 追蹤 (--trace-file)：request 帶 "trace" / "parent" (main_server 轉送 LobbyClient 的 trace id) 時，
+#   把處理時間、等 LOCK、等落地記成 span 寫到 trace 檔 (server/tracing.py，用 server/trace_report.py 分析)
+# - 診斷 (--profiling)：{"action": "profile"} 對所有執行緒取樣成 collapsed stacks，或對某個 action 掛 cProfile (server/profiler.py)
+# - log 走 server/log.py 的非同步佇列 (--log-level / --log-format / --log-file)；
+#   每次寫入、每條連線的訊息是 debug，預設不輸出，也不會在 LOCK 內寫終端機
 
+import argparse
+import bisect
+import collections
+import contextlib
+import itertools
 import json
 import os
+import re
+import signal
 import socket
+import sqlite3
 import threading
-from typing import Any, Dict, List, Optional
+import time
+import uuid
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 # 讓 `from common.protocol import ...` 能找到模組
 import sys
@@ -19,12 +49,180 @@ ROOT = Path(__file__).resolve().parent.parent
 if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))
 
-from common.protocol import send_frame, recv_frame  # type: ignore
+from common.protocol import encode_frame, send_frame, recv_frame  # type: ignore
+from server import metrics
+from server import tracing
+from server import profiler
+from server import log
 
 HOST = "0.0.0.0"
 PORT = 9900
 DB_FILE = ROOT / "db_data.json"
+SQLITE_FILE = ROOT / "db_data.sqlite3"
+DEFAULT_COLLECTIONS = ("developers", "players", "games", "player_games", "ratings", "replays")
 LOCK = threading.Lock()
+DURABILITY = "group"
+GROUP_COMMIT_MS = 5.0   # 一批最多等多久 (所有寫入者都在等回覆時會提早落地)
+GROUP_COMMIT_OPS = 256
+
+# 複寫
+READ_ACTIONS = ("read", "list", "query")
+REPL_LOG_SIZE = 10000      # primary 在記憶體保留最近幾筆 mutation；follower 落後更多就重送 snapshot
+REPL_HEARTBEAT = 1.0       # 沒有新寫入時，primary 每隔幾秒送一個空批次
+REPL_TIMEOUT = 3.0         # follower 超過幾秒沒收到任何東西就視為與 primary 斷線
+REPLICA_WAIT = 0.5         # 帶 min_seq 的讀取最多等 follower 追上多久，逾時回 stale
+ROLE = "primary"           # primary | follower
+EPOCH = uuid.uuid4().hex   # primary 每次啟動 / 升級換一個；seq 只在同一個 epoch 內有意義
+REPL_EPOCH: Optional[str] = None  # follower：目前副本來自哪個 epoch
+REPL_COND = threading.Condition() # primary：有新寫入；follower：套用了新的 mutation
+
+# 線上備份
+BACKUP_DIR = ROOT / "backups"
+BACKUP_FULL_OPS = 100000   # 距離上一份完整快照超過這麼多筆 mutation 就改做完整快照，還原時不必重放太長的 log
+BACKUP_CHUNK = 1000        # base 每行最多幾筆紀錄；json.dumps 一次呼叫不會釋放 GIL，切小才不會卡住其他請求
+_BACKUP_LOCK = threading.Lock()
+
+# 唯一索引：collection -> 欄位組合。create / update 會拒絕重複值，
+# create_if_absent / upsert 用它在一次請求內完成「查詢 + 建立」
+UNIQUE_KEYS: Dict[str, Tuple[str, ...]] = {
+    "developers": ("username",),
+    "players": ("username",),
+    "player_games": ("player", "game_id"),
+}
+
+
+# 排序索引：collection -> 欄位。以 bisect 維護 [(型別, 值, id)] 的有序陣列，
+# 讓 query 的 $gt / $gte / $lt / $lte / $in / $prefix 與等值條件不必掃整個 collection
+SORTED_KEYS: Dict[str, Tuple[str, ...]] = {
+    "games": ("max_players", "avg_score"),
+    "ratings": ("game_id", "created"),
+    "replays": ("game_id", "created"),
+}
+RANGE_OPS = ("$gt", "$gte", "$lt", "$lte", "$in", "$prefix", "$ne")
+_ID_MAX = "\U0010ffff"  # 比任何 id 都大，用來取某個值的右界
+
+
+def _rank(v: Any) -> Optional[int]:
+    """索引只收數字 (含 bool，與 Python 的 True == 1 一致) 與字串；兩者分開排，其餘型別 (None、list...) 不進索引。"""
+    if isinstance(v, (int, float)): return 0
+    if isinstance(v, str): return 1
+    return None
+
+
+def _match(value: Any, cond: Any) -> bool:
+    """cond 是純值時比較相等；是 {"$op": ...} 時逐一檢查，型別無法比較視為不符合。"""
+    if not (isinstance(cond, dict) and cond and all(k in RANGE_OPS for k in cond)):
+        return value == cond
+    try:
+        for op, arg in cond.items():
+            if op == "$ne":
+                if value == arg: return False
+            elif op == "$in":
+                if value not in arg: return False
+            elif value is None:
+                return False
+            elif op == "$gt":
+                if not value > arg: return False
+            elif op == "$gte":
+                if not value >= arg: return False
+            elif op == "$lt":
+                if not value < arg: return False
+            elif op == "$lte":
+                if not value <= arg: return False
+            elif op == "$prefix":
+                if not (isinstance(value, str) and value.startswith(arg)): return False
+    except TypeError:
+        return False
+    return True
+
+
+class Conflict(Exception):
+    """違反唯一索引。"""
+
+
+def _fsync_dir(path: str | os.PathLike[str]) -> None:
+    """rename / 新建檔案後 fsync 所在目錄，讓目錄項目本身也落地。"""
+    if not hasattr(os, "O_DIRECTORY"): return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try: os.fsync(fd)
+    finally: os.close(fd)
+
+
+_MISSING = object()  # 紀錄沒有這個欄位 (與值為 None 區分)
+INTERN_MAX = 32      # 不超過這個長度的字串值會 intern (帳號、game_id、版本號這類大量重複的值共用同一個物件)
+
+
+class Collection:
+    """
+    SimpleDB 的單一 collection：記憶體內不存 dict，而是「欄位表 + 每筆一個 tuple」。
+    - fields 依第一次出現的順序累加，舊的 tuple 比欄位表短時，缺的部分視為沒有該欄位
+    - id 就是 rows 的 key，不另外存在 tuple 裡
+    - 對外 (get / values / items / []) 一律回傳新建立的 dict，修改它不會影響 DB
+    """
+
+    __slots__ = ("fields", "pos", "rows")
+
+    def __init__(self, records: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.fields: List[str] = []
+        self.pos: Dict[str, int] = {}
+        self.rows: Dict[str, tuple] = {}
+        for rec_id, rec in (records or {}).items():
+            self[str(rec_id)] = rec
+
+    def _pack(self, rec: Dict[str, Any]) -> tuple:
+        for k in rec:
+            if k != "id" and k not in self.pos:
+                self.pos[k] = len(self.fields)
+                self.fields.append(sys.intern(k))
+        row = [_MISSING] * len(self.fields)
+        for k, v in rec.items():
+            if k == "id": continue
+            if isinstance(v, str) and len(v) <= INTERN_MAX: v = sys.intern(v)
+            row[self.pos[k]] = v
+        while row and row[-1] is _MISSING: row.pop()
+        return tuple(row)
+
+    def _unpack(self, rec_id: str, row: tuple) -> Dict[str, Any]:
+        rec = {f: v for f, v in zip(self.fields, row) if v is not _MISSING}
+        rec["id"] = rec_id
+        return rec
+
+    def value(self, rec_id: str, row: tuple, field: str) -> Any:
+        """等同 rec.get(field)，但不必先組出 dict。"""
+        if field == "id": return rec_id
+        i = self.pos.get(field)
+        if i is None or i >= len(row) or row[i] is _MISSING: return None
+        return row[i]
+
+    def scan(self, ids: Optional[Iterable[str]] = None) -> Iterator[Tuple[str, tuple]]:
+        if ids is None: return iter(self.rows.items())
+        return ((i, self.rows[i]) for i in ids)
+
+    def __len__(self) -> int: return len(self.rows)
+    def __contains__(self, rec_id: object) -> bool: return rec_id in self.rows
+    def __iter__(self) -> Iterator[str]: return iter(self.rows)
+    def __getitem__(self, rec_id: str) -> Dict[str, Any]: return self._unpack(rec_id, self.rows[rec_id])
+    def __setitem__(self, rec_id: str, rec: Dict[str, Any]) -> None: self.rows[rec_id] = self._pack(rec)
+    def __delitem__(self, rec_id: str) -> None: del self.rows[rec_id]
+
+    def get(self, rec_id: str) -> Optional[Dict[str, Any]]:
+        row = self.rows.get(rec_id)
+        return None if row is None else self._unpack(rec_id, row)
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        return ((i, self._unpack(i, row)) for i, row in self.rows.items())
+
+    def values(self) -> Iterator[Dict[str, Any]]:
+        return (self._unpack(i, row) for i, row in self.rows.items())
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return dict(self.items())
+
+    def copy(self) -> "Collection":
+        """copy-on-write 快照：tuple 不可變，只需複製欄位表與 id -> tuple 的對照 (不複製紀錄本身)。"""
+        c = Collection()
+        c.fields, c.pos, c.rows = list(self.fields), dict(self.pos), dict(self.rows)
+        return c
 
 
 class SimpleDB:
@@ -32,6 +230,10 @@ class SimpleDB:
         self.path = str(path)
         # 一開始就確保有 _counters
         self.data: Dict[str, Any] = {"_counters": {}}
+        self.write_seq = 0     # 每個寫入 +1；GroupCommitter 用它判斷哪些寫入已落地
+        self.autosave = True   # durability=sync：每個寫入立刻 save
+        self.oplog: Deque[Tuple[int, Dict[str, Any]]] = collections.deque(maxlen=REPL_LOG_SIZE)  # (write_seq, op)
+        self.repl_seq = 0      # follower：已套用到 primary 的哪個 seq
         #print(f"[DB] __init__ initial self.data['_counters'] type: {type(self.data['_counters'])}")
         self.load()
         #print(f"[DB] __init__ after load self.data['_counters'] type: {type(self.data['_counters'])}")
@@ -45,49 +247,217 @@ class SimpleDB:
                 #print(f"[DB] load from file, self.data content: {self.data}")
                 #print(f"[DB] load from file, self.data['_counters'] type: {type(self.data['_counters']) if '_counters' in self.data else 'not present'}")
             except Exception as e:
-                print(f"[WARN] load DB failed: {e}")
+                log.warn("DB", "load failed, starting empty", path=self.path, error=e)
                 self.data = {}
-                print(f"[DB] load failed, self.data['_counters'] reset. type: {type(self.data['_counters']) if '_counters' in self.data else 'not present'}")
 
         # ---- 統一在這裡補上必要欄位 ----
         if "_counters" not in self.data or not isinstance(self.data["_counters"], dict):
-            print(f"[DB] Fixing _counters. Current type: {type(self.data['_counters']) if '_counters' in self.data else 'not present'}")
+            log.debug("DB", "fixing _counters", found=type(self.data.get("_counters")).__name__)
             self.data["_counters"] = {}
-        print(f"[DB] load finished, final self.data['_counters'] type: {type(self.data['_counters'])}")
+        log.debug("DB", "load finished", path=self.path)
+        self._build()
+
+    def _build(self) -> None:
+        """self.data 換掉後 (load / follower 收到 snapshot) 重建 Collection 與索引。"""
+        # 紀錄改存成 Collection (tuple + 欄位表)；json.load 產生的 dict 隨即釋放
+        for col, recs in list(self.data.items()):
+            if col != "_counters" and isinstance(recs, dict): self.data[col] = Collection(recs)
 
         # 這幾個 collection 可能之後會用到：先建好
-        for col in ("developers", "players", "games", "player_games", "ratings"):
-            self.data.setdefault(col, {})
+        for col in DEFAULT_COLLECTIONS:
+            self.data.setdefault(col, Collection())
             # 若還沒有 counter，就用目前筆數當起始值
             self.data["_counters"].setdefault(col, len(self.data[col]))
 
+        # 唯一索引只存在記憶體，載入時重建 (舊資料若已有重複，保留第一筆)
+        self.unique: Dict[str, Dict[Tuple[Any, ...], str]] = {}
+        for col, fields in UNIQUE_KEYS.items():
+            idx = self.unique[col] = {}
+            recs = self._ensure_col(col)
+            for rec_id, row in recs.scan():
+                idx.setdefault(tuple(recs.value(rec_id, row, f) for f in fields), rec_id)
+        self.sorted: Dict[str, Dict[str, List[Tuple[int, Any, str]]]] = {}
+        for col, fields in SORTED_KEYS.items():
+            recs = self._ensure_col(col)
+            self.sorted[col] = {}
+            for f in fields:
+                vals = ((recs.value(rid, row, f), rid) for rid, row in recs.scan())
+                self.sorted[col][f] = sorted((_rank(v), v, rid) for v, rid in vals if _rank(v) is not None)
+
     def save(self) -> None:
-        print(f"[DB] Saving data. self.data['_counters'] type: {type(self.data['_counters'])}")
+        self.persist(self.snapshot())
+
+    def set_durability(self, mode: str) -> None:
+        self.autosave = mode == "sync"
+
+    def dump(self) -> Dict[str, Any]:
+        """整份資料 (與 db_data.json 相同格式)；回傳的是新物件，可在 LOCK 外使用。"""
+        return dict(self.export(self.checkpoint()))
+
+    def checkpoint(self) -> Any:
+        """在 LOCK 內呼叫：取得目前內容的一致快照 (每個 collection 一份 copy-on-write 副本，不複製紀錄)。"""
+        return {k: v.copy() if isinstance(v, Collection) else dict(v) for k, v in self.data.items()}
+
+    def export(self, view: Any) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """可在 LOCK 外呼叫：把 checkpoint 逐個 collection 轉回一般 dict。"""
+        for k, v in view.items():
+            yield k, v.to_dict() if isinstance(v, Collection) else v
+
+    def snapshot(self) -> Any:
+        """在 LOCK 內呼叫：取出要落地的內容 (checkpoint；序列化留給 persist 在 LOCK 外做)。"""
+        return self.checkpoint()
+
+    def persist(self, payload: Any) -> None:
+        """可在 LOCK 外呼叫：序列化、寫暫存檔、fsync 後原子地換掉資料檔。"""
+        if log.DEBUG: log.debug("DB", "saving data", path=self.path)
+        text = json.dumps(dict(self.export(payload)), ensure_ascii=False, indent=2)
         tmp = self.path + ".tmp"
         with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
         os.replace(tmp, self.path)
+        _fsync_dir(self.path)
+
+    def _written(self, op: Dict[str, Any]) -> None:
+        """op 記進 mutation log：{"op": "put", "col", "id", "rec", "ts"} 或 {"op": "del", "col", "id", "ts"}。"""
+        op.setdefault("ts", time.time())  # follower 套用時保留 primary 的時間，備份還原時依此決定停在哪一筆
+        self.write_seq += 1
+        self.oplog.append((self.write_seq, op))
+        if self.autosave: self.save()
+
+    # replication ---------------------------------------
+
+    def ops_since(self, seq: int) -> Optional[List[Tuple[int, Dict[str, Any]]]]:
+        """seq 之後的 mutation；已經不在 oplog 裡 (follower 落後太多) 回傳 None。"""
+        if seq >= self.write_seq: return []
+        if not self.oplog or seq + 1 < self.oplog[0][0]: return None
+        return list(itertools.islice(self.oplog, seq + 1 - self.oplog[0][0], None))
+
+    def apply(self, op: Dict[str, Any]) -> None:
+        """follower 套用 primary 的 mutation (primary 已檢查過唯一索引)。"""
+        col, rec_id = op["col"], op["id"]
+        colmap = self._ensure_col(col)
+        old = colmap.get(rec_id)
+        if op["op"] == "put":
+            self._reindex(col, old, op["rec"], rec_id)
+            colmap[rec_id] = op["rec"]
+            counters = self.data["_counters"]
+            if rec_id.isdigit(): counters[col] = max(counters.get(col, 0), int(rec_id))
+        elif old is not None:
+            self._reindex(col, old, None, rec_id)
+            del colmap[rec_id]
+        self._written(op)
+
+    def replace_all(self, data: Dict[str, Any]) -> None:
+        """follower 收到完整 snapshot。"""
+        self.data = data
+        self._build()
+        self._written({"op": "snapshot"})
 
     # collection generic helpers -------------------------
 
-    def _ensure_col(self, col: str) -> Dict[str, Any]:
+    def _ensure_col(self, col: str) -> Collection:
         if col not in self.data:
-            self.data[col] = {}
+            self.data[col] = Collection()
         return self.data[col]
 
     def _next_id(self, col: str) -> str:
-        print(f"[DB] _next_id called for col: {col}. self.data['_counters'] type: {type(self.data['_counters'])}")
+        if log.DEBUG: log.debug("DB", "next id", collection=col)
         c = self.data["_counters"].get(col, 0) + 1
         self.data["_counters"][col] = c
         return str(c)
 
+    # unique index helpers ------------------------------
+
+    def _ukey(self, col: str, rec: Dict[str, Any]) -> Optional[Tuple[Any, ...]]:
+        fields = UNIQUE_KEYS.get(col)
+        return tuple(rec.get(f) for f in fields) if fields else None
+
+    def _find_unique(self, col: str, key: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """key 必須剛好是該 collection 唯一索引的欄位；沒有索引時退回線性搜尋。"""
+        fields = UNIQUE_KEYS.get(col)
+        if fields and set(key) == set(fields):
+            rec_id = self.unique[col].get(tuple(key[f] for f in fields))
+            return self._ensure_col(col).get(rec_id) if rec_id else None
+        found = self.query(col, key)
+        return found[0] if found else None
+
+    def _check_unique(self, col: str, rec: Dict[str, Any], rec_id: Optional[str] = None) -> None:
+        k = self._ukey(col, rec)
+        if k is not None and self.unique[col].get(k, rec_id) != rec_id:
+            raise Conflict(f"duplicate {UNIQUE_KEYS[col]} in {col}")
+
+    def _reindex(self, col: str, old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]], rec_id: str) -> None:
+        if col in UNIQUE_KEYS:
+            if old is not None: self.unique[col].pop(self._ukey(col, old), None)
+            if new is not None: self.unique[col][self._ukey(col, new)] = rec_id
+        for f, arr in self.sorted.get(col, {}).items():
+            ov = old.get(f) if old is not None else None
+            nv = new.get(f) if new is not None else None
+            if old is not None and new is not None and ov == nv and _rank(ov) == _rank(nv): continue
+            if _rank(ov) is not None:
+                i = bisect.bisect_left(arr, (_rank(ov), ov, rec_id))
+                if i < len(arr) and arr[i][2] == rec_id: del arr[i]
+            if _rank(nv) is not None:
+                bisect.insort(arr, (_rank(nv), nv, rec_id))
+
+    # sorted index helpers ------------------------------
+
+    def _index_spans(self, col: str, field: str, cond: Any) -> Optional[List[Tuple[int, int]]]:
+        """把單一欄位的條件換成排序索引上的 [lo, hi) 區間；無法使用索引時回傳 None。"""
+        arr = self.sorted.get(col, {}).get(field)
+        if arr is None: return None
+        if not (isinstance(cond, dict) and cond and all(k in RANGE_OPS for k in cond)):
+            cond = {"$in": [cond]}
+        if "$in" in cond:
+            vals = cond["$in"]
+            if not isinstance(vals, list) or any(_rank(v) is None for v in vals): return None
+            return [(bisect.bisect_left(arr, (_rank(v), v)), bisect.bisect_right(arr, (_rank(v), v, _ID_MAX)))
+                    for v in sorted(set(vals), key=lambda v: (_rank(v), v))]
+        if "$prefix" in cond:
+            p = cond["$prefix"]
+            if not isinstance(p, str): return None
+            lo = bisect.bisect_left(arr, (1, p))
+            hi = bisect.bisect_left(arr, (1, p + _ID_MAX))
+            return [(lo, hi)]
+        bounds = [(op, cond[op]) for op in ("$gt", "$gte", "$lt", "$lte") if op in cond]
+        if not bounds: return None  # 只有 $ne
+        ranks = {_rank(v) for _, v in bounds}
+        if len(ranks) != 1 or None in ranks: return None
+        r = ranks.pop()
+        lo, hi = bisect.bisect_left(arr, (r,)), bisect.bisect_left(arr, (r + 1,))
+        for op, v in bounds:
+            if op == "$gt": lo = max(lo, bisect.bisect_right(arr, (r, v, _ID_MAX)))
+            elif op == "$gte": lo = max(lo, bisect.bisect_left(arr, (r, v)))
+            elif op == "$lt": hi = min(hi, bisect.bisect_left(arr, (r, v)))
+            elif op == "$lte": hi = min(hi, bisect.bisect_right(arr, (r, v, _ID_MAX)))
+        return [(lo, max(lo, hi))]
+
+    def _candidates(self, col: str, filt: Dict[str, Any]) -> Optional[List[str]]:
+        """挑命中筆數最少的索引條件，回傳候選 id (其餘條件由 query 再逐筆檢查)；沒有可用索引回傳 None。"""
+        best = None
+        for field, cond in filt.items():
+            spans = self._index_spans(col, field, cond)
+            if spans is None: continue
+            size = sum(hi - lo for lo, hi in spans)
+            if best is None or size < best[0]: best = (size, field, spans)
+        if best is None: return None
+        arr = self.sorted[col][best[1]]
+        # 依 id 數值排回建立順序，和全表掃描的結果順序一致
+        return sorted((arr[i][2] for lo, hi in best[2] for i in range(lo, hi)), key=lambda i: (len(i), i))
+
+    # CRUD ------------------------------------------------
+
     def create(self, col: str, record: Dict[str, Any]) -> Dict[str, Any]:
         colmap = self._ensure_col(col)
+        self._check_unique(col, record)
         new_id = self._next_id(col)
         rec = dict(record)
         rec["id"] = new_id
         colmap[new_id] = rec
-        self.save()
+        self._reindex(col, None, rec, new_id)
+        self._written({"op": "put", "col": col, "id": new_id, "rec": rec})
         return rec
 
     def read(self, col: str, rec_id: str) -> Optional[Dict[str, Any]]:
@@ -98,57 +468,441 @@ class SimpleDB:
         colmap = self._ensure_col(col)
         if rec_id not in colmap:
             return None
-        colmap[rec_id].update(patch)
-        self.save()
-        return colmap[rec_id]
+        old = colmap[rec_id]
+        new = {**old, **patch, "id": rec_id}
+        self._check_unique(col, new, rec_id)
+        self._reindex(col, old, new, rec_id)
+        colmap[rec_id] = new
+        self._written({"op": "put", "col": col, "id": rec_id, "rec": new})
+        return new
 
     def delete(self, col: str, rec_id: str) -> bool:
         colmap = self._ensure_col(col)
         if rec_id in colmap:
+            self._reindex(col, colmap[rec_id], None, rec_id)
             del colmap[rec_id]
-            self.save()
+            self._written({"op": "del", "col": col, "id": rec_id})
             return True
         return False
 
-    def list_all(self, col: str) -> List[Dict[str, Any]]:
-        colmap = self._ensure_col(col)
-        return list(colmap.values())
+    # atomic helpers (由 handle 在 LOCK 內呼叫，一次 round trip 完成) ----
+
+    def create_if_absent(self, col: str, record: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """依唯一索引檢查，不存在才建立。回傳 (紀錄, 是否新建)。"""
+        fields = UNIQUE_KEYS.get(col)
+        if not fields:
+            raise ValueError(f"{col} has no unique key")
+        existing = self._find_unique(col, {f: record.get(f) for f in fields})
+        if existing is not None:
+            return existing, False
+        return self.create(col, record), True
+
+    def upsert(self, col: str, key: Dict[str, Any], patch: Dict[str, Any],
+               defaults: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], bool]:
+        """有符合 key 的紀錄就套用 patch，否則以 key + defaults + patch 建立。回傳 (紀錄, 是否新建)。"""
+        existing = self._find_unique(col, key)
+        if existing is not None:
+            return self.update(col, existing["id"], patch), False
+        return self.create(col, {**(defaults or {}), **key, **patch}), True
+
+    def cas(self, col: str, rec_id: str, expect: Dict[str, Any], patch: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """expect 的每個欄位都符合目前值才套用 patch；不符合回傳 None。"""
+        rec = self.read(col, rec_id)
+        if rec is None or any(rec.get(k) != v for k, v in expect.items()):
+            return None
+        return self.update(col, rec_id, patch)
+
+    def incr(self, col: str, rec_id: str, field: str, by: int = 1) -> Optional[int]:
+        rec = self.read(col, rec_id)
+        if rec is None:
+            return None
+        value = int(rec.get(field) or 0) + by
+        self.update(col, rec_id, {field: value})
+        return value
+
+    def list_all(self, col: str, **opts: Any) -> List[Dict[str, Any]]:
+        return self.query(col, {}, **opts)
 
-    def query(self, col: str, filt: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def query(self, col: str, filt: Dict[str, Any], fields: Optional[List[str]] = None,
+              order_by: Any = None, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        filt: 欄位 -> 值 (相等) 或 {"$gt"|"$gte"|"$lt"|"$lte"|"$in"|"$prefix"|"$ne": ...}；
+              有排序索引的欄位 (SORTED_KEYS) 會先用 bisect 縮小範圍
+        fields: 只回傳這些欄位 (id 一定會帶)
+        order_by: 欄位名或欄位名 list，前面加 "-" 代表遞減
+        limit / offset: 排序後分頁；沒有 order_by 時湊滿 limit 就停止掃描
+        """
         colmap = self._ensure_col(col)
         res = []
-        for rec in colmap.values():
+        stop = None if order_by or limit is None else offset + limit
+        ids = self._candidates(col, filt) if filt else None
+        for rec_id, row in colmap.scan(ids):
             ok = True
             for k, v in filt.items():
-                if rec.get(k) != v:
+                if not _match(colmap.value(rec_id, row, k), v):
                     ok = False
                     break
             if ok:
+                res.append(colmap._unpack(rec_id, row))
+                if stop is not None and len(res) >= stop:
+                    break
+        return _shape(res, fields, order_by, limit, offset)
+
+
+def _shape(res: List[Dict[str, Any]], fields: Optional[List[str]], order_by: Any,
+           limit: Optional[int], offset: int) -> List[Dict[str, Any]]:
+    """query 的後處理 (兩種引擎共用)：排序 -> 分頁 -> 投影。"""
+    if order_by:
+        # 穩定排序：由最後一個欄位排到第一個；None 一律排在最後
+        for key in reversed([order_by] if isinstance(order_by, str) else list(order_by)):
+            desc = key.startswith("-")
+            name = key.lstrip("-")
+            present = [r for r in res if r.get(name) is not None]
+            present.sort(key=lambda r: r[name], reverse=desc)
+            res = present + [r for r in res if r.get(name) is None]
+    if offset or limit is not None:
+        res = res[offset:None if limit is None else offset + limit]
+    if fields:
+        keep = set(fields) | {"id"}
+        res = [{k: v for k, v in r.items() if k in keep} for r in res]
+    return res
+
+
+_NAME_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def _jx(field: str) -> str:
+    """欄位在 SQL 裡的寫法；索引與查詢必須用完全相同的運算式 SQLite 才會走索引。"""
+    return f"json_extract(body, '$.{field}')"
+
+
+class SQLiteDB(SimpleDB):
+    """
+    與 SimpleDB 相同的 API，資料放在 SQLite (WAL)：
+    - 每個 collection 一張表 c_<col>(id, body)，body 是 JSON
+    - UNIQUE_KEYS / SORTED_KEYS 變成 json_extract 運算式索引，唯一性由 SQLite 保證
+    - query 先把能翻成 SQL 的條件交給 SQLite 縮小範圍，再用 _match 逐筆確認 (語意與 SimpleDB 一致)
+    - durability=sync 時每個寫入各自是一個交易；group / async 時寫入累積在同一個交易裡 (每筆一個 SAVEPOINT)，
+      GroupCommitter 落地時才 COMMIT
+    - create_if_absent / upsert / cas / incr 沿用 SimpleDB 的實作
+    """
+
+    def load(self) -> None:
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS _counters (col TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.tables = {row[0][2:] for row in self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND substr(name, 1, 2) = 'c_'")}
+        for col in DEFAULT_COLLECTIONS:
+            self._ensure_col(col)
+        log.info("DB", "sqlite engine", path=self.path, collections=len(self.tables))
+
+    def set_durability(self, mode: str) -> None:
+        super().set_durability(mode)
+        # FULL：每次 COMMIT 都 fsync WAL；async 本來就允許遺失最後一批，用 NORMAL 即可
+        self.conn.execute(f"PRAGMA synchronous={'NORMAL' if mode == 'async' else 'FULL'}")
+
+    def snapshot(self) -> Any:
+        if self.conn.in_transaction: self.conn.commit()
+        return None
+
+    def persist(self, payload: Any) -> None:
+        pass  # snapshot 的 COMMIT 就已落地
+
+    def dump(self) -> Dict[str, Any]:
+        return dict(self._rows(self.conn, sorted(self.tables)))
+
+    def checkpoint(self) -> Any:
+        """先 COMMIT 累積的寫入，再開一條讀取連線並開始讀取交易：WAL 讓它一直看到這個時間點的資料，
+        之後的寫入不受影響 (也不會被它擋住)。"""
+        self.snapshot()
+        reader = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        reader.execute("BEGIN")
+        reader.execute("SELECT count(*) FROM _counters").fetchone()  # 第一次讀取才真正固定快照
+        return reader, sorted(self.tables)
+
+    def export(self, view: Any) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        reader, tables = view
+        try:
+            yield from self._rows(reader, tables)
+        finally:
+            reader.close()
+
+    def _rows(self, conn: sqlite3.Connection, tables: List[str]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        yield "_counters", dict(conn.execute("SELECT col, value FROM _counters"))
+        for col in tables:
+            yield col, {rid: json.loads(body) for rid, body in conn.execute(f'SELECT id, body FROM "c_{col}" ORDER BY rowid')}
+
+    @contextlib.contextmanager
+    def _tx(self):
+        if self.autosave:
+            with self.conn:
+                self.conn.execute("BEGIN IMMEDIATE")
+                yield
+            return
+        if not self.conn.in_transaction: self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.execute("SAVEPOINT w")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK TO w")
+            self.conn.execute("RELEASE w")
+            raise
+        self.conn.execute("RELEASE w")
+
+    def close(self) -> None:
+        self.snapshot()
+        self.conn.close()
+
+    def _ensure_col(self, col: str) -> str:
+        if not _NAME_RE.match(col):
+            raise ValueError(f"bad collection name {col!r}")
+        table = f'"c_{col}"'
+        if col in self.tables: return table
+        with self.conn:
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (id TEXT PRIMARY KEY, body TEXT NOT NULL)")
+            self.conn.execute("INSERT OR IGNORE INTO _counters (col, value) VALUES (?, 0)", (col,))
+            if col in UNIQUE_KEYS:
+                cols = ", ".join(_jx(f) for f in UNIQUE_KEYS[col])
+                self.conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "u_{col}" ON {table} ({cols})')
+            for f in SORTED_KEYS.get(col, ()):
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS "s_{col}_{f}" ON {table} ({_jx(f)})')
+        self.tables.add(col)
+        return table
+
+    def _next_id(self, col: str) -> str:
+        self.conn.execute("UPDATE _counters SET value = value + 1 WHERE col = ?", (col,))
+        return str(self.conn.execute("SELECT value FROM _counters WHERE col = ?", (col,)).fetchone()[0])
+
+    def _find_unique(self, col: str, key: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        found = self.query(col, key, limit=1)
+        return found[0] if found else None
+
+    def create(self, col: str, record: Dict[str, Any]) -> Dict[str, Any]:
+        table = self._ensure_col(col)
+        try:
+            with self._tx():
+                rec = dict(record)
+                rec["id"] = self._next_id(col)
+                self.conn.execute(f"INSERT INTO {table} (id, body) VALUES (?, ?)",
+                                  (rec["id"], json.dumps(rec, ensure_ascii=False)))
+        except sqlite3.IntegrityError:
+            raise Conflict(f"duplicate {UNIQUE_KEYS.get(col)} in {col}")
+        self._written({"op": "put", "col": col, "id": rec["id"], "rec": rec})
+        return rec
+
+    def read(self, col: str, rec_id: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute(f"SELECT body FROM {self._ensure_col(col)} WHERE id = ?", (rec_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, col: str, rec_id: str, patch: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        old = self.read(col, rec_id)
+        if old is None:
+            return None
+        new = {**old, **patch, "id": rec_id}
+        table = self._ensure_col(col)
+        try:
+            with self._tx():
+                self.conn.execute(f"UPDATE {table} SET body = ? WHERE id = ?", (json.dumps(new, ensure_ascii=False), rec_id))
+        except sqlite3.IntegrityError:
+            raise Conflict(f"duplicate {UNIQUE_KEYS.get(col)} in {col}")
+        self._written({"op": "put", "col": col, "id": rec_id, "rec": new})
+        return new
+
+    def delete(self, col: str, rec_id: str) -> bool:
+        table = self._ensure_col(col)
+        with self._tx():
+            cur = self.conn.execute(f"DELETE FROM {table} WHERE id = ?", (rec_id,))
+        if cur.rowcount > 0: self._written({"op": "del", "col": col, "id": rec_id})
+        return cur.rowcount > 0
+
+    def _where(self, filt: Dict[str, Any]) -> Tuple[str, List[Any]]:
+        """把條件翻成 SQL (只是縮小範圍，翻不了的條件留給 _match)。"""
+        terms: List[str] = []
+        args: List[Any] = []
+        scalar = (str, int, float)
+        for field, cond in filt.items():
+            if not _NAME_RE.match(field): continue
+            x = "id" if field == "id" else _jx(field)
+            if not (isinstance(cond, dict) and cond and all(k in RANGE_OPS for k in cond)):
+                if cond is None: terms.append(f"{x} IS NULL")
+                elif isinstance(cond, scalar): terms.append(f"{x} = ?"); args.append(cond)
+                continue
+            for op, arg in cond.items():
+                if op in ("$gt", "$gte", "$lt", "$lte") and isinstance(arg, scalar):
+                    terms.append(f"{x} {dict(zip(('$gt', '$gte', '$lt', '$lte'), ('>', '>=', '<', '<=')))[op]} ?")
+                    args.append(arg)
+                elif op == "$in" and isinstance(arg, list) and arg and all(isinstance(v, scalar) for v in arg):
+                    terms.append(f"{x} IN ({', '.join('?' * len(arg))})"); args.extend(arg)
+                elif op == "$prefix" and isinstance(arg, str):
+                    terms.append(f"{x} >= ? AND {x} < ?"); args.extend([arg, arg + _ID_MAX])
+        return (" WHERE " + " AND ".join(terms)) if terms else "", args
+
+    def query(self, col: str, filt: Dict[str, Any], fields: Optional[List[str]] = None,
+              order_by: Any = None, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+        where, args = self._where(filt)
+        cur = self.conn.execute(f"SELECT body FROM {self._ensure_col(col)}{where} ORDER BY rowid", args)
+        res = []
+        stop = None if order_by or limit is None else offset + limit
+        for (body,) in cur:
+            rec = json.loads(body)
+            if all(_match(rec.get(k), v) for k, v in filt.items()):
                 res.append(rec)
-        return res
+                if stop is not None and len(res) >= stop:
+                    break
+        cur.close()
+        return _shape(res, fields, order_by, limit, offset)
+
+    def import_data(self, data: Dict[str, Any]) -> Dict[str, int]:
+        """把 SimpleDB 的整份 data (JSON 檔內容或 SimpleDB.data) 匯入，保留 id 與計數器；違反唯一索引的紀錄略過。回傳各 collection 匯入筆數。"""
+        counts: Dict[str, int] = {}
+        counters = data.get("_counters") or {}
+        cols = [col for col, recs in data.items() if col != "_counters" and isinstance(recs, (dict, Collection))]
+        for col in cols: self._ensure_col(col)
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            for col in cols:
+                recs = data[col]
+                table = self._ensure_col(col)
+                before = self.conn.total_changes
+                self.conn.executemany(f"INSERT OR IGNORE INTO {table} (id, body) VALUES (?, ?)",
+                                      ((str(rid), json.dumps({**rec, "id": str(rid)}, ensure_ascii=False))
+                                       for rid, rec in recs.items()))
+                counts[col] = self.conn.total_changes - before
+                top = max([int(r) for r in recs if str(r).isdigit()] + [int(counters.get(col, 0))])
+                self.conn.execute("UPDATE _counters SET value = MAX(value, ?) WHERE col = ?", (top, col))
+        return counts
+
+
+DB: Optional[SimpleDB] = None  # main() 依 --engine 建立
+
+
+def open_db(engine: str = "json", path: Optional[str] = None) -> SimpleDB:
+    if engine == "sqlite": return SQLiteDB(path or SQLITE_FILE)
+    return SimpleDB(path or DB_FILE)
+
+
+class GroupCommitter:
+    """
+    durability=group / async：背景執行緒把一段時間內的寫入合併成一次落地。
+    - 有新寫入後最多等 interval 秒 (或累積 max_ops 筆) 就在 LOCK 內 snapshot，再於 LOCK 外 persist；
+      若所有未落地的寫入都已在 commit() 裡等待 (沒有人會再加進這批)，就不再等下去
+    - 落地進行中到達的寫入自然累積成下一批
+    - commit(seq)：group 模式下阻塞到 seq 之前的寫入都已落地；async 模式直接返回
+    """
+
+    def __init__(self, db: SimpleDB, mode: str, interval_ms: float, max_ops: int):
+        self.db = db
+        self.wait_durable = mode == "group"
+        self.interval = interval_ms / 1000.0
+        self.max_ops = max(1, max_ops)
+        self.cond = threading.Condition()
+        self.flushed = db.write_seq
+        self.waiting = 0
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def commit(self, seq: int) -> None:
+        with self.cond:
+            if not self.wait_durable:
+                self.cond.notify_all()
+                return
+            self.waiting += 1
+            self.cond.notify_all()
+            while self.flushed < seq:
+                self.cond.wait()
+            self.waiting -= 1
+
+    def _loop(self) -> None:
+        while True:
+            with self.cond:
+                while self.db.write_seq <= self.flushed:
+                    self.cond.wait()
+                deadline = time.monotonic() + self.interval
+                while self.db.write_seq - self.flushed < self.max_ops:
+                    if self.wait_durable and self.waiting >= self.db.write_seq - self.flushed: break
+                    left = deadline - time.monotonic()
+                    if left <= 0: break
+                    self.cond.wait(left)
+            with LOCK:
+                seq = self.db.write_seq
+                payload = self.db.snapshot()
+            try:
+                self.db.persist(payload)
+            except OSError as e:
+                log.error("DB", "group commit failed, retrying", error=e)
+                time.sleep(0.1)
+                continue
+            with self.cond:
+                self.flushed = seq
+                self.cond.notify_all()
+
+
+COMMITTER: Optional[GroupCommitter] = None  # durability=sync 時為 None
+_TLS = threading.local()  # handle 記下這個執行緒最後一個寫入的 write_seq，worker 回覆前用來等落地
+
+
+def _select_opts(req: Dict[str, Any]) -> Dict[str, Any]:
+    """list / query 的選用參數：fields, order_by, limit, offset。"""
+    limit = req.get("limit")
+    return {
+        "fields": req.get("fields"),
+        "order_by": req.get("order_by"),
+        "limit": None if limit is None else max(0, int(limit)),
+        "offset": max(0, int(req.get("offset") or 0)),
+    }
+
+
+class _TimedLock:
+    """with _TIMED_LOCK: 等 LOCK 的時間記到 db_lock_wait_seconds 與目前的 trace span。"""
+
+    def __enter__(self) -> None:
+        t0 = time.perf_counter()
+        LOCK.acquire()
+        wait = time.perf_counter() - t0
+        if metrics.ENABLED: metrics.observe("db_lock_wait_seconds", wait)
+        tracing.add("lock_wait", wait)
 
+    def __exit__(self, *exc: Any) -> None:
+        LOCK.release()
 
-DB = SimpleDB(DB_FILE)
+
+_TIMED_LOCK = _TimedLock()
 
 
 def handle(req: Dict[str, Any]) -> Dict[str, Any]:
     """
     Request:
       {
-        "action": "create|read|update|delete|list|query|ping",
+        "action": "create|read|update|delete|list|query|ping"
+                  "|create_if_absent|upsert|cas|incr",
         "collection": "developers|players|games|ratings|...",
         ...
       }
+    query 的 filter 支援 $gt / $gte / $lt / $lte / $in / $prefix / $ne；
+    list / query 另可帶 "fields", "order_by", "limit", "offset" (見 SimpleDB.query)
+    另有 "promote" (follower 升為 primary)、"backup" (線上備份，可帶 "full": true)、"profile" (--profiling，見 server/profiler.py)；
+    "replicate" 由 worker 直接處理
     """
     act = req.get("action")
     if act == "ping":
-        return {"status": "ok", "result": "pong"}
+        return {"status": "ok", "result": "pong", "role": ROLE, "epoch": EPOCH if ROLE == "primary" else REPL_EPOCH,
+                "seq": DB.write_seq if ROLE == "primary" else DB.repl_seq}
+    if act == "promote":
+        return promote()
+    if act == "backup":
+        return backup(bool(req.get("full")))
+    if act == "profile":
+        return profiler.handle(req)
 
     col = req.get("collection")
     if not isinstance(col, str):
         return {"status": "error", "error": "collection required"}
+    if ROLE == "follower" and act not in READ_ACTIONS:
+        return {"status": "error", "error": "read_only"}
 
-    with LOCK:
+    with _TIMED_LOCK if metrics.ENABLED or tracing.active() else LOCK:
+        before = DB.write_seq
         try:
             if act == "create":
                 rec = DB.create(col, req.get("record") or {})
@@ -170,66 +924,338 @@ def handle(req: Dict[str, Any]) -> Dict[str, Any]:
                 rec_id = str(req.get("id"))
                 ok = DB.delete(col, rec_id)
                 return {"status": "ok", "result": ok}
+            if act == "create_if_absent":
+                rec, created = DB.create_if_absent(col, req.get("record") or {})
+                return {"status": "ok", "result": rec, "created": created}
+            if act == "upsert":
+                rec, created = DB.upsert(col, req.get("key") or {}, req.get("patch") or {}, req.get("defaults"))
+                return {"status": "ok", "result": rec, "created": created}
+            if act == "cas":
+                rec_id = str(req.get("id"))
+                if DB.read(col, rec_id) is None:
+                    return {"status": "error", "error": "not found"}
+                rec = DB.cas(col, rec_id, req.get("expect") or {}, req.get("patch") or {})
+                if rec is None:
+                    return {"status": "error", "error": "conflict", "result": DB.read(col, rec_id)}
+                return {"status": "ok", "result": rec}
+            if act == "incr":
+                value = DB.incr(col, str(req.get("id")), str(req.get("field")), int(req.get("by", 1)))
+                if value is None:
+                    return {"status": "error", "error": "not found"}
+                return {"status": "ok", "result": value}
             if act == "list":
-                res = DB.list_all(col)
+                res = DB.list_all(col, **_select_opts(req))
                 return {"status": "ok", "result": res}
             if act == "query":
                 filt = req.get("filter") or {}
-                res = DB.query(col, filt)
+                res = DB.query(col, filt, **_select_opts(req))
                 return {"status": "ok", "result": res}
             return {"status": "error", "error": f"unknown action {act}"}
+        except Conflict as e:
+            return {"status": "error", "error": "conflict", "detail": str(e)}
         except Exception as e:
-            print(f"[ERROR] Exception in handle: type={type(e)}, message='{e}'")
+            log.error("DB", "exception in handle", action=act, type=type(e).__name__, error=e)
             return {"status": "error", "error": f"exception: {e}"}
+        finally:
+            _TLS.write_seq = DB.write_seq if DB.write_seq != before else 0
+
+
+# --- replication：primary 端 ---
+
+def _serve_replica(conn: socket.socket, req: Dict[str, Any]) -> None:
+    """這條連線之後只用來把 mutation log 推給 follower；follower 的位置不在 oplog 內就先送完整 snapshot。"""
+    pos = int(req.get("from_seq") or 0) if req.get("epoch") == EPOCH else -1
+    try:
+        while True:
+            with LOCK:
+                ops = DB.ops_since(pos) if pos >= 0 else None
+                if ops is None:
+                    pos, msg = DB.write_seq, {"type": "snapshot", "epoch": EPOCH, "seq": DB.write_seq, "data": DB.dump()}
+                else:
+                    msg = {"type": "ops", "ops": ops}
+                    if ops: pos = ops[-1][0]
+            conn.sendall(encode_frame(msg))  # 送不出去 (follower 斷線) 就結束
+            if ROLE != "primary": return
+            with REPL_COND:
+                REPL_COND.wait_for(lambda: DB.write_seq > pos, timeout=REPL_HEARTBEAT)
+    except OSError:
+        pass
+
+
+# --- replication：follower 端 ---
+
+def _follow(host: str, port: int, auto_promote: float) -> None:
+    """持續跟 primary 同步；auto_promote > 0 時，與 primary 斷線超過這麼多秒就自己升為 primary。"""
+    global REPL_EPOCH
+    last_seen = time.monotonic()
+    while ROLE == "follower":
+        try:
+            with socket.create_connection((host, port), timeout=REPL_TIMEOUT) as s:
+                s.settimeout(REPL_TIMEOUT)
+                send_frame(s, {"action": "replicate", "epoch": REPL_EPOCH, "from_seq": DB.repl_seq})
+                while True:
+                    msg = recv_frame(s)
+                    if msg is None: break
+                    last_seen = time.monotonic()
+                    with LOCK:
+                        if ROLE != "follower": return
+                        if msg.get("type") == "snapshot":
+                            DB.replace_all(msg["data"])
+                            DB.repl_seq, REPL_EPOCH = msg["seq"], msg["epoch"]
+                            log.info("DB", "replica synced from snapshot", seq=DB.repl_seq)
+                        else:
+                            for seq, op in msg.get("ops", []):
+                                DB.apply(op)
+                                DB.repl_seq = seq
+                    with REPL_COND: REPL_COND.notify_all()
+                    if COMMITTER is not None: COMMITTER.commit(DB.write_seq)
+        except OSError:
+            pass
+        if auto_promote > 0 and time.monotonic() - last_seen > auto_promote:
+            log.warn("DB", f"primary {host}:{port} unreachable for {auto_promote:.0f}s, promoting")
+            promote()
+            return
+        time.sleep(0.5)
+
+
+def _wait_replica(epoch: Any, min_seq: int) -> bool:
+    """follower：等副本追上 (epoch, min_seq)，讓同一個 session 讀得到自己剛寫的資料。"""
+    with REPL_COND:
+        return REPL_COND.wait_for(lambda: REPL_EPOCH == epoch and DB.repl_seq >= min_seq, timeout=REPLICA_WAIT)
+
+
+def promote() -> Dict[str, Any]:
+    global ROLE, EPOCH
+    with LOCK:
+        if ROLE == "primary": return {"status": "ok", "result": "already primary"}
+        ROLE, EPOCH = "primary", uuid.uuid4().hex
+        DB.set_durability(DURABILITY)
+        if COMMITTER is not None: COMMITTER.wait_durable = DURABILITY == "group"
+        DB.save()
+    with REPL_COND: REPL_COND.notify_all()
+    log.info("DB", "promoted to primary", epoch=EPOCH, local_writes=DB.write_seq)
+    return {"status": "ok", "result": "promoted"}
+
+
+# --- 線上備份 ---
+
+def read_manifest(backup_dir: str | os.PathLike[str]) -> List[Dict[str, Any]]:
+    """備份目錄的 manifest.jsonl：每份備份一行 (寫完資料檔才追加，最後一行若寫到一半就略過)。"""
+    path = Path(backup_dir) / "manifest.jsonl"
+    if not path.exists(): return []
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try: entries.append(json.loads(line))
+            except ValueError: pass
+    return entries
+
+
+def _write_backup(path: Path, lines: Iterable[Any]) -> int:
+    """一行一個 JSON，寫暫存檔 + fsync 後換名；回傳行數。"""
+    n = 0
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        for obj in lines:
+            f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+            n += 1
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path)
+    return n
+
+
+def _base_lines(view: Any, counter: List[int]) -> Iterator[Dict[str, Any]]:
+    """checkpoint -> {"col", "records"} 一行最多 BACKUP_CHUNK 筆 (空的 collection 也佔一行)。"""
+    for col, recs in DB.export(view):
+        items = iter(recs.items())
+        part = dict(itertools.islice(items, BACKUP_CHUNK))
+        while True:
+            counter[0] += len(part)
+            yield {"col": col, "records": part}
+            part = dict(itertools.islice(items, BACKUP_CHUNK))
+            if not part: break
+
+
+def backup(full: bool = False) -> Dict[str, Any]:
+    """
+    線上備份到 BACKUP_DIR，不必停止寫入：
+    - base：完整快照。LOCK 內只取 checkpoint (json：copy-on-write 副本；sqlite：WAL 讀取交易)，
+      序列化與寫檔都在 LOCK 外進行，期間的寫入照常處理
+    - ops ：上一份備份之後的 mutation log (每筆帶時間)。同一個 epoch 內、且還留在 oplog 裡才做得到，
+      否則 (重啟、升級、落後超過 REPL_LOG_SIZE、或距離 base 超過 BACKUP_FULL_OPS) 自動改做 base
+    資料檔落地後才追加到 manifest.jsonl；還原用 server/db_backup.py restore
+    """
+    if not _BACKUP_LOCK.acquire(blocking=False):
+        return {"status": "error", "error": "backup in progress"}
+    try:
+        out = Path(BACKUP_DIR)
+        out.mkdir(parents=True, exist_ok=True)
+        entries = read_manifest(out)
+        last = entries[-1] if entries else None
+        base = next((e for e in reversed(entries) if e["type"] == "base"), None)
+        t0 = time.perf_counter()
+        with LOCK:
+            seq, epoch, now = DB.write_seq, EPOCH, time.time()
+            ops = None
+            if not full and base and base["epoch"] == epoch and last["epoch"] == epoch and seq - base["seq"] <= BACKUP_FULL_OPS:
+                ops = DB.ops_since(last["seq"])
+                if ops and any(op["op"] == "snapshot" for _, op in ops): ops = None  # follower 重新同步過
+            view = DB.checkpoint() if ops is None else None
+        lock_ms = (time.perf_counter() - t0) * 1000
+        if ops == []:
+            return {"status": "ok", "result": {"type": "none", "seq": seq}}
+        if ops is None:
+            entry = {"type": "base", "file": f"base-{epoch[:8]}-{seq}.jsonl", "epoch": epoch, "seq": seq, "time": now}
+            header, counter = {"epoch": epoch, "seq": seq, "time": now}, [0]
+            _write_backup(out / entry["file"], itertools.chain([header], _base_lines(view, counter)))
+            n = counter[0]
+        else:
+            entry = {"type": "ops", "file": f"ops-{epoch[:8]}-{ops[0][0]}-{ops[-1][0]}.jsonl", "epoch": epoch,
+                     "from_seq": ops[0][0], "seq": ops[-1][0], "time": now,
+                     "first_ts": ops[0][1]["ts"], "last_ts": ops[-1][1]["ts"]}
+            n = _write_backup(out / entry["file"], ops)
+        with open(out / "manifest.jsonl", "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        log.info("DB", f"backup {entry['file']}", count=n, kind="base" if ops is None else "ops", lock_ms=round(lock_ms, 1))
+        return {"status": "ok", "result": {**entry, "count": n, "lock_ms": round(lock_ms, 3),
+                                           "elapsed_ms": round((time.perf_counter() - t0) * 1000, 3)}}
+    finally:
+        _BACKUP_LOCK.release()
+
+
+def _backup_loop(every: float) -> None:
+    while True:
+        time.sleep(every)
+        try:
+            backup()
+        except OSError as e:
+            log.error("DB", "periodic backup failed", error=e)
+
+
+CONNS: Set[socket.socket] = set()  # 目前的連線 (給 metrics)
 
 
 def worker(conn: socket.socket, addr) -> None:
-    print(f"[DB] new connection from {addr}")
+    if log.DEBUG: log.debug("DB", "new connection", addr=addr)
+    CONNS.add(conn)
     try:
         while True:
             req = recv_frame(conn)
             if req is None:
                 break
-            resp = handle(req)
+            if req.get("action") == "replicate":
+                if ROLE == "primary": _serve_replica(conn, req)
+                break
+            # follower 上帶 min_seq 的讀取：副本還沒追上就回 stale，讓呼叫端改讀 primary
+            if ROLE == "follower" and req.get("min_seq") and not _wait_replica(req.get("epoch"), int(req["min_seq"])):
+                send_frame(conn, {"status": "error", "error": "stale"})
+                continue
+            _TLS.write_seq = 0
+            t0 = time.perf_counter() if metrics.ENABLED else 0.0
+            with tracing.start(f"db {req.get('action')}", req.get("trace"), req.get("parent")):
+                with profiler.capture(req.get("action")): resp = handle(req)
+                if _TLS.write_seq and ROLE == "primary":
+                    resp["epoch"], resp["seq"] = EPOCH, _TLS.write_seq  # 給呼叫端做 read-your-writes
+                    with REPL_COND: REPL_COND.notify_all()
+                # 有寫入時，等它所在的那一批落地才回覆
+                if COMMITTER is not None and _TLS.write_seq:
+                    t1 = time.perf_counter() if metrics.ENABLED else 0.0
+                    with tracing.child("commit_wait"): COMMITTER.commit(_TLS.write_seq)
+                    if metrics.ENABLED: metrics.observe("db_commit_wait_seconds", time.perf_counter() - t1)
             send_frame(conn, resp)
+            if metrics.ENABLED: metrics.observe("db_request_seconds", time.perf_counter() - t0, action=req.get("action"))
     finally:
+        CONNS.discard(conn)
         conn.close()
-        print(f"[DB] closed {addr}")
+        if log.DEBUG: log.debug("DB", "closed", addr=addr)
 
 
 def main() -> None:
+    global DB, COMMITTER, ROLE, DURABILITY, BACKUP_DIR
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--engine", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--path", default=None, help="資料檔 (預設 db_data.json / db_data.sqlite3)")
+    parser.add_argument("--durability", choices=("sync", "group", "async"), default=DURABILITY)
+    parser.add_argument("--group-ms", type=float, default=GROUP_COMMIT_MS, help="一批最多等幾毫秒")
+    parser.add_argument("--group-ops", type=int, default=GROUP_COMMIT_OPS, help="累積幾筆寫入就立刻落地")
+    parser.add_argument("--follow", default=None, metavar="HOST[:PORT]", help="以 follower 身分複寫這個 primary")
+    parser.add_argument("--auto-promote", type=float, default=0, metavar="SEC",
+                        help="follower 與 primary 斷線超過幾秒就自動升為 primary (0 = 只接受 promote 指令)")
+    parser.add_argument("--backup-dir", default=str(BACKUP_DIR))
+    parser.add_argument("--backup-every", type=float, default=0, metavar="SEC",
+                        help="每隔幾秒自動做一次增量備份 (0 = 只在收到 backup 指令時備份)")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="在 127.0.0.1 的這個 port 提供 /metrics (0 = 不收集)")
+    parser.add_argument("--log-level", choices=tuple(log.LEVELS), default=None)
+    parser.add_argument("--log-format", choices=("text", "json"), default=None)
+    parser.add_argument("--log-file", default=None, help="log 寫到這個檔案 (預設 stdout)")
+    parser.add_argument("--trace-file", default=None, help="記錄帶 trace id 的請求的 span (server/trace_report.py 分析)")
+    parser.add_argument("--profiling", action="store_true", help="接受 profile 指令 (server/profiler.py)")
+    args = parser.parse_args()
+    log.configure(args.log_level, args.log_format, args.log_file)
+    if args.trace_file: tracing.configure(args.trace_file, f"db:{args.port}")
+    if args.profiling: profiler.enable()
+    DURABILITY = args.durability
+    BACKUP_DIR = Path(args.backup_dir)
+    if args.follow:
+        # follower 一律用記憶體副本 (json 引擎)，自己的資料檔只在背景落地，升級後才照 --durability
+        if args.engine != "json": parser.error("--follow only supports --engine json")
+        ROLE = "follower"
+        DB = open_db("json", args.path or str(ROOT / f"db_data.{args.port}.json"))
+        DB.set_durability("async")
+        COMMITTER = GroupCommitter(DB, "async", args.group_ms, args.group_ops)
+        host, _, port = args.follow.partition(":")
+        threading.Thread(target=_follow, args=(host, int(port or PORT), args.auto_promote), daemon=True).start()
+        log.info("DB", f"following {host}:{port or PORT}")
+    else:
+        DB = open_db(args.engine, args.path)
+        DB.set_durability(args.durability)
+        if args.durability != "sync":
+            COMMITTER = GroupCommitter(DB, args.durability, args.group_ms, args.group_ops)
+    log.info("DB", "durability", mode=args.durability)
+    if args.metrics_port:
+        metrics.gauge("db_connections", lambda: len(CONNS))
+        metrics.gauge("db_write_seq", lambda: DB.write_seq)
+        metrics.serve(args.metrics_port)
+        log.info("DB", f"metrics on http://127.0.0.1:{args.metrics_port}/metrics")
+    if args.backup_every > 0:
+        threading.Thread(target=_backup_loop, args=(args.backup_every,), daemon=True).start()
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            s.bind((HOST, PORT))
+            s.bind((HOST, args.port))
             s.listen(128)
-            # [修正] 設定 1 秒逾時
-            s.settimeout(1.0)
+            # accept 直接阻塞：Ctrl+C 會以 KeyboardInterrupt 打斷；
+            # SIGTERM（kill / 服務管理器停止）則關掉 listener，accept 丟 OSError 後照同一條路存檔離開
+            signal.signal(signal.SIGTERM, lambda *_: s.close())
             
-            print(f"[DB] listening on {HOST}:{PORT} (Press Ctrl+C to stop)")
+            log.info("DB", f"listening on {HOST}:{args.port} (Press Ctrl+C to stop)")
             
             while True:
                 try:
                     conn, addr = s.accept()
-                    conn.settimeout(None) # 恢復阻塞
-                    t = threading.Thread(target=worker, args=(conn, addr), daemon=True)
-                    t.start()
-                
-                except socket.timeout:
-                    continue
-                    
                 except OSError:
                     break
+                t = threading.Thread(target=worker, args=(conn, addr), daemon=True)
+                t.start()
                     
     except KeyboardInterrupt:
-        print("\n[DB] Server stopping...")
+        pass
+    try:
+        log.info("DB", "Server stopping...")
         # 這裡可以做存檔動作 DB.save()，雖然 worker 操作時就會存，但保險起見
-        if 'DB' in globals():
-            print("[DB] Saving data before exit...")
-            DB.save()
+        if DB is not None:
+            log.info("DB", "Saving data before exit...")
+            with LOCK: DB.save()
             
     finally:
-        print("[DB] Server closed.")
+        log.info("DB", "Server closed.")
+        log.flush()
 
 
 if __name__ == "__main__":
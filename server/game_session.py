@@ -0,0 +1,464 @@
+# server/game_session.py
+#
+# 單一房間的遊戲 session (game / chat / 觀戰 port、relay、斷線續玩、replay 錄製)
+# Lobby 行程直接開執行緒跑，或交給 server/session_worker.py 的 worker 行程跑
+# 等人期限、等待階段的斷線檢查與重連寬限都排在行程共用的時間輪 (server/timers.py)；
+# 各 port 的 accept 直接阻塞，關房時由 stop() 關掉 listening socket 喚醒，不再每秒輪詢；
+# game port 的每條新連線在自己的 handshake 執行緒判斷是新玩家還是 resume
+# 送給玩家的 frame 一律經過各自的 PlayerWriter 排隊送出，relay_lock 內不做阻塞的 sendall
+
+import collections
+import hmac
+import json
+import secrets
+import select
+import socket
+import struct
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from common.protocol import send_frame, encode_frame
+from common.gamesdk.replay import ReplayWriter
+from server.spectator import SpectatorHub
+from server import timers
+from server import log
+
+REPLAY_DIR = ROOT / "server" / "replays"
+RECORD_REPLAYS = True  # 是否為每場對局錄製 replay
+RESUME_GRACE = 30.0      # 玩家斷線後保留房間的秒數
+RESUME_LOG_SIZE = 5000   # 每個房間保留多少個已送出 frame 供斷線重連補送
+ROOM_FILL_TIMEOUT = 60.0 # 開房後這麼久都沒有玩家連進來就關房
+WAIT_CHECK_INTERVAL = 1.0  # 等待階段檢查玩家連線的間隔
+RESUME_PEEK = 0.3        # 等待階段新連線多久內送出第一個 frame 就視為 resume (新玩家不會先送東西)
+MAX_PLAYER_BACKLOG = 1 << 20  # 每個玩家最多排隊多少 bytes 沒送出；超過就當作斷線 (resume 時從 sent_log 補送)
+CLOSE_FLUSH = 0.5        # 關房時最多等幾秒把最後的 frame 送給玩家
+
+# --- Network Helpers ---
+def recv_exact(sock, n):
+    data = b''
+    try:
+        while len(data) < n:
+            chunk = sock.recv(n - len(data))
+            if not chunk: return None
+            data += chunk
+        return data
+    except: return None
+
+def robust_recv_frame(sock):
+    return recv_frame_sized(sock)[0]
+
+#收一個 frame，連同它的大小 (含 header) 一起回傳；失敗回傳 (None, 0)
+def recv_frame_sized(sock):
+    try:
+        header = recv_exact(sock, 4)
+        if not header: return None, 0
+        (length,) = struct.unpack("!I", header)
+        body = recv_exact(sock, length)
+        if not body: return None, 0
+        return json.loads(body.decode("utf-8")), 4 + length
+    except: return None, 0
+
+PING_FRAME = encode_frame({"type": "ping"})
+
+#每個玩家連線一條送出執行緒：relay 在 relay_lock 內只把 bytes 排進佇列，某個玩家卡住不會擋住其他人
+class PlayerWriter(threading.Thread):
+    def __init__(self, sock):
+        super().__init__(daemon=True)
+        self.sock = sock
+        self.pending = collections.deque()
+        self.size = 0
+        self.cond = threading.Condition()
+        self.dead = False
+        self.closing = False
+        self.start()
+
+    def send(self, data):
+        """排進佇列；連線已死或塞爆時回傳 False。塞爆時直接 shutdown，該玩家的 forward 會照常進入重連等待。"""
+        with self.cond:
+            if self.dead or self.closing: return False
+            if self.size + len(data) > MAX_PLAYER_BACKLOG:
+                self.dead = True
+                try: self.sock.shutdown(socket.SHUT_RDWR)
+                except OSError: pass
+                self.cond.notify()
+                return False
+            self.pending.append(data)
+            self.size += len(data)
+            self.cond.notify()
+        return True
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not (self.pending or self.closing or self.dead): self.cond.wait()
+                if self.dead or not self.pending: return  # 死掉，或 close 之後已經送完
+                data = b"".join(self.pending)
+                self.pending.clear()
+                self.size = 0
+            try: self.sock.sendall(data)
+            except OSError:
+                with self.cond: self.dead = True
+                return
+
+    def close(self):
+        """不再接受新的 frame；已排隊的送完執行緒就結束 (要等它送完就 join)。"""
+        with self.cond:
+            self.closing = True
+            self.cond.notify()
+
+
+# --- GameSession Class ---
+class GameSession(threading.Thread):
+    """
+    一個房間的 game / chat / 觀戰 server。不直接碰 Lobby 的狀態，
+    開局與結束時呼叫 on_start(session) / on_close(session)，可以跑在 Lobby 行程內或 session worker 行程裡。
+    """
+    def __init__(self, room_id: int, game_port: int, players_count: int = 2, game_id: str = "",
+                 players: Optional[List[str]] = None, record: bool = RECORD_REPLAYS,
+                 on_start: Optional[Callable[["GameSession"], None]] = None,
+                 on_close: Optional[Callable[["GameSession"], None]] = None):
+        super().__init__()
+        self.room_id = room_id
+        self.game_id = game_id
+        self.players = players if players is not None else []  # Lobby 端的玩家名單 (加入房間時由 Lobby 更新)
+        self.on_start = on_start
+        self.on_close = on_close
+        self.game_port = game_port
+        self.chat_port = game_port + 5000 
+        self.spectate_port = game_port + 10000
+        self.expected_players = players_count
+        self.game_sockets = []   # index = 玩家座位；斷線等待重連期間為 None
+        self.writers: Dict[socket.socket, PlayerWriter] = {}  # 玩家連線 -> 它的送出執行緒 (在 relay_lock 內增刪)
+        self.started = False     # 座位坐滿 (開始轉發)；之後 game port 只接受 resume
+        self.filled = threading.Event()  # 坐滿或關房時叫醒 run_game_server
+        self.tokens = []         # 每個座位的 session token (在 init frame 發給玩家)
+        self.roles = []
+        self.chat_sockets = [] 
+        # 所有送給玩家的 frame 都帶遞增 seq，並保留最近的部分供重連時補送
+        self.relay_lock = threading.Lock()
+        self.seq = 0
+        self.sent_log = collections.deque(maxlen=RESUME_LOG_SIZE)  # (seq, 來源座位, bytes)
+        self.bytes_in = 0    # 從玩家收到的 bytes (含 header)；和 bytes_out 一樣在 relay_lock 內累加
+        self.bytes_out = 0   # 送給玩家的 bytes；送給觀眾的另外記在 SpectatorHub.bytes_out
+        self.grace_timers: Dict[int, timers.Timer] = {}
+        self.spectators = SpectatorHub(room_id)
+        self.record = record
+        self.recorder: Optional[ReplayWriter] = None
+        self.replay_meta: Dict[str, Any] = {}
+        self.results: Dict[int, Any] = {}  # 座位 -> (贏家 role tuple, 玩家名稱)，遊戲 client 以 report_result 回報
+        self.running = True
+        self.closed = threading.Event()
+        self.listeners: List[socket.socket] = []  # 各 port 的 listening socket，stop() 時關掉
+        self.daemon = True 
+
+    def run(self):
+        log.info("Session", "opened", room=self.room_id, game_port=self.game_port, chat_port=self.chat_port, spectate_port=self.spectate_port)
+        threading.Thread(target=self.run_chat_server, daemon=True).start()
+        self.spectators.start()
+        threading.Thread(target=self.run_spectator_server, daemon=True).start()
+        self.run_game_server()
+#關房：所有迴圈看 running 結束；關掉 listening socket 讓阻塞中的 accept 立刻返回
+    def stop(self):
+        self.running = False
+        self.closed.set()
+        self.filled.set()
+        for srv in list(self.listeners):
+            try: srv.shutdown(socket.SHUT_RDWR)
+            except OSError: pass
+            try: srv.close()
+            except OSError: pass
+#啟動 Plugin 用的聊天 Socket Server。邏輯：等待連線 -> 接受連線 -> 為每個連線開啟 chat_relay 執行緒。
+    def run_chat_server(self):
+        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            srv.bind(("0.0.0.0", self.chat_port))
+            srv.listen(10)
+            self.listeners.append(srv)
+            while self.running:
+                try:
+                    conn, _ = srv.accept()
+                    self.chat_sockets.append(conn)
+                    threading.Thread(target=self.chat_relay, args=(conn,), daemon=True).start()
+                except: break
+        finally:
+            srv.close()
+#觀戰用 Socket Server：連進來的都是唯讀觀眾，交給 SpectatorHub 統一 fan-out
+    def run_spectator_server(self):
+        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            srv.bind(("0.0.0.0", self.spectate_port))
+            srv.listen(128)
+            self.listeners.append(srv)
+            while self.running:
+                try:
+                    conn, _ = srv.accept()
+                    self.spectators.add(conn)
+                except: break
+        finally:
+            srv.close()
+    #聊天室廣播
+    def chat_relay(self, conn):
+        try:
+            while self.running:
+                msg = robust_recv_frame(conn)
+                if not msg: break
+                dead = []
+                for s in self.chat_sockets:
+                    try:
+                        data = json.dumps(msg).encode("utf-8")
+                        header = struct.pack("!I", len(data))
+                        s.sendall(header + data)
+                    except: dead.append(s)
+                for d in dead: 
+                    if d in self.chat_sockets: self.chat_sockets.remove(d)
+        except: pass
+        finally:
+            if conn in self.chat_sockets: self.chat_sockets.remove(conn)
+            try: conn.close()
+            except: pass
+#階段一 (等待)：accept_players 為每條連線開 handshake 執行緒，新玩家拿到座位與 init。階段二 (開始)：人滿了 (seat 設定 filled) -> on_start -> 廣播 gamestart。階段三 (轉發)：forward 執行緒轉發，這裡等到關房。
+    def run_game_server(self):
+        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            srv.bind(("0.0.0.0", self.game_port))
+            srv.listen(max(self.expected_players, 16))
+            self.listeners.append(srv)
+            waiting = timers.call_every(WAIT_CHECK_INTERVAL, self.check_waiting, time.monotonic() + ROOM_FILL_TIMEOUT)
+            threading.Thread(target=self.accept_players, args=(srv,), daemon=True).start()
+            self.filled.wait()
+            waiting.cancel()
+
+            if not self.running: return
+
+            log.info("Session", "Game Start!", room=self.room_id)
+            if self.on_start: self.on_start(self)
+            if self.record: self.start_recording()
+
+            if self.closed.wait(2.0): return
+            self.broadcast_game({"type": "gamestart", "msg": "Game Start!"}, record=True)
+            self.closed.wait()
+
+        except Exception as e:
+            log.error("Session", "game error", room=self.room_id, error=e)
+        finally:
+            self.stop()
+            self.broadcast_game({"type": "error", "msg": "Room closed."})
+            self.spectators.close()
+            self.finish_recording()
+            for t in self.grace_timers.values(): t.cancel()
+            with self.relay_lock: writers = list(self.writers.values())
+            # 盡力把最後的 Room closed 送出去 (所有玩家一起等，最多 CLOSE_FLUSH 秒)
+            deadline = time.monotonic() + CLOSE_FLUSH
+            for w in writers: w.close()
+            for w in writers: w.join(max(0.0, deadline - time.monotonic()))
+            for s in self.game_sockets: 
+                if s is None: continue
+                try: s.close() 
+                except: pass
+            for s in self.chat_sockets:
+                try: s.close()
+                except: pass
+            srv.close()
+            if self.on_close: self.on_close(self)
+#開局時建立 replay 檔；之後 relay 的每個 frame 都會寫入 (帶 monotonic 時間戳)
+    def start_recording(self):
+        try:
+            REPLAY_DIR.mkdir(parents=True, exist_ok=True)
+            fname = f"room{self.room_id}_{int(time.time())}.rpl"
+            self.recorder = ReplayWriter(str(REPLAY_DIR / fname))
+            self.replay_meta = {"game_id": self.game_id, "players": list(self.players), "file": fname, "created": int(time.time())}
+        except OSError as e:
+            log.warn("Session", "replay disabled", room=self.room_id, error=e)
+#所有座位回報的勝負一致、且回報的玩家剛好是這個房間的玩家時，回傳 {"game_id", "winners", "players"} (都是玩家名稱)；否則 None
+    def outcome(self):
+        with self.relay_lock: results, roles = dict(self.results), list(self.roles)
+        if not roles or len(results) != len(roles): return None
+        if len({winners for winners, _ in results.values()}) != 1: return None
+        names = {roles[i]: player for i, (_, player) in results.items()}
+        if len(set(names.values())) != len(roles) or (self.players and set(names.values()) != set(self.players)): return None
+        winners = next(iter(results.values()))[0]
+        if any(r not in names for r in winners): return None
+        return {"game_id": self.game_id, "winners": [names[r] for r in winners], "players": list(names.values())}
+#房間結束：收尾 replay 檔。replay_meta 由 on_close 登記到 DB，玩家才能用 player_replay 下載
+    def finish_recording(self):
+        if not self.recorder: return
+        self.recorder.close()
+        self.recorder = None
+#等待階段 (計時執行緒每 WAIT_CHECK_INTERVAL 秒呼叫)：移除斷線的玩家；過了等人期限仍然沒有人就關房。
+    def check_waiting(self, deadline):
+        with self.relay_lock:
+            if self.started: return
+            self.check_game_connections()
+            empty = not self.game_sockets
+        if empty and time.monotonic() > deadline: self.stop()
+#在等待階段檢查有沒有人斷線，將死掉的連線移除 (ping 由各自的 writer 送；寫入失敗的下一輪就會被移除)。
+    def check_game_connections(self):
+        dead = [i for i, s in enumerate(self.game_sockets) if not self.send_to(s, PING_FRAME)]
+        for i in reversed(dead):
+            self.writers.pop(self.game_sockets[i]).close()
+            try: self.game_sockets[i].close()
+            except: pass
+            del self.game_sockets[i], self.tokens[i], self.roles[i]
+#game port 從開房到關房都用這條執行緒 accept；判斷新玩家還是 resume 交給每條連線自己的 handshake 執行緒，同時連進來的人不必排隊
+    def accept_players(self, srv):
+        while self.running:
+            try:
+                conn, _ = srv.accept()
+            except OSError: break
+            threading.Thread(target=self.handshake, args=(conn,), daemon=True).start()
+
+    def handshake(self, conn):
+        try:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # relay 的 frame 都很小，不要等 delayed ACK
+            # 開局前：新玩家連上後只等 init，不會先送東西；RESUME_PEEK 內送來第一個 frame 的是斷線重連的 client
+            # 開局後：只接受 resume，給 client 比較久的時間送出第一個 frame
+            readable, _, _ = select.select([conn], [], [], 5.0 if self.started else RESUME_PEEK)
+            if not readable and not self.started: return self.seat(conn)
+            conn.settimeout(5.0)
+            msg = robust_recv_frame(conn) if readable else None
+            conn.settimeout(None)
+            self.try_resume(conn, msg)
+        except (OSError, ValueError):
+            try: conn.close()
+            except OSError: pass
+#新玩家：分配座位並送 init；最後一個座位坐滿時開始轉發並叫醒 run_game_server 開局
+    def seat(self, conn):
+        token = secrets.token_hex(16)
+        with self.relay_lock:  # check_waiting 在計時執行緒上也會改這三個 list
+            full = self.started or len(self.game_sockets) >= self.expected_players
+            if not full:
+                if self.expected_players == 2:
+                    role = ["black", "white"][len(self.game_sockets)]
+                else:
+                    role = f"P{len(self.game_sockets) + 1}"
+                self.game_sockets.append(conn)
+                self.tokens.append(token)
+                self.roles.append(role)
+                self.writers[conn] = PlayerWriter(conn)
+                self.send_to(conn, encode_frame({"type": "init", "role": role, "token": token, "msg": "Waiting..."}))
+                if len(self.game_sockets) == self.expected_players:
+                    self.started = True
+                    for i, sock in enumerate(self.game_sockets):
+                        threading.Thread(target=self.forward, args=(i, sock), daemon=True).start()
+                    self.filled.set()
+        if full:
+            try: send_frame(conn, {"type": "error", "msg": "Room is full."})
+            except OSError: pass
+            conn.close()
+            return
+        log.info("Session", f"Player {role} joined", room=self.room_id)
+#交給 writer 排隊送出 (呼叫端持有 relay_lock)；連線已經死掉或塞爆時回傳 False
+    def send_to(self, sock, data):
+        w = self.writers.get(sock)
+        if w is None or not w.send(data): return False
+        self.bytes_out += len(data)
+        return True
+
+    def forward(self, idx, source):
+        try:
+            while self.running:
+                msg, size = recv_frame_sized(source)
+                if msg is None: break
+                with self.relay_lock: self.bytes_in += size
+                type_ = msg.get("type")
+                if type_ in ("ping", "resume"): continue
+                if type_ == "result":
+                    with self.relay_lock: self.results[idx] = (tuple(sorted(map(str, msg.get("winners") or []))), str(msg.get("player", "")))
+                    continue
+                if type_ == "leave":
+                    # 玩家主動離開 (關閉視窗)：照舊結束房間
+                    self.stop()
+                    break
+                self.relay(idx, msg)
+        except: pass
+        finally:
+            if self.running: self.player_dropped(idx, source)
+
+    #指派 seq、只序列化一次，送給其他玩家 / 觀眾 / replay；在鎖內進行以保證三者順序一致
+    #給玩家的部分只是排進各自的 writer，卡住的玩家不會擋住其他人、resume 與計時執行緒
+    def relay(self, source_idx, msg, record=True):
+        with self.relay_lock:
+            self.seq += 1
+            msg["seq"] = self.seq
+            data = encode_frame(msg)
+            self.sent_log.append((self.seq, source_idx, data))
+            for i, other in enumerate(self.game_sockets):
+                if i != source_idx and other is not None: self.send_to(other, data)
+            self.spectators.publish(msg, data)
+            if record and self.recorder: self.recorder.record(msg, data)
+
+    def player_dropped(self, idx, sock):
+        with self.relay_lock:
+            if self.game_sockets[idx] is not sock: return  # 已經被新的 resume 連線取代
+            self.game_sockets[idx] = None
+            w = self.writers.pop(sock, None)
+        if w: w.close()
+        try: sock.close()
+        except: pass
+        role = self.roles[idx]
+        log.info("Session", f"Player {role} disconnected, waiting {RESUME_GRACE:.0f}s for resume", room=self.room_id)
+        self.relay(idx, {"type": "player_disconnected", "role": role, "grace": RESUME_GRACE}, record=False)
+        old = self.grace_timers.pop(idx, None)
+        if old: old.cancel()
+        self.grace_timers[idx] = timers.call_later(RESUME_GRACE, self.grace_expired, idx)
+
+    def grace_expired(self, idx):
+        if self.running and self.game_sockets[idx] is None:
+            log.info("Session", f"Player {self.roles[idx]} did not come back, closing room", room=self.room_id)
+            self.stop()
+
+    #第一個 frame 必須是 {"type": "resume", "token", "last_seq"}；驗證後換掉座位上的舊連線並補送 last_seq 之後錯過的 frame。
+    #開局前斷線的 client (auto_reconnect) 也走這裡，拿回原本的座位而不是再佔一個新座位
+    def try_resume(self, conn, msg):
+        token = str((msg or {}).get("token", ""))
+        try: last_seq = int((msg or {}).get("last_seq", 0))
+        except (TypeError, ValueError): last_seq = 0
+        error = None
+        with self.relay_lock:
+            idx = next((i for i, t in enumerate(self.tokens) if msg and msg.get("type") == "resume" and hmac.compare_digest(t, token)), None)
+            if idx is None:
+                error = "Room is full." if self.started else "Resume window expired."
+            elif self.sent_log and self.sent_log[0][0] > last_seq + 1:
+                error = "Resume window expired."  # 需要補送的部分已經不在 log 裡，就無法續玩
+            else:
+                role, started, old = self.roles[idx], self.started, self.game_sockets[idx]
+                w = self.writers[conn] = PlayerWriter(conn)
+                missed = [data for seq, src, data in self.sent_log if seq > last_seq and src != idx]
+                self.send_to(conn, encode_frame({"type": "resumed", "role": role, "seq": self.seq}))
+                if missed: self.send_to(conn, b"".join(missed))
+                self.game_sockets[idx] = conn
+                old_w = self.writers.pop(old, None) if old is not None else None
+        if error:
+            try: send_frame(conn, {"type": "error", "msg": error})
+            except OSError: pass
+            conn.close()
+            return
+        timer = self.grace_timers.pop(idx, None)
+        if timer: timer.cancel()
+        if old_w: old_w.close()
+        if old is not None:
+            try: old.close()
+            except: pass
+        log.info("Session", f"Player {role} resumed" if started else f"Player {role} resumed before start", room=self.room_id, missed=len(missed))
+        if not started: return  # forward 執行緒在坐滿時才啟動
+        self.relay(idx, {"type": "player_reconnected", "role": role}, record=False)
+        threading.Thread(target=self.forward, args=(idx, conn), daemon=True).start()
+
+    def broadcast_game(self, msg, record=False):
+        self.relay(-1, msg, record=record)
+
+    #給 metrics：流量 (玩家 + 觀眾) 與目前的連線數
+    def stats(self):
+        return {"bytes_in": self.bytes_in, "bytes_out": self.bytes_out + self.spectators.bytes_out,
+                "sockets": sum(1 for s in self.game_sockets if s is not None) + len(self.chat_sockets) + self.spectators.count()}
@@ -0,0 +1,142 @@
+# server/log.py
+#
+# 伺服器共用的非同步 log
+# - 呼叫端只把一筆 record (時間、等級、來源、訊息、欄位) 放進記憶體佇列就返回；
+#   背景執行緒批次寫到 stdout (或 --log-file)，持有 LOCK / 在 relay 執行緒上 log 不會卡在終端機 I/O
+# - 等級 debug < info < warn < error；低於門檻的呼叫在格式化之前就返回。
+#   熱路徑上的 debug 用 `if log.DEBUG: log.debug(...)`，關閉時連參數都不會建立
+# - rate=N：同一個 (來源, 訊息) 每秒最多輸出 N 筆，被略過的筆數記在下一筆的 "suppressed" 欄位
+# - 輸出格式：text ("[DB] 訊息 key=value"，預設) 或 json (每行一個 JSON 物件)
+# - 佇列超過 MAX_PENDING 筆 (輸出端卡住) 就丟掉新的並計數，不會讓呼叫端等待或吃光記憶體
+# - 等級 / 格式也可用環境變數 LOG_LEVEL / LOG_FORMAT 設定；configure() 會寫回環境變數，spawn 出來的 worker 行程沿用
+
+import atexit
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Deque, Dict, Optional, TextIO, Tuple
+
+LEVELS = {"debug": 10, "info": 20, "warn": 30, "error": 40}
+MAX_PENDING = 100000
+FLUSH_INTERVAL = 0.1  # 佇列裡有東西時，最久多久寫一次
+
+_level = LEVELS.get(os.environ.get("LOG_LEVEL", "info"), 20)
+_format = os.environ.get("LOG_FORMAT", "text")
+DEBUG = _level <= LEVELS["debug"]  # 給熱路徑判斷用
+
+_out: TextIO = sys.stdout
+_pending: Deque[Tuple[float, str, str, str, Dict[str, Any]]] = collections.deque()
+_wake = threading.Event()
+_write_lock = threading.Lock()
+_writer: Optional[threading.Thread] = None
+_start_lock = threading.Lock()
+_dropped = 0
+_limits: Dict[Tuple[str, str], list] = {}  # (來源, 訊息) -> [這一秒, 已輸出筆數, 被略過的筆數]
+
+
+def configure(level: Optional[str] = None, fmt: Optional[str] = None, path: Optional[str] = None) -> None:
+    global _level, _format, DEBUG, _out
+    if level:
+        _level = LEVELS[level]
+        os.environ["LOG_LEVEL"] = level
+    if fmt:
+        _format = fmt
+        os.environ["LOG_FORMAT"] = fmt
+    if path:
+        flush()
+        _out = open(path, "a", encoding="utf-8", buffering=1)
+    DEBUG = _level <= LEVELS["debug"]
+
+
+def _emit(level: str, src: str, msg: str, fields: Dict[str, Any]) -> None:
+    global _dropped, _writer
+    if LEVELS[level] < _level: return
+    now = time.time()
+    rate = fields.pop("rate", None)
+    if rate is not None:
+        key = (src, msg)
+        sec = int(now)
+        slot = _limits.get(key)
+        if slot is None or slot[0] != sec:
+            skipped = slot[2] if slot else 0
+            slot = _limits[key] = [sec, 0, 0]
+            if skipped: fields["suppressed"] = skipped
+        if slot[1] >= rate:
+            slot[2] += 1
+            return
+        slot[1] += 1
+    if len(_pending) >= MAX_PENDING:
+        _dropped += 1
+        return
+    _pending.append((now, level, src, msg, fields))
+    if _writer is None: _start()
+    if not _wake.is_set(): _wake.set()
+
+
+def debug(src: str, msg: str, **fields: Any) -> None:
+    _emit("debug", src, msg, fields)
+
+
+def info(src: str, msg: str, **fields: Any) -> None:
+    _emit("info", src, msg, fields)
+
+
+def warn(src: str, msg: str, **fields: Any) -> None:
+    _emit("warn", src, msg, fields)
+
+
+def error(src: str, msg: str, **fields: Any) -> None:
+    _emit("error", src, msg, fields)
+
+
+# --- 背景寫出 ---
+def _render(rec: Tuple[float, str, str, str, Dict[str, Any]]) -> str:
+    ts, level, src, msg, fields = rec
+    if _format == "json":
+        d = {"ts": datetime.fromtimestamp(ts).isoformat(timespec="milliseconds"), "level": level, "src": src, "msg": msg}
+        d.update(fields)
+        return json.dumps(d, ensure_ascii=False, default=str)
+    tag = f"[{src}]" if level in ("info", "debug") else f"[{src}][{level.upper()}]"
+    extra = "".join(f" {k}={v}" for k, v in fields.items())
+    return f"{tag} {msg}{extra}"
+
+
+def flush() -> None:
+    """把佇列裡的 record 全部寫出 (背景執行緒與結束前呼叫)。"""
+    global _dropped
+    with _write_lock:
+        lines = []
+        while _pending:
+            lines.append(_render(_pending.popleft()))
+        if _dropped:
+            lines.append(_render((time.time(), "warn", "Log", "queue full, records dropped", {"dropped": _dropped})))
+            _dropped = 0
+        if not lines: return
+        try:
+            _out.write("\n".join(lines) + "\n")
+            _out.flush()
+        except (OSError, ValueError):
+            pass
+
+
+def _loop() -> None:
+    while True:
+        _wake.wait()
+        _wake.clear()
+        flush()
+        time.sleep(FLUSH_INTERVAL)  # 讓高頻的 log 累積成一批再寫
+
+
+def _start() -> None:
+    global _writer
+    with _start_lock:
+        if _writer is not None: return
+        _writer = threading.Thread(target=_loop, name="log-writer", daemon=True)
+        _writer.start()
+
+
+atexit.register(flush)
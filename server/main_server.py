@@ -1,12 +1,14 @@
 # server/main_server.py
 
 import socket
+import signal
 import threading
 import random
 import time
-import struct
-import json
-from typing import Any, Dict, Tuple, Optional, List
+import collections
+import os
+import argparse
+from typing import Any, Dict, Tuple, Optional, List, Set, Deque
 import sys
 from pathlib import Path
 
@@ -15,68 +17,203 @@ ROOT = Path(__file__).resolve().parent.parent
 if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))
 
-from common.protocol import send_frame, recv_frame, recv_file, send_file
+from common.protocol import send_frame, recv_frame, recv_file, send_file, encode_frame
+from server.game_session import GameSession, REPLAY_DIR, RECORD_REPLAYS
+from server.session_worker import SessionWorkerPool
+from server.matchmaking import Matchmaker, Ticket, DEFAULT_RATING, update_ratings
+from server.state_server import StateStore, StateClient, PORT as STATE_PORT
+from server import auth
+from server.presence import Presence
+from server import timers
+from server import metrics
+from server import log
+from server import tracing
+from server import profiler
 
 # --- 設定與全域變數 ---
 DB_HOST = "127.0.0.1"
 DB_PORT = 9900
+# db follower (--db-replica)：read / list / query 分散到這些節點，其餘寫入一律送 primary (DB_HOST:DB_PORT)
+DB_REPLICAS: List[Tuple[str, int]] = []
+DB_READS = ("read", "list", "query")
+# 每條 client 連線由自己的執行緒處理 (= 一個 session)：記下該執行緒最後一次寫入的 (epoch, seq)，
+# 讀 replica 時要求它至少追到這裡 (read-your-writes)
+_DB_TLS = threading.local()
 HOST = "0.0.0.0"
 PORT = 9800
 
-ONLINE: Dict[Tuple[str, str], int] = {}
-ROOMS_LOCK = threading.Lock()
-ROOMS: Dict[int, Dict[str, Any]] = {}
-NEXT_ROOM_ID = 1
-STORAGE_DIR = ROOT / "server" / "storage"
+# 線上名單 / 房間 / 房號放在共享狀態 (StateStore)，多個 Lobby 才能互相看到：
+#   online:<type>:<user> -> "<instance>/<連線>/<session id>" (TTL，由心跳延長)
+#   auth:secret          -> session token 的簽章金鑰 (所有 Lobby 共用，token 在哪個 Lobby 都能 resume)
+#   revoked:<session id> -> 已登出的 token (TTL = token 剩餘效期)
+#   room:<id>            -> 房間資訊 (TTL，由開房的 instance 心跳延長；該 instance 掛掉會自動消失)
+#   port:<game_port>     -> 佔用此 port 的 instance
+#   next_room_id         -> 房號計數器
+# 單一 Lobby 時用行程內的 StateStore；main() 帶 --state 時改連 state_server
+STATE = StateStore()
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+EVENTS_CHANNEL = "lobby_events"
+ONLINE_TTL = 30.0
+ROOM_TTL = 30.0
+HEARTBEAT_INTERVAL = 10.0
+# 這個 instance 持有的 online key 與各連線的最後活動時間 (分片 + 時間輪)；
+# client 每 HEARTBEAT_INTERVAL 秒送 heartbeat，超過 PRESENCE_TTL 沒動靜 (當機 / 半開的連線) 就關掉連線釋放帳號
+PRESENCE_TTL = 45.0
+# 帳號 -> 密碼雜湊的行程內快取；auth:secret 在 main() 取得
+USERS = auth.UserCache()
+AUTH_SECRET = b""
+# 每條 lobby 連線的送出鎖與推播佇列：回應與 Server 主動推播 (配對成功、訂閱事件) 不可交錯
+SEND_LOCKS: Dict[socket.socket, threading.Lock] = {}
+OUTBOX: Dict[socket.socket, Deque[bytes]] = {}
+# 訂閱：topic ("rooms" / "room:<id>" / "game:<id>") -> 訂閱的 lobby 連線
+SUBS_LOCK = threading.Lock()
+SUBSCRIBERS: Dict[str, Set[socket.socket]] = {}
+# 這個 instance 開的房間：room_id -> worker id (或行程內的 GameSession)
+OWNED_LOCK = threading.Lock()
+OWNED_ROOMS: Dict[int, Any] = {}
+# GameSession 跑在幾個 worker 行程 (預設每核心一個)；0 代表照舊在 Lobby 行程內開執行緒
+SESSION_WORKERS = os.cpu_count() or 1
+STORAGE_DIR = ROOT / "server" / "storage"  # 可用 --storage-dir 改 (bench 用暫存目錄)
 GAME_PORT_RANGE = list(range(20000, 20100))
 
-# --- Network Helpers ---
-def recv_exact(sock, n):
-    data = b''
-    try:
-        while len(data) < n:
-            chunk = sock.recv(n - len(data))
-            if not chunk: return None
-            data += chunk
-        return data
-    except: return None
-
-def robust_recv_frame(sock):
+#主動推送訊息到某條 lobby 連線 (訊息帶 "type"，回應則帶 "status")
+#連線正在處理 request 時不等待，先排進 OUTBOX，由 client_worker 回應後送出
+def push_bytes(conn, data):
+    box = OUTBOX.get(conn)
+    if box is None: return
+    box.append(data)
+    _drain(conn)
+
+def push_frame(conn, msg):
+    push_bytes(conn, encode_frame(msg))
+
+def _drain(conn):
+    lock, box = SEND_LOCKS.get(conn), OUTBOX.get(conn)
+    if lock is None or box is None: return
+    # 放開鎖後要再檢查一次，避免別的執行緒在我們送的期間排進來卻拿不到鎖
+    while box and lock.acquire(blocking=False):
+        try:
+            while box:
+                try: conn.sendall(box.popleft())
+                except OSError: box.clear()
+        finally:
+            lock.release()
+
+#事件經由共享狀態的 channel 廣播，每個 Lobby (包含自己) 再推給本地的訂閱者
+def publish(topic, event, data):
+    STATE.publish(EVENTS_CHANNEL, {"topics": [topic], "event": event, "data": data})
+
+#房間變動同時通知房間列表與該房間的訂閱者
+def publish_room(event, data):
+    STATE.publish(EVENTS_CHANNEL, {"topics": ["rooms", f"room:{data['id']}"], "event": event, "data": data})
+
+def _on_lobby_event(msg):
+    event, data = msg.get("event"), msg.get("data") or {}
+    for topic in msg.get("topics", []):
+        with SUBS_LOCK: conns = list(SUBSCRIBERS.get(topic, ()))
+        if conns:
+            # 每個事件只編碼一次
+            frame = encode_frame({"type": "event", "topic": topic, "event": event, "data": data})
+            for c in conns: push_bytes(c, frame)
+    if event == "room_closed":
+        with SUBS_LOCK: SUBSCRIBERS.pop(f"room:{data['id']}", None)
+    elif event == "room_updated":
+        # 別的 Lobby 處理的加入房間：更新在這裡跑的 session 的玩家名單
+        with OWNED_LOCK: owner = OWNED_ROOMS.get(data["id"])
+        if isinstance(owner, GameSession): owner.players = list(data["players"])
+        elif owner is not None: WORKERS.update_players(owner, data["id"], data["players"])
+
+def _rooms():
+    return sorted(STATE.scan("room:").values(), key=lambda r: r["id"])
+
+def _get_room(rid):
+    return STATE.get(f"room:{rid}")
+
+#心跳 (每 HEARTBEAT_INTERVAL 秒由時間輪呼叫)：延長本 instance 持有的 online / room / port key，instance 當掉時這些 key 會自己過期
+def _heartbeat():
     try:
-        header = recv_exact(sock, 4)
-        if not header: return None
-        (length,) = struct.unpack("!I", header)
-        body = recv_exact(sock, length)
-        if not body: return None
-        return json.loads(body.decode("utf-8"))
-    except: return None
-
-def send_ping_unsafe(sock):
-    data = json.dumps({"type": "ping"}).encode("utf-8")
-    header = struct.pack("!I", len(data))
-    sock.sendall(header + data)
+        STATE.touch(PRESENCE.keys(), ONLINE_TTL)
+        with OWNED_LOCK: rids = list(OWNED_ROOMS)
+        ports = [r["game_port"] for r in (_get_room(rid) for rid in rids) if r]
+        STATE.touch([f"room:{rid}" for rid in rids] + [f"port:{p}" for p in ports], ROOM_TTL)
+    except Exception as e:
+        log.warn("MAIN", "heartbeat failed", error=e)
 
 # --- DB & Logic Helpers ---
 #建立一個短暫連線到 DB Server，送出請求並等待回應
-def db_req(req: Dict[str, Any]) -> Dict[str, Any]:
-    try:
-        with socket.create_connection((DB_HOST, DB_PORT)) as s:
+def _db_send(addr, req):
+    # 連不上時丟 OSError：請求還沒送出，可以安全地換節點重試
+    t0 = time.perf_counter() if metrics.ENABLED else 0.0
+    with tracing.child(f"db_req {req.get('action')}") as span:
+        # 追蹤中：把 trace / 這個 span 帶給 db_server，它的 span 會接在這裡底下
+        if span: req = dict(req, trace=span.trace, parent=span.id)
+        with socket.create_connection(addr) as s:
             send_frame(s, req)
-            return recv_frame(s) or {"status": "error", "error": "db no response"}
-    except Exception as e:
-        return {"status": "error", "error": f"db connection failed: {e}"}
+            r = recv_frame(s) or {"status": "error", "error": "db no response"}
+    if metrics.ENABLED: metrics.observe("lobby_db_rtt_seconds", time.perf_counter() - t0, action=req.get("action"))
+    return r
+
+#primary 連不上 (或發現連到的是 follower) 時，問一輪所有 db 節點，找出目前的 primary
+def _find_db_primary():
+    global DB_HOST, DB_PORT
+    for addr in [(DB_HOST, DB_PORT)] + DB_REPLICAS:
+        try: r = _db_send(addr, {"action": "ping"})
+        except OSError: continue
+        if r.get("status") == "ok" and r.get("role", "primary") == "primary":
+            if addr != (DB_HOST, DB_PORT): log.info("MAIN", f"DB primary is now {addr[0]}:{addr[1]}")
+            DB_HOST, DB_PORT = addr
+            return True
+    return False
+
+def db_req(req: Dict[str, Any]) -> Dict[str, Any]:
+    if DB_REPLICAS and req.get("action") in DB_READS:
+        epoch, seq = getattr(_DB_TLS, "last_write", (None, 0))
+        try:
+            r = _db_send(random.choice(DB_REPLICAS), dict(req, epoch=epoch, min_seq=seq) if seq else req)
+            if r.get("error") not in ("stale", "db no response"): return r
+        except OSError:
+            pass  # replica 掛了或還沒追上：改讀 primary
+    for attempt in range(2):
+        try:
+            r = _db_send((DB_HOST, DB_PORT), req)
+            if r.get("error") != "read_only": break
+        except OSError as e:
+            r = {"status": "error", "error": f"db connection failed: {e}"}
+        if attempt or not DB_REPLICAS or not _find_db_primary(): break
+    if "seq" in r: _DB_TLS.last_write = (r.pop("epoch", None), r.pop("seq"))
+    return r
 #將參與這場遊戲的所有玩家，在資料庫中的 has_played 欄位設為 True
 def _record_play_history(game_id: str, players: List[str]):
     for p in players:
-        r = db_req({"action": "query", "collection": "player_games", "filter": {"player": p, "game_id": game_id}})
+        r = db_req({"action": "query", "collection": "player_games", "filter": {"player": p, "game_id": game_id},
+                    "fields": ["id"], "limit": 1})
         if r.get("status") == "ok" and r.get("result"):
             rec_id = r["result"][0]["id"]
             db_req({"action": "update", "collection": "player_games", "id": rec_id, "patch": {"has_played": True}})
 #去資料庫查找特定的使用者資料
 def _find_user(utype, user):
     col = "developers" if utype == "developer" else "players"
-    res = db_req({"action": "query", "collection": col, "filter": {"username": user}})
+    res = db_req({"action": "query", "collection": col, "filter": {"username": user},
+                  "fields": ["username", "password"], "limit": 1})
     return res["result"][0] if res.get("result") else None
+#密碼雜湊：先查行程內快取，沒有才問 DB
+@tracing.traced
+def _stored_password(utype, user):
+    stored = USERS.get(utype, user)
+    if stored is None:
+        u = _find_user(utype, user)
+        if u and isinstance(u.get("password"), str):
+            stored = u["password"]
+            USERS.put(utype, user, stored)
+    return stored
+#舊資料的明文密碼 (或雜湊參數改過) 在登入成功時換成新的雜湊；cas 避免蓋掉別人同時的更新
+def _upgrade_password(utype, user, old, password):
+    col = "developers" if utype == "developer" else "players"
+    u = _find_user(utype, user)
+    if not u: return
+    new = auth.hash_password(password)
+    r = db_req({"action": "cas", "collection": col, "id": u["id"], "expect": {"password": old}, "patch": {"password": new}})
+    if r.get("status") == "ok": USERS.put(utype, user, new)
 #確認目前的連線 Session 是否已登入，且身分正確。
 def _require_player(s):
     if not s.get("logged_in") or s.get("user_type") != "player":
@@ -86,178 +223,99 @@ def _require_dev(s):
     if not s.get("logged_in") or s.get("user_type") != "developer":
         return {"status": "error", "error": "Dev Auth required"}
 #檢查玩家擁有的遊戲版本，是否等於 Server 上的最新版本
+@tracing.traced
 def _check_version(user, gid):
     r1 = db_req({"action": "read", "collection": "games", "id": gid})
     if r1.get("status")!="ok": return False
-    r2 = db_req({"action": "query", "collection": "player_games", "filter": {"player": user, "game_id": gid}})
+    r2 = db_req({"action": "query", "collection": "player_games", "filter": {"player": user, "game_id": gid},
+                 "fields": ["version"], "limit": 1})
     return r2.get("result") and r2["result"][0]["version"] == r1["result"]["version"]
 
-# --- GameSession Class ---
-class GameSession(threading.Thread):
-    def __init__(self, room_id: int, game_port: int, players_count: int = 2):
-        super().__init__()
-        self.room_id = room_id
-        self.game_port = game_port
-        self.chat_port = game_port + 5000 
-        self.expected_players = players_count
-        self.game_sockets = []
-        self.chat_sockets = [] 
-        self.running = True
-        self.daemon = True 
-
-    def run(self):
-        print(f"[Session {self.room_id}] Game Port: {self.game_port}, Chat Port: {self.chat_port}")
-        threading.Thread(target=self.run_chat_server, daemon=True).start()
-        self.run_game_server()
-#啟動 Plugin 用的聊天 Socket Server。邏輯：等待連線 -> 接受連線 -> 為每個連線開啟 chat_relay 執行緒。
-    def run_chat_server(self):
-        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        try:
-            srv.bind(("0.0.0.0", self.chat_port))
-            srv.listen(10)
-            srv.settimeout(1.0)
-            while self.running:
-                try:
-                    conn, _ = srv.accept()
-                    self.chat_sockets.append(conn)
-                    threading.Thread(target=self.chat_relay, args=(conn,), daemon=True).start()
-                except socket.timeout: continue
-                except: break
-        finally:
-            srv.close()
-    #聊天室廣播
-    def chat_relay(self, conn):
-        try:
-            while self.running:
-                msg = robust_recv_frame(conn)
-                if not msg: break
-                dead = []
-                for s in self.chat_sockets:
-                    try:
-                        data = json.dumps(msg).encode("utf-8")
-                        header = struct.pack("!I", len(data))
-                        s.sendall(header + data)
-                    except: dead.append(s)
-                for d in dead: 
-                    if d in self.chat_sockets: self.chat_sockets.remove(d)
-        except: pass
-        finally:
-            if conn in self.chat_sockets: self.chat_sockets.remove(conn)
-            try: conn.close()
-            except: pass
-#階段一 (等待)：等待玩家連線，發送 init 。階段二 (開始)：人滿了 -> 呼叫 _record_play_history (紀錄已遊玩) -> 廣播 gamestart。階段三 (轉發)：進入 game_relay_loop。
-    def run_game_server(self):
-        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        try:
-            srv.bind(("0.0.0.0", self.game_port))
-            srv.listen(self.expected_players)
-            srv.settimeout(1.0)
-            start_time = time.time() 
-            
-            while len(self.game_sockets) < self.expected_players and self.running:
-                try:
-                    conn, addr = srv.accept()
-                    conn.settimeout(None) 
-                    
-                    if self.expected_players == 2:
-                        roles = ["black", "white"]
-                        role = roles[len(self.game_sockets)]
-                    else:
-                        role = f"P{len(self.game_sockets) + 1}"
-
-                    self.game_sockets.append(conn)
-                    print(f"[Session {self.room_id}] Player {role} joined.")
-                    send_frame(conn, {"type": "init", "role": role, "msg": "Waiting..."})
-                    time.sleep(0.2)
-                except socket.timeout:
-                    self.check_game_connections()
-                    if not self.game_sockets and time.time() - start_time > 60:
-                        self.running = False
-                except: pass
-
-            if not self.running: return
-
-            print(f"[Session {self.room_id}] Game Start!")
-            with ROOMS_LOCK:
-                if self.room_id in ROOMS:
-                    players = ROOMS[self.room_id]["players"]
-                    game_id = str(ROOMS[self.room_id]["game_id"])
-                    threading.Thread(target=_record_play_history, args=(game_id, players)).start()
-
-            time.sleep(2.0)
-            self.broadcast_game({"type": "gamestart", "msg": "Game Start!"})
-            self.game_relay_loop()
-
-        except Exception as e:
-            print(f"[Session {self.room_id}] Game Error: {e}")
-        finally:
-            self.running = False
-            self.broadcast_game({"type": "error", "msg": "Room closed."})
-            for s in self.game_sockets: 
-                try: s.close() 
-                except: pass
-            for s in self.chat_sockets:
-                try: s.close()
-                except: pass
-            srv.close()
-            with ROOMS_LOCK:
-                if self.room_id in ROOMS: del ROOMS[self.room_id]
-#在等待階段檢查有沒有人斷線，將死掉的連線移除。
-    def check_game_connections(self):
-        dead = []
-        for s in self.game_sockets:
-            try: send_ping_unsafe(s)
-            except: dead.append(s)
-        for s in dead: self.game_sockets.remove(s)
-#收到某玩家的遊戲指令 (移動、下棋)，直接轉發給其他所有玩家。
-    def game_relay_loop(self):
-        def forward(source, role):
-            try:
-                while self.running:
-                    msg = robust_recv_frame(source)
-                    if msg is None: break
-                    if msg.get("type") == "ping": continue
-                    for other in self.game_sockets:
-                        if other != source:
-                            try: send_frame(other, msg)
-                            except: pass
-            except: pass
-            finally: self.running = False
-
-        for i, sock in enumerate(self.game_sockets):
-            threading.Thread(target=forward, args=(sock, f"P{i}"), daemon=True).start()
-        
-        while self.running: time.sleep(1)
-
-    def broadcast_game(self, msg):
-        for s in self.game_sockets:
-            try: send_frame(s, msg)
-            except: pass
-
 # --- Handlers ---
 
+#查詢與建立在 DB 端一次完成 (username 唯一索引)，同時註冊同名帳號不會產生兩筆
 def handle_register(conn, session, data): 
     user_type = data.get("user_type")
     username = data.get("username")
-    if _find_user(user_type, username):
+    stored = auth.hash_password(str(data["password"]))
+    res = db_req({"action": "create_if_absent", "collection": user_type+"s", "record": {"username": username, "password": stored}})
+    if res.get("status") == "ok" and not res.get("created"):
         return {"status": "error", "error": "帳號已存在"}
-    return db_req({"action": "create", "collection": user_type+"s", "record": {"username": username, "password": data["password"]}})
+    if res.get("status") == "ok":
+        USERS.put(user_type, username, stored)
+        res["result"] = {k: v for k, v in res["result"].items() if k != "password"}
+    return res
 
+#登入成功回傳 token，斷線重連時送 resume 即可接回身分
 def handle_login(conn, session, data):
-    u = _find_user(data["user_type"], data["username"])
-    if u and u["password"] == data["password"]:
-        key = (data["user_type"], data["username"])
-        if key in ONLINE: return {"status": "error", "error": "此帳號已在別處登入"}
-        session.update({"logged_in": True, "user_type": data["user_type"], "username": data["username"]})
-        ONLINE[key] = 1
-        return {"status": "ok"}
-    return {"status": "error", "error": "帳號或密碼錯誤"}
+    utype, user, password = data["user_type"], data["username"], str(data["password"])
+    stored = _stored_password(utype, user)
+    if not stored or not auth.verify_password(password, stored):
+        return {"status": "error", "error": "帳號或密碼錯誤"}
+    sid = auth.new_session_id()
+    if err := _start_session(conn, session, utype, user, sid): return err
+    if auth.needs_rehash(stored): _upgrade_password(utype, user, stored, password)
+    return {"status": "ok", "token": auth.sign_token(AUTH_SECRET, utype, user, sid)}
+
+#驗證 token 的簽章與效期 (不查 DB)，接回原本的 session，並換發新的 token
+def handle_resume(conn, session, data):
+    claims = auth.verify_token(AUTH_SECRET, data.get("token"))
+    if claims is None or STATE.get(f"revoked:{claims['sid']}"):
+        return {"status": "error", "error": "token 無效或已過期，請重新登入"}
+    if err := _start_session(conn, session, claims["t"], claims["u"], claims["sid"], resume=True): return err
+    return {"status": "ok", "user_type": claims["t"], "username": claims["u"],
+            "token": auth.sign_token(AUTH_SECRET, claims["t"], claims["u"], claims["sid"])}
+
+#佔用 online key；resume 時舊連線 (同一個 session id) 可能還沒被偵測到斷線，允許直接接手
+def _start_session(conn, session, utype, user, sid, resume=False):
+    # holder 每條連線不同 (同一個 Lobby 上的舊連線結束時才不會刪掉新連線的 key)，結尾是 session id
+    key, holder = f"online:{utype}:{user}", f"{INSTANCE_ID}/{auth.new_session_id()}/{sid}"
+    if session.get("online_key") == key: return {"status": "error", "error": "此帳號已在別處登入"}
+    if not STATE.set(key, holder, ttl=ONLINE_TTL, nx=True):
+        cur = STATE.get(key)
+        if not (resume and isinstance(cur, str) and cur.endswith(f"/{sid}") and STATE.cas(key, cur, holder, ttl=ONLINE_TTL)):
+            return {"status": "error", "error": "此帳號已在別處登入"}
+    _release_online(session)  # 同一條連線換帳號登入
+    entry, old = PRESENCE.join(key, holder, conn)
+    if old is not None and old.conn is not conn: _kick(old.conn)  # 被 resume 接手的舊連線
+    session.update({"logged_in": True, "user_type": utype, "username": user, "online_key": key,
+                    "online_holder": holder, "sid": sid, "presence": entry})
+
+def _release_online(session):
+    key, holder = session.get("online_key"), session.get("online_holder")
+    if not key: return
+    PRESENCE.leave(key, holder)
+    STATE.cas(key, holder, None)  # 已被重連的新連線接手時不會刪到它
+
+#關掉連線：client_worker 的 recv 會結束，照常在 finally 裡清理
+def _kick(conn):
+    try: conn.shutdown(socket.SHUT_RDWR)
+    except OSError: pass
+
+def _on_presence_expired(entry):
+    log.info("MAIN", f"{entry.key} idle for {PRESENCE.ttl:.0f}s, closing connection")
+    _kick(entry.conn)
+
+PRESENCE = Presence(_on_presence_expired, ttl=PRESENCE_TTL)
+
+#client 定期送的心跳：client_worker 收到任何 frame 都會延長 presence，這裡不必回覆
+def handle_heartbeat(conn, session, data):
+    return None
+
+#線上玩家：帶 usernames 時回傳每個人是否在線，否則回傳所有在線玩家 (跨 Lobby，來自共享狀態)
+def player_list_online(conn, session, data):
+    if err := _require_player(session): return err
+    names = data.get("usernames")
+    if names is not None:
+        return {"status": "ok", "result": {str(u): STATE.get(f"online:player:{u}") is not None for u in list(names)[:200]}}
+    return {"status": "ok", "result": sorted(k.split(":", 2)[2] for k in STATE.scan("online:player:"))}
 
 def handle_logout(conn, session, data): 
     if session.get("logged_in"): 
-        ONLINE.pop((session.get("user_type"), session.get("username")), None)
+        _release_online(session)
+        MATCHMAKER.dequeue(session.get("username"))
+        STATE.set(f"revoked:{session['sid']}", True, ttl=auth.TOKEN_TTL)
+    handle_unsubscribe(conn, session, {})
     session.clear()
     return {"status": "ok"}
 
@@ -271,8 +329,9 @@ def dev_create_game(c, s, d):
 
 def dev_list_games(c, s, d):
     if err := _require_dev(s): return err
-    res = db_req({"action": "query", "collection": "games", "filter": {"owner": s["username"]}})
-    return {"status": "ok", "result": [g for g in res.get("result",[]) if not g.get("deleted")]}
+    res = db_req({"action": "query", "collection": "games", "filter": {"owner": s["username"], "deleted": {"$ne": True}},
+                  "fields": ["name", "version", "description", "max_players", "game_type"]})
+    return {"status": "ok", "result": res.get("result", [])}
 
 def dev_update_game(c, s, d):
     if err := _require_dev(s): return err
@@ -282,7 +341,9 @@ def dev_update_game(c, s, d):
     if r["result"]["owner"] != s["username"]: return {"status": "error", "error": "無權限"}
     patch = {"version": d["version"]}
     if "description" in d: patch["description"] = d["description"]
-    return db_req({"action": "update", "collection": "games", "id": gid, "patch": patch})
+    res = db_req({"action": "update", "collection": "games", "id": gid, "patch": patch})
+    if res.get("status") == "ok": publish(f"game:{gid}", "game_updated", res["result"])
+    return res
 
 def dev_delete_game(c, s, d):
     if err := _require_dev(s): return err
@@ -290,7 +351,9 @@ def dev_delete_game(c, s, d):
     r = db_req({"action": "read", "collection": "games", "id": gid})
     if r.get("status") != "ok": return {"status": "error", "error": "遊戲不存在"}
     if r["result"]["owner"] != s["username"]: return {"status": "error", "error": "無權限"}
-    return db_req({"action": "update", "collection": "games", "id": gid, "patch": {"deleted": True}})
+    res = db_req({"action": "update", "collection": "games", "id": gid, "patch": {"deleted": True}})
+    if res.get("status") == "ok": publish(f"game:{gid}", "game_deleted", {"id": gid})
+    return res
 
 def handle_upload_init(c, s, d):
     if err := _require_dev(s): return err
@@ -314,16 +377,25 @@ def handle_upload_init(c, s, d):
 # Player Handlers
 def player_list_games(c, s, d):
     if err := _require_player(s): return err
-    res = db_req({"action": "list", "collection": "games"})
-    valid_games = [g for g in res.get("result", []) if not g.get("deleted")]
-    return {"status": "ok", "result": valid_games}
+    # 列表只需要這幾個欄位；完整描述與評分走 player_game_detail
+    # min_players: 只列出可容納至少 N 人的遊戲；sort="top": 依平均評分由高到低
+    filt: Dict[str, Any] = {"deleted": {"$ne": True}}  # 舊紀錄可能沒有 deleted 欄位
+    if d.get("min_players"): filt["max_players"] = {"$gte": int(d["min_players"])}
+    res = db_req({"action": "query", "collection": "games", "filter": filt,
+                  "fields": ["name", "version", "owner", "max_players", "game_type", "avg_score", "rating_count"],
+                  "order_by": ["-avg_score", "-rating_count"] if d.get("sort") == "top" else None,
+                  "limit": d.get("limit"), "offset": d.get("offset", 0)})
+    return {"status": "ok", "result": res.get("result", [])}
 
 def player_game_detail(c, s, d):
     if err := _require_player(s): return err
     gid = str(d["game_id"])
     game = db_req({"action": "read", "collection": "games", "id": gid}).get("result")
     if not game or game.get("deleted"): return {"status": "error", "error": "Game not found"}
-    ratings = db_req({"action": "query", "collection": "ratings", "filter": {"game_id": gid}}).get("result", [])
+    filt: Dict[str, Any] = {"game_id": gid}
+    if d.get("since"): filt["created"] = {"$gte": int(d["since"])}  # 只取某個時間點之後的評分
+    ratings = db_req({"action": "query", "collection": "ratings", "filter": filt,
+                      "fields": ["player", "score", "comment", "created"]}).get("result", [])
     return {"status": "ok", "result": {"game": game, "ratings": ratings}}
 
 def player_download_req(c, s, d):
@@ -335,34 +407,158 @@ def player_download_req(c, s, d):
     send_frame(c, {"status": "ok", "file_size": path.stat().st_size, "filename": path.name})
     send_file(c, str(path))
 
+def player_list_replays(c, s, d):
+    if err := _require_player(s): return err
+    filt = {"game_id": str(d["game_id"])} if d.get("game_id") else {}
+    res = db_req({"action": "query", "collection": "replays", "filter": filt, "order_by": "-created",
+                  "fields": ["game_id", "players", "created"], "limit": d.get("limit", 50), "offset": d.get("offset", 0)})
+    return {"status": "ok", "result": res.get("result", [])}
+
+def player_replay(c, s, d):
+    if err := _require_player(s): return err
+    r = db_req({"action": "read", "collection": "replays", "id": str(d.get("replay_id"))})
+    if r.get("status") != "ok": return {"status": "error", "error": "Replay not found"}
+    path = REPLAY_DIR / r["result"]["file"]
+    if not path.exists(): return {"status": "error", "error": "No file"}
+    send_frame(c, {"status": "ok", "file_size": path.stat().st_size, "filename": path.name, "game_id": r["result"]["game_id"]})
+    send_file(c, str(path))
+
 def player_download_game_update_db(conn, session, data):
     if err := _require_player(session): return err
     game_id = str(data.get("game_id"))
     r = db_req({"action": "read", "collection": "games", "id": game_id})
     if r.get("status") != "ok": return r
     latest_ver = r["result"].get("version")
-    r2 = db_req({"action": "query", "collection": "player_games", "filter": {"player": session["username"], "game_id": game_id}})
-    if res := r2.get("result"):
-        return db_req({"action": "update", "collection": "player_games", "id": res[0]["id"], "patch": {"version": latest_ver}})
-    else:
-        return db_req({"action": "create", "collection": "player_games", "record": {
-            "player": session["username"], "game_id": game_id, "version": latest_ver, "has_played": False
-        }})
+    return db_req({"action": "upsert", "collection": "player_games",
+                   "key": {"player": session["username"], "game_id": game_id},
+                   "patch": {"version": latest_ver}, "defaults": {"has_played": False}})
 
 def player_rate_game(conn, session, data):
     if err := _require_player(session): return err
     game_id = str(data.get("game_id"))
     score = int(data.get("score"))
     if not (1 <= score <= 5): return {"status": "error", "error": "Score 1-5"}
-    r = db_req({"action": "query", "collection": "player_games", "filter": {"player": session["username"], "game_id": game_id}})
+    r = db_req({"action": "query", "collection": "player_games", "filter": {"player": session["username"], "game_id": game_id},
+                "fields": ["has_played"], "limit": 1})
     if r.get("status") != "ok" or not r.get("result"): return {"status": "error", "error": "未擁有此遊戲"}
     if not r["result"][0].get("has_played"): return {"status": "error", "error": "您尚未遊玩過此遊戲，無法評分"}
-    return db_req({"action": "create", "collection": "ratings", "record": {
-        "game_id": game_id, "player": session["username"], "score": score, "comment": data.get("comment", "")
+    res = db_req({"action": "create", "collection": "ratings", "record": {
+        "game_id": game_id, "player": session["username"], "score": score, "comment": data.get("comment", ""),
+        "created": int(time.time())
     }})
+    if res.get("status") == "ok": _add_game_score(game_id, score)
+    return res
+
+#把評分累加到 games 紀錄 (rating_count / score_sum / avg_score)，列表排「評分最高」時不必每次再去 ratings 算平均
+#(排序本身仍是 db_server 在 _shape 裡做的 Python sort；avg_score 的排序索引只用在 $gte 之類的篩選)
+def _add_game_score(game_id, score):
+    for _ in range(20):
+        game = db_req({"action": "read", "collection": "games", "id": game_id}).get("result")
+        if not game: return
+        if game.get("rating_count") is None:
+            # 還沒有累計欄位 (舊資料)：剛建立的這筆已在 ratings 裡，直接整個重算
+            patch = _score_patch(_game_scores(game_id))
+        else:
+            n, total = game["rating_count"], game.get("score_sum", 0)
+            patch = {"rating_count": n + 1, "score_sum": total + score, "avg_score": round((total + score) / (n + 1), 3)}
+        r = db_req({"action": "cas", "collection": "games", "id": game_id,
+                    "expect": {"rating_count": game.get("rating_count")}, "patch": patch})
+        if r.get("status") == "ok": return
+
+def _game_scores(game_id):
+    res = db_req({"action": "query", "collection": "ratings", "filter": {"game_id": game_id}, "fields": ["score"]})
+    return [int(r["score"]) for r in res.get("result") or [] if r.get("score") is not None]
+
+def _score_patch(scores):
+    return {"rating_count": len(scores), "score_sum": sum(scores),
+            "avg_score": round(sum(scores) / len(scores), 3) if scores else None}
+
+#啟動時把累計欄位出現前就有的評分補算進 games 紀錄；多個 Lobby 同時補只會有一個 cas 成功
+def _backfill_game_scores():
+    games = db_req({"action": "query", "collection": "games", "filter": {"rating_count": None}, "fields": ["rating_count"]})
+    filled = 0
+    for game in games.get("result") or []:
+        scores = _game_scores(game["id"])
+        if not scores: continue  # 沒人評過分：等第一筆評分時再建立欄位
+        r = db_req({"action": "cas", "collection": "games", "id": game["id"],
+                    "expect": {"rating_count": None}, "patch": _score_patch(scores)})
+        if r.get("status") == "ok": filled += 1
+    if filled: log.info("MAIN", f"backfilled rating stats for {filled} games")
+
+#配置 port、登記房間到共享狀態並啟動 GameSession (本 instance 的 worker 或執行緒)
+@tracing.traced
+def _open_room(game, gid, host, players):
+    if len(STATE.scan("room:")) >= 100: return {"status": "error", "error": "Full"}
+    game_port = 0
+    for _ in range(50):
+        p = random.choice(GAME_PORT_RANGE)
+        if STATE.set(f"port:{p}", INSTANCE_ID, ttl=ROOM_TTL, nx=True):
+            game_port = p; break
+    if not game_port: return {"status": "error", "error": "No ports"}
+
+    rid = STATE.incr("next_room_id")
+    room = {
+        "id": rid, "game_id": gid, "game_name": game["name"],
+        "host": host, "players": list(players), "owner": INSTANCE_ID,
+        "max_players": game.get("max_players", 2),
+        "game_port": game_port, "game_host": "140.113.17.11", "chat_port": game_port + 5000,
+        "spectate_port": game_port + 10000
+    }
+    STATE.set(f"room:{rid}", room, ttl=ROOM_TTL)
+    if WORKERS:
+        with OWNED_LOCK:
+            worker = WORKERS.place(rid, game_port, game.get("max_players", 2), gid, list(players), RECORD_REPLAYS)
+            if worker is not None: OWNED_ROOMS[rid] = worker
+        if worker is None:
+            STATE.delete(f"room:{rid}"); STATE.delete(f"port:{game_port}")
+            return {"status": "error", "error": "No session worker available"}
+    else:
+        session = GameSession(rid, game_port, game.get("max_players", 2), game_id=gid, players=list(players), record=RECORD_REPLAYS,
+                              on_start=lambda s: _session_started(s.room_id),
+                              on_close=lambda s: _session_closed(s.room_id, s.replay_meta, s.outcome()))
+        with OWNED_LOCK: OWNED_ROOMS[rid] = session
+        session.start()
+    publish_room("room_created", room)
+    return {"status": "ok", "result": room}
+
+#開局：把這場的玩家標記為已遊玩 (之後才能評分)
+def _session_started(rid):
+    room = _get_room(rid)
+    if not room: return
+    threading.Thread(target=_record_play_history, args=(str(room["game_id"]), list(room["players"]))).start()
+
+#房間結束：移出共享狀態、通知訂閱者，有錄 replay 就登記到 DB
+def _session_closed(rid, replay=None, result=None):
+    with OWNED_LOCK: OWNED_ROOMS.pop(rid, None)
+    room = _get_room(rid)
+    STATE.delete(f"room:{rid}")
+    if room:
+        STATE.cas(f"port:{room['game_port']}", INSTANCE_ID, None)
+        publish_room("room_closed", {"id": rid})
+    if replay: db_req({"action": "create", "collection": "replays", "record": replay})
+    if result: threading.Thread(target=_apply_result, args=(result,), daemon=True).start()
+
+#依一局的勝負更新各玩家在這個遊戲的 rating (player_games.rating，player_queue 配對時讀它)
+def _apply_result(result):
+    gid = str(result["game_id"])
+    recs = {}
+    for p in result["players"]:
+        r = db_req({"action": "query", "collection": "player_games", "filter": {"player": p, "game_id": gid},
+                    "fields": ["rating"], "limit": 1}).get("result")
+        if not r: return  # 沒有擁有紀錄 (不該發生)：整局不計
+        recs[p] = r[0]
+    new = update_ratings({p: int(rec.get("rating", DEFAULT_RATING)) for p, rec in recs.items()}, result["winners"])
+    for p, rec in recs.items():
+        db_req({"action": "update", "collection": "player_games", "id": rec["id"], "patch": {"rating": new[p]}})
+    log.info("MAIN", "ratings updated", game_id=gid, ratings=new)
+
+def _on_worker_event(worker_id, evt):
+    if evt["evt"] == "started": _session_started(evt["room_id"])
+    elif evt["evt"] == "closed": _session_closed(evt["room_id"], evt.get("replay"), evt.get("result"))
+
+WORKERS = SessionWorkerPool(SESSION_WORKERS, on_event=_on_worker_event) if SESSION_WORKERS else None
 
 def player_create_room(conn, session, data):
-    global NEXT_ROOM_ID
     if err := _require_player(session): return err
     gid = str(data.get("game_id"))
     if not _check_version(session["username"], gid): return {"status": "error", "error": "UPDATE_REQUIRED"}
@@ -371,91 +567,258 @@ def player_create_room(conn, session, data):
     game = r["result"]
     if game.get("deleted"): return {"status": "error", "error": "Deleted"}
 
-    with ROOMS_LOCK:
-        if len(ROOMS) >= 100: return {"status": "error", "error": "Full"}
-        game_port = 0
-        for _ in range(50):
-            p = random.choice(GAME_PORT_RANGE)
-            if not any(r.get("game_port")==p for r in ROOMS.values()):
-                game_port = p; break
-        if not game_port: return {"status": "error", "error": "No ports"}
-
-        rid = NEXT_ROOM_ID; NEXT_ROOM_ID += 1
-        GameSession(rid, game_port, players_count=game.get("max_players", 2)).start()
-
-        ROOMS[rid] = {
-            "id": rid, "game_id": gid, "game_name": game["name"],
-            "host": session["username"], "players": [session["username"]],
-            "max_players": game.get("max_players", 2),
-            "game_port": game_port, "game_host": "140.113.17.11", "chat_port": game_port + 5000 
-        }
-    return {"status": "ok", "result": ROOMS[rid]}
+    return _open_room(game, gid, session["username"], [session["username"]])
+
+# --- Matchmaking ---
+#配對成功：開房並把房間資訊推給這一批玩家
+def _on_match(gid, batch):
+    game = db_req({"action": "read", "collection": "games", "id": gid}).get("result") or {}
+    if not game or game.get("deleted"):
+        resp = {"status": "error", "error": "Game not found"}
+    else:
+        resp = _open_room(game, gid, batch[0].username, [t.username for t in batch])
+    for t in batch:
+        if resp.get("status") == "ok": t.notify({"type": "match_found", "result": resp["result"]})
+        else: t.notify({"type": "match_failed", "error": resp.get("error")})
+
+MATCHMAKER = Matchmaker(on_match=_on_match)
+
+def player_queue(conn, session, data):
+    if err := _require_player(session): return err
+    gid = str(data.get("game_id"))
+    if not _check_version(session["username"], gid): return {"status": "error", "error": "UPDATE_REQUIRED", "game_id": gid}
+    game = db_req({"action": "read", "collection": "games", "id": gid}).get("result") or {}
+    if game.get("deleted"): return {"status": "error", "error": "Deleted"}
+    owned = db_req({"action": "query", "collection": "player_games", "filter": {"player": session["username"], "game_id": gid},
+                    "fields": ["rating"], "limit": 1}).get("result") or [{}]
+    rating = int(owned[0].get("rating", DEFAULT_RATING))
+    ticket = Ticket(session["username"], gid, rating, int(game.get("max_players", 2)),
+                    notify=lambda msg: push_frame(conn, msg))
+    if not MATCHMAKER.enqueue(ticket): return {"status": "error", "error": "Already queued"}
+    return {"status": "ok", "result": {"queued": True, "rating": rating, "band": ticket.band}}
+
+def player_dequeue(conn, session, data):
+    if err := _require_player(session): return err
+    return {"status": "ok", "result": MATCHMAKER.dequeue(session["username"])}
+
+def matchmaking_stats(conn, session, data):
+    if err := _require_player(session): return err
+    return {"status": "ok", "result": MATCHMAKER.stats()}
 
+#房間放在共享狀態，多個 Lobby 可能同時加入同一間：以 compare-and-set 重試
 def player_join_room(conn, session, data):
     if err := _require_player(session): return err
     rid = int(data.get("room_id"))
-    with ROOMS_LOCK:
-        room = ROOMS.get(rid)
+    checked = False
+    for _ in range(20):
+        room = _get_room(rid)
         if not room: return {"status": "error", "error": "Not found"}
+        if session["username"] in room["players"]: return {"status": "ok", "result": room}
         if len(room["players"]) >= room.get("max_players", 2): return {"status": "error", "error": "Full"}
-        
+
         gid = str(room["game_id"])
-        if not _check_version(session["username"], gid): return {"status": "error", "error": "UPDATE_REQUIRED", "game_id": gid}
-        
-        if session["username"] not in room["players"]: room["players"].append(session["username"])
-        return {"status": "ok", "result": room}
+        if not checked:
+            if not _check_version(session["username"], gid): return {"status": "error", "error": "UPDATE_REQUIRED", "game_id": gid}
+            checked = True
+
+        joined = dict(room, players=room["players"] + [session["username"]])
+        if STATE.cas(f"room:{rid}", room, joined, ttl=ROOM_TTL):
+            publish_room("room_updated", joined)
+            return {"status": "ok", "result": joined}
+    return {"status": "error", "error": "Busy, please retry"}
+
+def player_spectate_room(conn, session, data):
+    if err := _require_player(session): return err
+    room = _get_room(int(data.get("room_id")))
+    if not room: return {"status": "error", "error": "Not found"}
+    gid = str(room["game_id"])
+    # 觀眾用同一個遊戲 client，所以一樣要求最新版本
+    if not _check_version(session["username"], gid): return {"status": "error", "error": "UPDATE_REQUIRED", "game_id": gid}
+    return {"status": "ok", "result": room}
 
 def player_list_rooms(c, s, d): 
     if err := _require_player(s): return err
-    return {"status": "ok", "result": list(ROOMS.values())}
+    return {"status": "ok", "result": _rooms()}
+
+# --- Subscriptions ---
+#訂閱後先登記再取快照：期間的變動會以事件補上 (事件排在這個回應之後送出)
+def handle_subscribe(conn, session, data):
+    if err := _require_player(session): return err
+    snapshot = {}
+    for topic in [str(t) for t in data.get("topics") or []]:
+        kind, _, key = topic.partition(":")
+        if topic != "rooms" and (kind not in ("room", "game") or not key):
+            return {"status": "error", "error": f"Unknown topic: {topic}"}
+        with SUBS_LOCK: SUBSCRIBERS.setdefault(topic, set()).add(conn)
+        if topic == "rooms":
+            snapshot[topic] = _rooms()
+        elif kind == "room":
+            snapshot[topic] = _get_room(int(key)) if key.isdigit() else None
+        else:
+            game = db_req({"action": "read", "collection": "games", "id": key}).get("result")
+            snapshot[topic] = game if game and not game.get("deleted") else None
+        if snapshot[topic] is None:  # 房間已關 / 遊戲已下架，不必再訂閱
+            with SUBS_LOCK: SUBSCRIBERS.get(topic, set()).discard(conn)
+    return {"status": "ok", "result": snapshot}
+
+def handle_unsubscribe(conn, session, data):
+    topics = data.get("topics")
+    with SUBS_LOCK:
+        for topic in list(SUBSCRIBERS) if topics is None else [str(t) for t in topics]:
+            subs = SUBSCRIBERS.get(topic)
+            if subs is None: continue
+            subs.discard(conn)
+            if not subs: del SUBSCRIBERS[topic]
+    return {"status": "ok"}
+
+# --- Admin ---
+#診斷用 (--profiling)：對整個 Lobby 行程取樣，或對某個 action 的下幾次請求掛 cProfile；只接受本機連線
+def admin_profile(conn, session, data):
+    if conn.getpeername()[0] not in ("127.0.0.1", "::1"): return {"status": "error", "error": "local only"}
+    return profiler.handle(data)
 
 # --- Mapping ---
 HANDLERS = {
-    "register": handle_register, "login": handle_login, "logout": handle_logout,
+    "register": handle_register, "login": handle_login, "resume": handle_resume, "logout": handle_logout,
+    "heartbeat": handle_heartbeat, "player_list_online": player_list_online,
     "dev_list_games": dev_list_games, "dev_create_game": dev_create_game, 
     "dev_update_game": dev_update_game, "dev_delete_game": dev_delete_game, 
     "dev_upload_init": handle_upload_init,
     "player_list_games": player_list_games, "player_create_room": player_create_room, 
     "player_join_room": player_join_room, "player_list_rooms": player_list_rooms, 
+    "player_spectate_room": player_spectate_room, 
+    "player_list_replays": player_list_replays, "player_replay": player_replay, 
+    "player_queue": player_queue, "player_dequeue": player_dequeue, 
+    "matchmaking_stats": matchmaking_stats, 
+    "subscribe": handle_subscribe, "unsubscribe": handle_unsubscribe, 
     "player_download_req": player_download_req, 
     "player_download_game_update_db": player_download_game_update_db, 
     "player_game_detail": player_game_detail, 
-    "player_rate_game": player_rate_game
+    "player_rate_game": player_rate_game,
+    "admin_profile": admin_profile
 }
 
 def client_worker(conn, addr):
     session = {} 
-    print(f"[MAIN] New connection from {addr}")
+    send_lock = SEND_LOCKS[conn] = threading.Lock()
+    OUTBOX[conn] = collections.deque()
+    log.info("MAIN", "new connection", addr=addr, rate=10)  # 大量連線時每秒最多記 10 筆
     try:
         while True:
             req = recv_frame(conn)
             if not req: break
             action = req.get("action")
             handler = HANDLERS.get(action)
-            if handler:
-                resp = handler(conn, session, req.get("data") or {})
-                if resp is not None: send_frame(conn, resp)
-            else:
-                send_frame(conn, {"status": "error", "error": f"Unknown action: {action}"})
+            # 處理中 (busy) 的連線不會因為閒置而被關掉，例如上傳大檔；+1 / -1 都記在這條連線自己的 entry 上
+            entry = session.get("presence")
+            PRESENCE.touch(entry, busy=1)
+            t0 = time.perf_counter() if metrics.ENABLED else 0.0
+            # handler 可能自己送 frame (例如下載)，整段持有送出鎖，推播會排在回應之後
+            try:
+                with send_lock, tracing.start(f"lobby {action if handler else 'unknown'}", req.get("trace")), \
+                        profiler.capture(action):
+                    if handler:
+                        resp = handler(conn, session, req.get("data") or {})
+                        if resp is not None: send_frame(conn, resp)
+                    else:
+                        send_frame(conn, {"status": "error", "error": f"Unknown action: {action}"})
+            finally:
+                PRESENCE.touch(entry, busy=-1)
+            if metrics.ENABLED:
+                metrics.observe("lobby_request_seconds", time.perf_counter() - t0, action=action if handler else "unknown")
+            _drain(conn)
     except Exception as e:
-        print(f"[MAIN] Error: {e}")
+        log.warn("MAIN", "connection error", addr=addr, error=e)
     finally:
         if session.get("logged_in"): 
-            ONLINE.pop((session.get("user_type"), session.get("username")), None)
+            _release_online(session)
+            MATCHMAKER.dequeue(session.get("username"))
+        handle_unsubscribe(conn, session, {})
+        SEND_LOCKS.pop(conn, None); OUTBOX.pop(conn, None)
         conn.close()
 
+#各房間的流量與連線數：行程內的 session 直接讀，worker 上的取最近一次 pong 帶回的值
+def _session_stats():
+    with OWNED_LOCK: local = [s for s in OWNED_ROOMS.values() if isinstance(s, GameSession)]
+    res = {s.room_id: s.stats() for s in local}
+    if WORKERS: res.update(WORKERS.session_stats())
+    return res
+
+def _register_gauges():
+    metrics.gauge("lobby_connections", lambda: len(SEND_LOCKS))
+    metrics.gauge("lobby_online_sessions", lambda: len(PRESENCE))
+    metrics.gauge("lobby_rooms_active", lambda: len(OWNED_ROOMS))
+    # 配對等待時間另有 matchmaking_time_to_match_seconds (histogram，在配對成功時記錄)
+    metrics.gauge("matchmaking_queue_depth", lambda: MATCHMAKER.stats()["queue_depth"], label="game")
+    metrics.gauge("matchmaking_oldest_wait_seconds", lambda: MATCHMAKER.stats()["oldest_wait"], label="game")
+    metrics.gauge("matchmaking_matched_total", lambda: MATCHMAKER.matched_total)
+    for field in ("bytes_in", "bytes_out", "sockets"):
+        metrics.gauge(f"game_session_{field}", lambda f=field: {rid: st[f] for rid, st in _session_stats().items()}, label="room")
+
 def main():
+    global PORT, STATE, INSTANCE_ID, DB_HOST, DB_PORT, AUTH_SECRET, STORAGE_DIR, RECORD_REPLAYS
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--state", help="多個 Lobby 共用狀態時，state_server 的 host[:port]")
+    parser.add_argument("--db", help="db_server (primary) 的 host[:port]")
+    parser.add_argument("--db-replica", action="append", default=[], metavar="HOST[:PORT]",
+                        help="唯讀的 db follower，可重複指定")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="在 127.0.0.1 的這個 port 提供 /metrics (0 = 不收集)")
+    parser.add_argument("--log-level", choices=tuple(log.LEVELS), default=None)
+    parser.add_argument("--log-format", choices=("text", "json"), default=None)
+    parser.add_argument("--log-file", default=None, help="log 寫到這個檔案 (預設 stdout；session worker 沿用等級與格式)")
+    parser.add_argument("--trace-file", default=None, help="記錄帶 trace id 的請求的 span (server/trace_report.py 分析)")
+    parser.add_argument("--storage-dir", default=str(STORAGE_DIR), help="開發者上傳的遊戲檔案放在哪裡")
+    parser.add_argument("--no-replays", action="store_true", help="不錄製對局 replay")
+    parser.add_argument("--profiling", action="store_true", help="接受本機送來的 admin_profile 指令 (server/profiler.py)")
+    args = parser.parse_args()
+    log.configure(args.log_level, args.log_format, args.log_file)
+    PORT = args.port
+    STORAGE_DIR = Path(args.storage_dir)
+    if args.no_replays: RECORD_REPLAYS = False
+    if args.profiling: profiler.enable()
+    if args.trace_file: tracing.configure(args.trace_file, f"lobby:{PORT}")
+    if args.db:
+        host, _, port = args.db.partition(":")
+        DB_HOST, DB_PORT = host, int(port or DB_PORT)
+    for r in args.db_replica:
+        host, _, port = r.partition(":")
+        DB_REPLICAS.append((host, int(port or DB_PORT)))
+    INSTANCE_ID = f"{socket.gethostname()}:{PORT}:{os.getpid()}"
+    if args.state:
+        host, _, port = args.state.partition(":")
+        STATE = StateClient(host, int(port or STATE_PORT))
+    STATE.set("auth:secret", auth.new_secret(), nx=True)
+    AUTH_SECRET = STATE.get("auth:secret").encode()
+    STATE.subscribe(EVENTS_CHANNEL, _on_lobby_event)
+    timers.call_every(HEARTBEAT_INTERVAL, _heartbeat, offload=True)  # 可能要連 state_server，不佔用計時執行緒
+    if args.metrics_port:
+        _register_gauges()
+        metrics.serve(args.metrics_port)
+        log.info("MAIN", f"metrics on http://127.0.0.1:{args.metrics_port}/metrics")
+
+    if WORKERS:
+        WORKERS.start()
+        log.info("MAIN", f"{SESSION_WORKERS} session workers started")
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     s.bind((HOST, PORT)); s.listen(10)
-    s.settimeout(1.0)
-    print(f"[MAIN] Listening on {HOST}:{PORT}")
-    while True:
-        try:
-            conn, addr = s.accept()
-            conn.settimeout(None)
+    # accept 直接阻塞：Ctrl+C 會以 KeyboardInterrupt 打斷；SIGTERM 則關掉 listener 讓 accept 丟 OSError 跳出
+    signal.signal(signal.SIGTERM, lambda *_: s.close())
+    MATCHMAKER.start()
+    threading.Thread(target=_backfill_game_scores, daemon=True).start()
+    log.info("MAIN", f"Listening on {HOST}:{PORT}", instance=INSTANCE_ID, state=args.state or "local")
+    try:
+        while True:
+            try: conn, addr = s.accept()
+            except OSError: break
             threading.Thread(target=client_worker, args=(conn, addr), daemon=True).start()
-        except socket.timeout: continue
-        except OSError: break
+    except KeyboardInterrupt: pass
+    finally:
+        s.close()
+        if WORKERS: WORKERS.stop()
+        log.info("MAIN", "Server closed.")
+        log.flush()
 
 if __name__ == "__main__": main()
\ No newline at end of file
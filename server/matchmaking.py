@@ -0,0 +1,167 @@
+# server/matchmaking.py
+#
+# 配對佇列：玩家 player_queue 後不必再輪詢房間列表
+# - 每個遊戲一組佇列，依 rating 分段 (band) 放進不同的 FIFO
+# - 同一段湊滿 max_players 就整批開房；等太久的玩家會逐步放寬到相鄰的段
+# - 開房後透過 notify callback 把房間資訊推給被配對到的玩家
+# - stats() 提供佇列深度與配對等待時間；開了 metrics 時配對等待時間另外記進 histogram
+# - rating 是每個玩家在各遊戲的 Elo (player_games.rating)，遊戲結束時由 update_ratings 依勝負調整
+
+import collections
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from server import log
+from server import metrics
+
+BAND_WIDTH = 200      # 每一段的 rating 寬度
+WIDEN_AFTER = 10.0    # 每等這麼多秒，多接受左右各一段
+MATCH_INTERVAL = 1.0  # 沒有新玩家時，多久檢查一次放寬條件
+DEFAULT_RATING = 1000
+K_FACTOR = 32         # Elo 每場最多變動多少
+
+
+def update_ratings(ratings: Dict[str, int], winners: List[str]) -> Dict[str, int]:
+    """
+    一場結束後的新 rating。ratings: 玩家 -> 目前 rating；winners 為空代表平手。
+    多人遊戲把勝方與敗方各當成一隊，每個人對上另一隊的平均 rating；平手時對上其餘所有人的平均。
+    """
+    win = set(winners)
+    res = {}
+    for p, r in ratings.items():
+        if win:
+            opp = [ratings[q] for q in ratings if (q in win) != (p in win)]
+            actual = 1.0 if p in win else 0.0
+        else:
+            opp = [ratings[q] for q in ratings if q != p]
+            actual = 0.5
+        if not opp:
+            res[p] = r
+            continue
+        expected = 1.0 / (1.0 + 10 ** ((sum(opp) / len(opp) - r) / 400))
+        res[p] = int(round(r + K_FACTOR * (actual - expected)))
+    return res
+
+
+class Ticket:
+    __slots__ = ("username", "game_id", "rating", "band", "need", "since", "notify")
+
+    def __init__(self, username: str, game_id: str, rating: int, need: int,
+                 notify: Callable[[Dict[str, Any]], None]):
+        self.username = username
+        self.game_id = game_id
+        self.rating = rating
+        self.band = rating // BAND_WIDTH
+        self.need = need
+        self.since = time.monotonic()
+        self.notify = notify
+
+
+class Matchmaker(threading.Thread):
+    def __init__(self, on_match: Callable[[str, List[Ticket]], None]):
+        super().__init__(daemon=True)
+        self.on_match = on_match
+        self.cond = threading.Condition()
+        # game_id -> band -> username -> Ticket (OrderedDict 保持先來先配)
+        self.queues: Dict[str, Dict[int, "collections.OrderedDict[str, Ticket]"]] = {}
+        self.where: Dict[str, Ticket] = {}
+        self.waits: Deque[float] = collections.deque(maxlen=1000)  # 最近的配對等待秒數
+        self.matched_total = 0
+
+    # --- 給 handler 呼叫 ---
+    def enqueue(self, ticket: Ticket) -> bool:
+        with self.cond:
+            if ticket.username in self.where:
+                return False
+            bands = self.queues.setdefault(ticket.game_id, {})
+            bands.setdefault(ticket.band, collections.OrderedDict())[ticket.username] = ticket
+            self.where[ticket.username] = ticket
+            self.cond.notify()
+        return True
+
+    def dequeue(self, username: str) -> bool:
+        with self.cond:
+            t = self.where.pop(username, None)
+            if t is None:
+                return False
+            self._remove(t)
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self.cond:
+            depth = {gid: sum(len(q) for q in bands.values()) for gid, bands in self.queues.items()}
+            oldest = {gid: min(t.since for q in bands.values() for t in q.values()) for gid, bands in self.queues.items()}
+            waits = sorted(self.waits)
+        now = time.monotonic()
+        def pct(p: float) -> Optional[float]:
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 3) if waits else None
+        return {
+            "queue_depth": depth,
+            "queued_total": sum(depth.values()),
+            "oldest_wait": {gid: round(now - since, 3) for gid, since in oldest.items()},
+            "matched_total": self.matched_total,
+            "time_to_match_p50": pct(0.5),
+            "time_to_match_p95": pct(0.95),
+            "time_to_match_max": round(waits[-1], 3) if waits else None,
+        }
+
+    # --- matcher 執行緒 ---
+    def _remove(self, t: Ticket) -> None:
+        bands = self.queues.get(t.game_id, {})
+        q = bands.get(t.band)
+        if q is not None:
+            q.pop(t.username, None)
+            if not q:
+                del bands[t.band]
+        if not bands:
+            self.queues.pop(t.game_id, None)
+
+    def _take(self, batch: List[Ticket], now: float) -> None:
+        for t in batch:
+            self.where.pop(t.username, None)
+            self._remove(t)
+            self.waits.append(now - t.since)
+            if metrics.ENABLED: metrics.observe("matchmaking_time_to_match_seconds", now - t.since, game=t.game_id)
+        self.matched_total += len(batch)
+
+    def _find_batches(self, now: float) -> List[Tuple[str, List[Ticket]]]:
+        found = []
+        for gid, bands in list(self.queues.items()):
+            need = next(iter(next(iter(bands.values())).values())).need  # 同一個遊戲人數相同
+            # 1. 同一段內先到先配
+            for b in sorted(bands):
+                while b in bands and len(bands[b]) >= need:
+                    batch = list(bands[b].values())[:need]
+                    self._take(batch, now)
+                    found.append((gid, batch))
+            # 2. 等太久的玩家放寬到相鄰段，以該玩家為中心找 rating 最接近的人
+            for b in sorted(bands):
+                q = bands.get(b)
+                if not q:
+                    continue
+                oldest = next(iter(q.values()))
+                spread = int((now - oldest.since) // WIDEN_AFTER)
+                if spread == 0:
+                    continue
+                pool = [t for bb in range(b - spread, b + spread + 1)
+                        for t in bands.get(bb, {}).values() if t is not oldest]
+                if len(pool) + 1 < oldest.need:
+                    continue
+                pool.sort(key=lambda t: abs(t.rating - oldest.rating))
+                batch = [oldest] + pool[:oldest.need - 1]
+                self._take(batch, now)
+                found.append((gid, batch))
+        return found
+
+    def run(self) -> None:
+        while True:
+            with self.cond:
+                self.cond.wait(MATCH_INTERVAL)
+                batches = self._find_batches(time.monotonic())
+            # 開房 (會呼叫 DB) 不要佔著佇列的鎖
+            for gid, batch in batches:
+                try:
+                    self.on_match(gid, batch)
+                except Exception as e:
+                    log.error("Match", "on_match failed", game_id=gid, error=e)
@@ -0,0 +1,166 @@
+# server/metrics.py
+#
+# 行程內的效能指標 (預設關閉；main_server / db_server 帶 --metrics-port 才開啟)
+# - counter：請求數等累計值
+# - histogram：延遲分布，HDR 式的 log-linear 分桶 (每個 2 的次方再切 SUB_BUCKETS 格，相對誤差約 3%)，
+#   以微秒記錄，記錄一筆是 O(1)；輸出 p50 / p99 / p999、count、sum、max
+# - gauge：登記一個函式，輸出時才呼叫 (連線數、房間數等不必在熱路徑上維護)
+# - 關閉時呼叫端只多一次 `if metrics.ENABLED` 判斷，不建 key、不拿鎖
+# - serve(port) 在 127.0.0.1 開一個 HTTP 端點：curl http://127.0.0.1:<port>/metrics (Prometheus 文字格式)
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ENABLED = False
+SUB_BITS = 5
+SUB_BUCKETS = 1 << SUB_BITS
+MAX_US = 3600 * 1_000_000  # 超過一小時的值算在最後一格
+QUANTILES = (0.5, 0.99, 0.999)
+
+
+def _bucket(v: int) -> int:
+    shift = max(0, v.bit_length() - SUB_BITS - 1)
+    return (shift << SUB_BITS) + (v >> shift)
+
+
+def _upper(b: int) -> int:
+    """這一格涵蓋的最大值 (回報百分位數時取上界，不會低估)。"""
+    shift = max(0, (b >> SUB_BITS) - 1)
+    return (((b - (shift << SUB_BITS)) + 1) << shift) - 1
+
+
+class Histogram:
+    __slots__ = ("lock", "counts", "count", "sum_us", "max_us")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = [0] * (_bucket(MAX_US) + 1)
+        self.count = 0
+        self.sum_us = 0
+        self.max_us = 0
+
+    def record(self, seconds: float) -> None:
+        v = min(max(int(seconds * 1_000_000), 0), MAX_US)
+        with self.lock:
+            self.counts[_bucket(v)] += 1
+            self.count += 1
+            self.sum_us += v
+            if v > self.max_us: self.max_us = v
+
+    def quantiles(self, qs: Tuple[float, ...] = QUANTILES) -> List[float]:
+        """回傳各百分位數 (秒)。"""
+        with self.lock:
+            counts, total, top = list(self.counts), self.count, self.max_us
+        res: List[float] = []
+        if not total: return [0.0 for _ in qs]
+        seen, b = 0, 0
+        for q in qs:
+            want = max(1, int(q * total + 0.999999))
+            while seen + counts[b] < want:
+                seen += counts[b]
+                b += 1
+            res.append(min(_upper(b), top) / 1_000_000)
+        return res
+
+
+# name -> {labels: 值}；labels 是排序過的 (key, value) tuple
+_LOCK = threading.Lock()
+_COUNTERS: Dict[str, Dict[Tuple[Tuple[str, str], ...], int]] = {}
+_HISTS: Dict[str, Dict[Tuple[Tuple[str, str], ...], Histogram]] = {}
+_GAUGES: Dict[str, Tuple[Callable[[], Any], Optional[str]]] = {}
+
+
+def enable() -> None:
+    global ENABLED
+    ENABLED = True
+
+
+def _labels(labels: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def incr(name: str, n: int = 1, **labels: Any) -> None:
+    key = _labels(labels)
+    with _LOCK:
+        series = _COUNTERS.setdefault(name, {})
+        series[key] = series.get(key, 0) + n
+
+
+def observe(name: str, seconds: float, **labels: Any) -> None:
+    key = _labels(labels)
+    series = _HISTS.get(name)
+    h = series.get(key) if series else None
+    if h is None:
+        with _LOCK: h = _HISTS.setdefault(name, {}).setdefault(key, Histogram())
+    h.record(seconds)
+
+
+def gauge(name: str, fn: Callable[[], Any], label: Optional[str] = None) -> None:
+    """fn() 回傳數值；有 label 時回傳 {label 值: 數值}，每個 label 值輸出一行。"""
+    _GAUGES[name] = (fn, label)
+
+
+# --- 輸出 ---
+def _fmt(labels: Tuple[Tuple[str, str], ...], *extra: Tuple[str, str]) -> str:
+    items = list(labels) + list(extra)
+    if not items: return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+def render() -> str:
+    lines: List[str] = []
+    with _LOCK:
+        counters = {name: dict(series) for name, series in _COUNTERS.items()}
+        hists = {name: dict(series) for name, series in _HISTS.items()}
+    for name in sorted(counters):
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in sorted(counters[name].items()):
+            lines.append(f"{name}{_fmt(labels)} {value}")
+    for name in sorted(hists):
+        lines.append(f"# TYPE {name} summary")
+        for labels, h in sorted(hists[name].items()):
+            for q, v in zip(QUANTILES, h.quantiles()):
+                lines.append(f"{name}{_fmt(labels, ('quantile', str(q)))} {v:.6f}")
+            lines.append(f"{name}_count{_fmt(labels)} {h.count}")
+            lines.append(f"{name}_sum{_fmt(labels)} {h.sum_us / 1_000_000:.6f}")
+            lines.append(f"{name}_max{_fmt(labels)} {h.max_us / 1_000_000:.6f}")
+    for name in sorted(_GAUGES):
+        fn, label = _GAUGES[name]
+        try:
+            value = fn()
+        except Exception as e:
+            lines.append(f"# {name} failed: {e}")
+            continue
+        lines.append(f"# TYPE {name} gauge")
+        if label is None:
+            lines.append(f"{name} {value}")
+        else:
+            for k, v in sorted(value.items()):
+                lines.append(f"{name}{_fmt(((label, str(k)),))} {v}")
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """開啟指標收集並在背景執行緒提供 /metrics。"""
+    enable()
+    srv = ThreadingHTTPServer((host, port), _Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, name="metrics", daemon=True).start()
+    return srv
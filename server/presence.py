@@ -0,0 +1,116 @@
+# server/presence.py
+#
+# Lobby 本地的在線狀態 (presence)：這個 instance 上每個已登入連線的最後活動時間
+# - 依 key 的 hash 分成 SHARDS 個分片，各自一把鎖，大量連線同時收發不會搶同一把鎖
+# - 每個 entry 在行程共用的時間輪 (server/timers.py) 上排一個到期 timer
+# - touch (收到任何 frame / heartbeat) 是 O(1)：只更新 deadline，不重排 timer；
+#   timer 到期時才發現 deadline 已延後，再排到新的 deadline (每個 entry 每個 TTL 週期最多被看一次)
+# - 超過 ttl 沒有活動的連線呼叫 on_expire (main_server 會關掉 socket，讓 client_worker 照常清理)
+# - 正在處理 request 的連線 (busy，例如上傳大檔) 不會過期；touch 直接作用在連線自己拿到的 Entry 上，
+#   被 resume 接手後舊連線還在跑的 request 結束時不會扣到新連線的 busy
+# 跨 Lobby 的在線名單仍在共享狀態 (online:<type>:<user>)，這裡只負責偵測本地的死連線
+
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from server import timers
+from server import log
+
+SHARDS = 16
+DEFAULT_TTL = 45.0  # client 每 10 秒送一次 heartbeat，連續漏掉幾次才判定斷線
+
+
+class Entry:
+    __slots__ = ("key", "holder", "conn", "deadline", "busy", "timer")
+
+    def __init__(self, key: str, holder: str, conn: Any, deadline: float):
+        self.key = key
+        self.holder = holder
+        self.conn = conn
+        self.deadline = deadline
+        self.busy = 0
+        self.timer: Optional[timers.Timer] = None
+
+
+class _Shard:
+    __slots__ = ("lock", "entries")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries: Dict[str, Entry] = {}
+
+
+class Presence:
+    def __init__(self, on_expire: Callable[[Entry], None], ttl: float = DEFAULT_TTL, shards: int = SHARDS):
+        self.on_expire = on_expire
+        self.ttl = ttl
+        self.shards = [_Shard() for _ in range(shards)]
+        self.expired_total = 0
+
+    def _shard(self, key: str) -> _Shard:
+        return self.shards[hash(key) % len(self.shards)]
+
+    def _arm(self, shard: _Shard, e: Entry) -> None:
+        e.timer = timers.call_later(e.deadline - time.monotonic(), self._check, shard, e)
+
+    # --- 給 main_server 呼叫 ---
+    def join(self, key: str, holder: str, conn: Any) -> Tuple[Entry, Optional[Entry]]:
+        """登記一條已登入的連線，回傳 (新 entry, 同一個 key 原本的 entry)；原本的 (被 resume 接手的舊連線) 給呼叫端處理。"""
+        shard = self._shard(key)
+        e = Entry(key, holder, conn, time.monotonic() + self.ttl)
+        with shard.lock:
+            old = shard.entries.get(key)
+            shard.entries[key] = e
+            self._arm(shard, e)
+        if old is not None and old.timer: old.timer.cancel()
+        return e, old
+
+    def leave(self, key: str, holder: str) -> bool:
+        """只移除 holder 相符的 entry (已被新連線接手就不動)。"""
+        shard = self._shard(key)
+        with shard.lock:
+            e = shard.entries.get(key)
+            if e is None or e.holder != holder: return False
+            del shard.entries[key]
+        if e.timer: e.timer.cancel()
+        return True
+
+    def touch(self, e: Optional[Entry], busy: int = 0) -> None:
+        """有活動：延後 deadline。busy=+1 / -1 標記開始 / 結束處理 request。已被移除或接手的 entry 照改，_check 不會再看它。"""
+        if e is None: return
+        with self._shard(e.key).lock:
+            e.deadline = time.monotonic() + self.ttl
+            e.busy += busy
+
+    def keys(self) -> List[str]:
+        res: List[str] = []
+        for shard in self.shards:
+            with shard.lock: res.extend(shard.entries)
+        return res
+
+    def __len__(self) -> int:
+        return sum(len(shard.entries) for shard in self.shards)
+
+    # --- 到期檢查 (在計時執行緒上) ---
+    def _check(self, shard: _Shard, e: Entry) -> None:
+        now = time.monotonic()
+        with shard.lock:
+            if shard.entries.get(e.key) is not e: return
+            if e.deadline > now or e.busy:
+                if e.busy: e.deadline = now + self.ttl
+                self._arm(shard, e)
+                return
+            del shard.entries[e.key]
+        self.expired_total += 1
+        try:
+            self.on_expire(e)
+        except Exception as ex:
+            log.error("Presence", "on_expire failed", key=e.key, error=ex)
@@ -0,0 +1,190 @@
+# server/profiler.py
+#
+# 線上診斷用的 profiler (預設關閉；main_server / db_server 帶 --profiling 才接受 profile 指令)，執行中隨時可以下指令
+# - sample：在收到指令的執行緒上每 interval 秒用 sys._current_frames() 取行程內所有執行緒的呼叫堆疊，
+#   累計成 collapsed stacks ("執行緒;外層函式;...;內層函式 次數")，可直接餵給 flamegraph.pl / speedscope；
+#   被測的程式碼路徑完全不變，只有取樣的這條執行緒在做事
+# - handler：對某個 action 接下來的 count 次請求掛 cProfile，合併後回傳依 cumulative 排序的 pstats 文字；
+#   同一時間只 profile 一個請求 (cProfile 不能重疊)，其餘照常執行。沒有在等的 capture 時 capture() 直接回傳共用的空 context
+# - session worker 是獨立行程，不在 main_server 的取樣範圍內
+# - 指令：
+#   db_server   : {"action": "profile", "mode": "sample", "seconds": 5}
+#   main_server : {"action": "admin_profile", "data": {"mode": "handler", "target": "login", "count": 3}} (只接受本機連線)
+#
+#   python server/profiler.py sample --seconds 5 > lobby.folded                  # 預設連 127.0.0.1:9800 (main_server)
+#   python server/profiler.py --port 9900 --db handler query --count 20         # db_server 的 query
+
+import argparse
+import collections
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import re
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from common.protocol import send_frame, recv_frame
+
+ENABLED = False
+NOOP = contextlib.nullcontext()
+MAX_SECONDS = 120.0      # sample 最長幾秒
+MAX_WAIT = 600.0         # handler 最多等幾秒讓目標 action 出現
+DEFAULT_INTERVAL = 0.005
+
+_labels: Dict[Any, str] = {}  # code object -> "函式 (檔名:行號)"
+_armed: Dict[str, "_Capture"] = {}  # action -> 等待中的 capture
+_armed_lock = threading.Lock()
+_profile_lock = threading.Lock()  # cProfile 同時只開一個
+
+
+def enable() -> None:
+    global ENABLED
+    ENABLED = True
+
+
+# --- sample ---
+def _label(code: Any) -> str:
+    s = _labels.get(code)
+    if s is None:
+        s = _labels[code] = f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return s
+
+
+def sample(seconds: float, interval: float = DEFAULT_INTERVAL) -> Dict[str, Any]:
+    """取樣 seconds 秒；同名的執行緒 (Thread-12 (client_worker) 等) 合併成一個根。"""
+    seconds = min(max(float(seconds), 0.1), MAX_SECONDS)
+    interval = max(float(interval), 0.001)
+    me = threading.get_ident()
+    counts: collections.Counter = collections.Counter()
+    rounds = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {t.ident: re.sub(r"-\d+", "", t.name) for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me: continue
+            stack: List[str] = []
+            while frame is not None:
+                stack.append(_label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, "unknown"))
+            counts[";".join(reversed(stack))] += 1
+        rounds += 1
+        time.sleep(interval)
+    return {"seconds": seconds, "interval": interval, "samples": rounds,
+            "stacks": [f"{stack} {n}" for stack, n in counts.most_common()]}
+
+
+# --- handler ---
+class _Capture:
+    def __init__(self, target: str, count: int):
+        self.target = target
+        self.count = count
+        self.profiles: List[cProfile.Profile] = []
+        self.done = threading.Event()
+
+
+def capture(action: Any) -> Any:
+    """with profiler.capture(action): 包住 handler；有人在等這個 action 才掛 cProfile。"""
+    if not _armed: return NOOP
+    cap = _armed.get(action)
+    if cap is None: return NOOP
+    return _profiled(cap)
+
+
+@contextlib.contextmanager
+def _profiled(cap: _Capture) -> Iterator[None]:
+    if cap.done.is_set() or not _profile_lock.acquire(blocking=False):
+        yield  # 另一個請求正在被 profile：這次照常執行
+        return
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+        yield
+    finally:
+        prof.disable()
+        _profile_lock.release()
+        with _armed_lock:
+            cap.profiles.append(prof)
+            if len(cap.profiles) >= cap.count: cap.done.set()
+
+
+def profile_handler(target: str, count: int = 1, timeout: float = 30.0, limit: int = 40) -> Dict[str, Any]:
+    cap = _Capture(target, max(1, int(count)))
+    with _armed_lock:
+        if target in _armed: return {"status": "error", "error": f"already capturing {target}"}
+        _armed[target] = cap
+    try:
+        cap.done.wait(min(max(float(timeout), 0.0), MAX_WAIT))
+    finally:
+        with _armed_lock:
+            _armed.pop(target, None)
+            profiles = list(cap.profiles)
+    if not profiles: return {"status": "error", "error": f"no {target} request within {timeout}s"}
+    out = io.StringIO()
+    stats = pstats.Stats(profiles[0], stream=out)
+    for p in profiles[1:]: stats.add(p)
+    stats.sort_stats("cumulative").print_stats(int(limit))
+    return {"status": "ok", "result": {"target": target, "captured": len(profiles), "stats": out.getvalue()}}
+
+
+def handle(params: Dict[str, Any]) -> Dict[str, Any]:
+    """profile 指令：mode = sample | handler。"""
+    if not ENABLED: return {"status": "error", "error": "profiling disabled (start the server with --profiling)"}
+    mode = params.get("mode", "sample")
+    try:
+        if mode == "sample":
+            return {"status": "ok", "result": sample(params.get("seconds", 5), params.get("interval", DEFAULT_INTERVAL))}
+        if mode == "handler":
+            if not params.get("target"): return {"status": "error", "error": "target required"}
+            return profile_handler(str(params["target"]), params.get("count", 1), params.get("timeout", 30),
+                                   params.get("limit", 40))
+    except (TypeError, ValueError) as e:
+        return {"status": "error", "error": str(e)}
+    return {"status": "error", "error": f"unknown mode: {mode}"}
+
+
+# --- CLI ---
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9800)
+    parser.add_argument("--db", action="store_true", help="對象是 db_server (預設是 main_server)")
+    sub = parser.add_subparsers(dest="mode", required=True)
+    p = sub.add_parser("sample", help="對所有執行緒取樣，輸出 collapsed stacks")
+    p.add_argument("--seconds", type=float, default=5.0)
+    p.add_argument("--interval", type=float, default=DEFAULT_INTERVAL)
+    p = sub.add_parser("handler", help="對某個 action 的下幾次請求掛 cProfile")
+    p.add_argument("target", help="action 名稱 (main_server: login、player_list_games...；db_server: query、create...)")
+    p.add_argument("--count", type=int, default=1)
+    p.add_argument("--timeout", type=float, default=30.0)
+    p.add_argument("--limit", type=int, default=40, help="輸出前幾個函式")
+    args = parser.parse_args()
+
+    params = {k: v for k, v in vars(args).items() if k not in ("host", "port", "db")}
+    req = dict(params, action="profile") if args.db else {"action": "admin_profile", "data": params}
+    with socket.create_connection((args.host, args.port)) as s:
+        send_frame(s, req)
+        resp = recv_frame(s)
+    if not resp or resp.get("status") != "ok":
+        sys.exit(f"[Profile] failed: {resp}")
+    r = resp["result"]
+    if args.mode == "sample":
+        print(f"[Profile] {r['samples']} samples over {r['seconds']:g}s", file=sys.stderr)
+        print("\n".join(r["stacks"]))
+    else:
+        print(f"[Profile] {r['target']}: {r['captured']} request(s)", file=sys.stderr)
+        print(r["stats"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+# server/session_worker.py
+#
+# Session worker pool：把 GameSession 分散到多個行程，房間的 relay 不再和 Lobby 搶同一個 GIL
+# - Lobby (main_server) 以 multiprocessing.Pipe 控制每個 worker：open / players / ping
+# - worker 自己 bind 房間的 game / chat / 觀戰 port，玩家直接連到 worker，不經過 Lobby
+# - 開房時挑房間數最少的健康 worker
+# - 定期 ping (排在共用的時間輪上)；沒回應或行程掛掉就把它的房間當作已關閉回報給 Lobby，並重啟該 worker
+# - worker 回報 started / closed 事件，Lobby 據此更新 ROOMS、遊玩紀錄與 replay
+
+import multiprocessing as mp
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from server.game_session import GameSession
+from server import timers
+from server import log
+
+# 一律用 spawn：重啟 worker 時 Lobby 已開著 socket，fork 會讓 worker 繼承到 (Lobby 結束後 port 仍被佔用)
+MP = mp.get_context("spawn")
+HEALTH_INTERVAL = 2.0  # 每隔幾秒 ping 一次
+HEALTH_TIMEOUT = 6.0   # 超過幾秒沒有 pong 視為卡死
+
+Event = Dict[str, Any]
+
+
+# --- worker 行程 ---
+def worker_main(worker_id: int, pipe) -> None:
+    send_lock = threading.Lock()
+    sessions: Dict[int, GameSession] = {}
+    frames_done = 0  # 已結束房間 relay 過的 frame 數
+
+    def emit(evt: Event) -> None:
+        with send_lock:
+            try: pipe.send(evt)
+            except (OSError, EOFError): pass
+
+    def on_start(s: GameSession) -> None:
+        emit({"evt": "started", "room_id": s.room_id})
+
+    def on_close(s: GameSession) -> None:
+        nonlocal frames_done
+        sessions.pop(s.room_id, None)
+        frames_done += s.seq
+        emit({"evt": "closed", "room_id": s.room_id, "replay": s.replay_meta or None, "result": s.outcome()})
+
+    log.info("Worker", "started", worker=worker_id, pid=mp.current_process().pid)
+    while True:
+        try:
+            cmd = pipe.recv()
+        except (EOFError, OSError):
+            break  # Lobby 結束
+        kind = cmd.get("cmd")
+        if kind == "open":
+            s = GameSession(cmd["room_id"], cmd["game_port"], cmd["players_count"], game_id=cmd["game_id"],
+                            players=cmd["players"], record=cmd["record"], on_start=on_start, on_close=on_close)
+            sessions[s.room_id] = s
+            s.start()
+        elif kind == "players":
+            s = sessions.get(cmd["room_id"])
+            if s: s.players = list(cmd["players"])
+        elif kind == "ping":
+            live = list(sessions.values())
+            emit({"evt": "pong", "rooms": len(live), "frames": frames_done + sum(s.seq for s in live),
+                  "sessions": {s.room_id: s.stats() for s in live}})
+        elif kind == "stop":
+            break
+
+
+# --- Lobby 端 ---
+class _Worker:
+    def __init__(self, worker_id: int):
+        self.id = worker_id
+        self.pipe, child = MP.Pipe()
+        self.proc = MP.Process(target=worker_main, args=(worker_id, child), daemon=True,
+                               name=f"session-worker-{worker_id}")
+        self.proc.start()
+        child.close()
+        self.lock = threading.Lock()
+        self.rooms: Set[int] = set()
+        self.frames = 0
+        self.sessions: Dict[int, Dict[str, int]] = {}  # 最近一次 pong 帶回的各房間 stats
+        self.last_pong = time.monotonic()
+        self.alive = True
+
+    def send(self, cmd: Dict[str, Any]) -> bool:
+        with self.lock:
+            try:
+                self.pipe.send(cmd)
+                return True
+            except (OSError, ValueError):
+                return False
+
+
+class SessionWorkerPool:
+    """on_event(worker_id, evt) 會在 pool 的執行緒被呼叫 (evt 為 started / closed)。"""
+
+    def __init__(self, size: int, on_event: Callable[[int, Event], None]):
+        self.size = size
+        self.on_event = on_event
+        self.lock = threading.Lock()
+        self.workers: List[_Worker] = []
+        self.stopping = False
+
+    def start(self) -> None:
+        for i in range(self.size):
+            self._spawn(i)
+        # 重啟 worker 會 join 舊行程，不在計時執行緒上直接跑
+        timers.call_every(HEALTH_INTERVAL, self._health_check, offload=True)
+
+    def stop(self) -> None:
+        """Lobby 正常關閉時呼叫：結束所有 worker，不當成掛掉去重啟。"""
+        with self.lock:
+            self.stopping = True
+            workers = list(self.workers)
+        for w in workers:
+            w.alive = False
+            if w.proc.is_alive(): w.proc.terminate()
+        for w in workers: w.proc.join(1.0)
+
+    def _spawn(self, worker_id: int) -> None:
+        w = _Worker(worker_id)
+        with self.lock:
+            if worker_id < len(self.workers): self.workers[worker_id] = w
+            else: self.workers.append(w)
+        threading.Thread(target=self._reader, args=(w,), daemon=True).start()
+
+    def place(self, room_id: int, game_port: int, players_count: int, game_id: str,
+              players: List[str], record: bool) -> Optional[int]:
+        """把房間交給負載最低的 worker，回傳 worker id；沒有可用的 worker 回傳 None。"""
+        with self.lock:
+            healthy = [w for w in self.workers if w.alive]
+            if not healthy: return None
+            w = min(healthy, key=lambda w: len(w.rooms))
+            w.rooms.add(room_id)
+        ok = w.send({"cmd": "open", "room_id": room_id, "game_port": game_port, "players_count": players_count,
+                     "game_id": game_id, "players": list(players), "record": record})
+        if not ok:
+            with self.lock: w.rooms.discard(room_id)
+            return None
+        return w.id
+
+    def update_players(self, worker_id: int, room_id: int, players: List[str]) -> None:
+        with self.lock: w = self.workers[worker_id]
+        w.send({"cmd": "players", "room_id": room_id, "players": list(players)})
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [{"id": w.id, "pid": w.proc.pid, "alive": w.alive, "rooms": len(w.rooms), "frames": w.frames}
+                    for w in self.workers]
+
+    def session_stats(self) -> Dict[int, Dict[str, int]]:
+        """room id -> GameSession.stats()，最多落後一次健康檢查的間隔。"""
+        with self.lock: workers = [w for w in self.workers if w.alive]
+        res: Dict[int, Dict[str, int]] = {}
+        for w in workers: res.update(w.sessions)
+        return res
+
+    def _reader(self, w: _Worker) -> None:
+        while True:
+            try:
+                evt = w.pipe.recv()
+            except (EOFError, OSError):
+                break
+            if evt.get("evt") == "pong":
+                w.last_pong = time.monotonic()
+                w.frames = evt.get("frames", 0)
+                w.sessions = evt.get("sessions", {})
+                continue
+            if evt.get("evt") == "closed":
+                with self.lock: w.rooms.discard(evt["room_id"])
+            try:
+                self.on_event(w.id, evt)
+            except Exception as e:
+                log.error("Workers", "on_event failed", error=e)
+        self._fail(w)
+
+    #worker 掛掉或卡死：它的房間都算關閉 (玩家的連線也已斷)，換一個新的 worker 頂上
+    def _fail(self, w: _Worker) -> None:
+        with self.lock:
+            if not w.alive or self.stopping: return
+            w.alive = False
+            lost = sorted(w.rooms)
+            w.rooms.clear()
+        log.warn("Workers", f"Worker {w.id} is down, restarting", rooms_lost=len(lost))
+        if w.proc.is_alive(): w.proc.kill()
+        w.proc.join(1.0)
+        w.pipe.close()
+        for rid in lost:
+            try:
+                self.on_event(w.id, {"evt": "closed", "room_id": rid, "replay": None})
+            except Exception as e:
+                log.error("Workers", "on_event failed", error=e)
+        self._spawn(w.id)
+
+    def _health_check(self) -> None:
+        with self.lock: workers = list(self.workers)
+        for w in workers:
+            if not w.alive: continue
+            if not w.proc.is_alive() or time.monotonic() - w.last_pong > HEALTH_TIMEOUT:
+                self._fail(w)
+            else:
+                w.send({"cmd": "ping"})
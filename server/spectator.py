@@ -0,0 +1,242 @@
+# server/spectator.py
+#
+# 觀戰 fan-out：每個房間一個 SpectatorHub
+# - 玩家的 relay 執行緒只呼叫 publish()：序列化一次、丟進 inbox，O(1)，不會被觀眾拖慢
+# - 一條 hub 執行緒用 selectors + non-blocking socket 把同一份 bytes 寫給所有觀眾
+# - 每個觀眾有上限的送出佇列；位置類訊息 (update) 只保留最新一筆，
+#   其他訊息塞爆時清空佇列，改送 {"type": "reset"} 再送一次完整 snapshot 重新同步；
+#   snapshot 會重送觀眾已經套用過的事件，遊戲 client 收到 reset 要先清空盤面
+# - 中途加入的觀眾先收到 snapshot (init + 歷史事件 + 每個角色最新位置)；snapshot 不受佇列上限限制，
+#   上限是「snapshot 長度 + MAX_PENDING」，送 snapshot 不會讓觀眾立刻又被判定塞爆
+# - 歷史事件最多保留 MAX_HISTORY 筆 (gamestart 另外保留)；盤面需要更多事件才能重建的遊戲，
+#   應定期送可合併的 update 帶完整狀態
+
+import collections
+import queue
+import selectors
+import socket
+import threading
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from common.protocol import encode_frame
+from common.gamesdk.replay import coalesce_key
+
+SPECTATOR_ROLE = "Spectator"
+_START = ("gamestart",)  # publish() 用來標記 gamestart 的 key
+MAX_SPECTATORS = 2000
+MAX_PENDING = 256  # 每個觀眾在 snapshot 之外最多排隊幾個 frame
+MAX_HISTORY = 4096  # snapshot 裡最多帶幾筆不可合併的歷史事件
+
+
+class _Viewer:
+    def __init__(self, conn: socket.socket):
+        self.conn = conn
+        self.out = b""  # 正在寫的 bytes
+        self.pending: Deque[List[Any]] = collections.deque()  # [key, data]
+        self.latest: Dict[Tuple[str, Any], List[Any]] = {}  # key -> pending 裡的那一筆
+        self.limit = MAX_PENDING
+
+    def reset(self, frames: List[Tuple[Any, bytes]]) -> None:
+        """換成一份 snapshot：整份放進佇列 (不檢查上限)，上限改為 snapshot 長度 + MAX_PENDING。"""
+        self.pending.clear()
+        self.latest.clear()
+        for key, data in frames:
+            entry = [key, data]
+            self.pending.append(entry)
+            if key is not None: self.latest[key] = entry
+        self.limit = len(frames) + MAX_PENDING
+
+    def enqueue(self, key, data: bytes) -> bool:
+        """回傳 False 代表佇列已滿，需要重新同步。"""
+        if key is not None and key in self.latest:
+            self.latest[key][1] = data  # 原地覆蓋，不增加長度
+            return True
+        if len(self.pending) >= self.limit:
+            return False
+        entry = [key, data]
+        self.pending.append(entry)
+        if key is not None:
+            self.latest[key] = entry
+        return True
+
+    def has_data(self) -> bool:
+        return bool(self.out or self.pending)
+
+    def fill(self) -> None:
+        # 一次把排隊的 frame 接起來，減少 send 次數
+        parts = [self.out] if self.out else []
+        size = len(self.out)
+        while self.pending and size < 65536:
+            key, data = self.pending.popleft()
+            if key is not None:
+                self.latest.pop(key, None)
+            parts.append(data)
+            size += len(data)
+        self.out = b"".join(parts)
+
+
+class SpectatorHub(threading.Thread):
+    def __init__(self, room_id: int):
+        super().__init__(daemon=True)
+        self.room_id = room_id
+        self.inbox: "queue.SimpleQueue[Tuple[str, Any, Any]]" = queue.SimpleQueue()
+        self.viewers: Dict[socket.socket, _Viewer] = {}
+        self.start_frame: Optional[bytes] = None  # gamestart：不會被擠出 history
+        self.history: Deque[bytes] = collections.deque(maxlen=MAX_HISTORY)  # 不可合併的事件 (move, kill...)
+        self.latest: Dict[Tuple[str, Any], bytes] = {}  # 可合併事件的最新值
+        self.init_frame = encode_frame({"type": "init", "role": SPECTATOR_ROLE, "msg": "Spectating..."})
+        self.reset_frame = encode_frame({"type": "reset"})
+        self.running = True
+        self.bytes_out = 0  # 實際寫給觀眾的 bytes (只在 hub 執行緒累加)
+        self.sel = selectors.DefaultSelector()
+        # 用 socketpair 喚醒 select
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.sel.register(self._wake_r, selectors.EVENT_READ)
+
+    # --- 給其他執行緒呼叫 ---
+    def add(self, conn: socket.socket) -> None:
+        self.inbox.put(("add", conn, None))
+        self._wake()
+
+    def publish(self, msg: Dict[str, Any], data: Optional[bytes] = None) -> None:
+        """relay 執行緒呼叫：可傳入已序列化的 data，避免重複 encode。"""
+        key = coalesce_key(msg)
+        if key is None and msg.get("type") == "gamestart": key = _START
+        self.inbox.put(("msg", key, data or encode_frame(msg)))
+        self._wake()
+
+    def close(self) -> None:
+        self.inbox.put(("close", None, None))
+        self._wake()
+
+    def count(self) -> int:
+        return len(self.viewers)
+
+    def _wake(self) -> None:
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # buffer 滿代表已經有待處理的喚醒
+
+    # --- hub 執行緒 ---
+    def _snapshot(self) -> List[Tuple[Any, bytes]]:
+        frames: List[Tuple[Any, bytes]] = [(None, self.init_frame)]
+        if self.start_frame is not None: frames.append((None, self.start_frame))
+        frames += [(None, d) for d in self.history]
+        frames += list(self.latest.items())
+        return frames
+
+    def _resync(self, v: _Viewer, reset: bool = False) -> None:
+        """reset=True：觀眾已經收過部分事件，snapshot 前先送 reset 讓 client 清空狀態。"""
+        frames = self._snapshot()
+        if reset: frames.insert(0, (None, self.reset_frame))
+        v.reset(frames)
+
+    def _drain_inbox(self) -> None:
+        while True:
+            try:
+                kind, a, b = self.inbox.get_nowait()
+            except queue.Empty:
+                return
+            if kind == "close":
+                self.running = False
+                return
+            if kind == "add":
+                if len(self.viewers) >= MAX_SPECTATORS:
+                    a.close()
+                    continue
+                a.setblocking(False)
+                v = _Viewer(a)
+                self.viewers[a] = v
+                self._resync(v)
+                self.sel.register(a, selectors.EVENT_READ | selectors.EVENT_WRITE)
+                continue
+            key, data = a, b
+            if key is _START:
+                self.start_frame, key = data, None
+            elif key is None:
+                self.history.append(data)
+            else:
+                self.latest[key] = data
+            for v in self.viewers.values():
+                was_idle = not v.has_data()
+                if not v.enqueue(key, data):
+                    self._resync(v, reset=True)  # 慢觀眾：丟掉舊的，直接跳到目前狀態
+                if was_idle:
+                    self.sel.modify(v.conn, selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+    def _drop(self, conn: socket.socket) -> None:
+        self.viewers.pop(conn, None)
+        try:
+            self.sel.unregister(conn)
+        except (KeyError, ValueError):
+            pass
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+    def run(self) -> None:
+        try:
+            while self.running:
+                for key, mask in self.sel.select():
+                    sock = key.fileobj
+                    if sock is self._wake_r:
+                        try:
+                            while self._wake_r.recv(4096):
+                                pass
+                        except (BlockingIOError, OSError):
+                            pass
+                        continue
+                    v = self.viewers.get(sock)
+                    if v is None:
+                        continue
+                    if mask & selectors.EVENT_READ:
+                        # 觀眾是唯讀的：收到資料就丟掉，收到 EOF 代表離開
+                        try:
+                            if not sock.recv(4096):
+                                self._drop(sock)
+                                continue
+                        except BlockingIOError:
+                            pass
+                        except OSError:
+                            self._drop(sock)
+                            continue
+                    if mask & selectors.EVENT_WRITE:
+                        if not v.out:
+                            v.fill()
+                        try:
+                            sent = sock.send(v.out)
+                            v.out = v.out[sent:]
+                            self.bytes_out += sent
+                        except BlockingIOError:
+                            pass
+                        except OSError:
+                            self._drop(sock)
+                            continue
+                        if not v.has_data():
+                            self.sel.modify(sock, selectors.EVENT_READ)
+                self._drain_inbox()
+        finally:
+            # 房間結束時，盡力送出最後的 frame (例如 Room closed) 再關閉
+            for v in list(self.viewers.values()):
+                v.fill()
+                try:
+                    v.conn.setblocking(True)
+                    v.conn.settimeout(0.5)
+                    v.conn.sendall(v.out)
+                except OSError:
+                    pass
+                self._drop(v.conn)
+            self.sel.close()
+            self._wake_r.close()
+            self._wake_w.close()
@@ -0,0 +1,253 @@
+# server/state_server.py
+#
+# 共享狀態服務：讓多個 main_server (Lobby) 共用線上名單、房間與房號
+# - StateStore：記憶體 key-value，支援 TTL、compare-and-set、incr、prefix scan 與 pub/sub
+#   (有 TTL 的 key 在時間輪上排一個到期 timer；touch 只延後期限，timer 到時再依新期限重排)
+# - 單一 Lobby 時 main_server 直接在行程內用 StateStore
+# - 多個 Lobby 時啟動本檔 (獨立行程)，各 Lobby 以 StateClient 連線 (TCP + JSON + Length-Prefixed Framing)
+# - 狀態只在記憶體：重啟即清空 (帳號、遊戲等持久資料仍在 db_server)
+
+import signal
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from common.protocol import send_frame, recv_frame
+from server import timers
+from server import log
+
+HOST = "0.0.0.0"
+PORT = 9950
+
+Listener = Callable[[Dict[str, Any]], None]
+
+
+class StateStore:
+    """所有操作都是原子的 (單一鎖)。value 必須可 JSON 序列化；ttl 以秒為單位，None 代表不過期。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data: Dict[str, Any] = {}
+        self.expires: Dict[str, float] = {}
+        self.timers: Dict[str, timers.Timer] = {}  # 有 TTL 的 key -> 到期檢查的 timer
+        self.listeners: Dict[str, List[Listener]] = {}
+
+    def _alive(self, key: str) -> bool:
+        exp = self.expires.get(key)
+        if exp is not None and exp <= time.monotonic(): self._drop(key)
+        return key in self.data
+
+    def _drop(self, key: str) -> None:
+        self.data.pop(key, None); self.expires.pop(key, None)
+        timer = self.timers.pop(key, None)
+        if timer: timer.cancel()
+
+    def _put(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        self.data[key] = value
+        if ttl is None:
+            self.expires.pop(key, None)
+            return
+        self.expires[key] = time.monotonic() + ttl
+        if key not in self.timers: self.timers[key] = timers.call_later(ttl, self._expire, key)
+
+    def get(self, key: str) -> Any:
+        with self.lock:
+            return self.data.get(key) if self._alive(key) else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        """nx=True 時只在 key 不存在才寫入 (用來搶佔，例如同一帳號只能登入一次)。"""
+        with self.lock:
+            if nx and self._alive(key): return False
+            self._put(key, value, ttl)
+            return True
+
+    def cas(self, key: str, expect: Any, value: Any, ttl: Optional[float] = None) -> bool:
+        """目前值等於 expect 才換成 value；expect=None 代表 key 不存在，value=None 代表刪除。"""
+        with self.lock:
+            current = self.data.get(key) if self._alive(key) else None
+            if current != expect: return False
+            if value is None:
+                self._drop(key)
+            else:
+                self._put(key, value, ttl)
+            return True
+
+    def incr(self, key: str, by: int = 1) -> int:
+        with self.lock:
+            value = (self.data.get(key, 0) if self._alive(key) else 0) + by
+            self.data[key] = value
+            return value
+
+    def delete(self, key: str) -> bool:
+        with self.lock:
+            existed = self._alive(key)
+            self._drop(key)
+            return existed
+
+    def touch(self, keys: List[str], ttl: float) -> int:
+        """延長多個 key 的 TTL (心跳用)，回傳仍存在的 key 數。"""
+        with self.lock:
+            n = 0
+            for key in keys:
+                if self._alive(key):
+                    self.expires[key] = time.monotonic() + ttl
+                    n += 1
+            return n
+
+    def scan(self, prefix: str) -> Dict[str, Any]:
+        with self.lock:
+            return {k: v for k, v in list(self.data.items()) if k.startswith(prefix) and self._alive(k)}
+
+    def publish(self, channel: str, msg: Dict[str, Any]) -> None:
+        with self.lock: listeners = list(self.listeners.get(channel, ()))
+        for fn in listeners:
+            try: fn(msg)
+            except Exception as e: log.error("State", "listener failed", channel=channel, error=e)
+
+    def subscribe(self, channel: str, fn: Listener) -> None:
+        with self.lock: self.listeners.setdefault(channel, []).append(fn)
+
+    def unsubscribe(self, channel: str, fn: Listener) -> None:
+        with self.lock:
+            fns = self.listeners.get(channel, [])
+            if fn in fns: fns.remove(fn)
+
+    def _expire(self, key: str) -> None:
+        """到期 timer (在計時執行緒上)：期限被 touch 延後就依新期限重排，否則刪除。"""
+        with self.lock:
+            self.timers.pop(key, None)
+            exp = self.expires.get(key)
+            if exp is None: return
+            left = exp - time.monotonic()
+            if left > 0: self.timers[key] = timers.call_later(left, self._expire, key)
+            else: self._drop(key)
+
+
+class StateClient:
+    """
+    與 StateStore 相同介面，但透過 TCP 連到 state_server。
+    一般操作共用一條連線 (以鎖序列化)；subscribe 另外開一條長連線接收推播，斷線會自動重連。
+    """
+
+    def __init__(self, host: str, port: int = PORT):
+        self.host = host
+        self.port = port
+        self.lock = threading.Lock()
+        self.sock: Optional[socket.socket] = None
+
+    def _call(self, action: str, **kw) -> Any:
+        req = dict(kw, action=action)
+        with self.lock:
+            for attempt in range(2):  # 連線斷掉就重連一次
+                try:
+                    if self.sock is None:
+                        self.sock = socket.create_connection((self.host, self.port))
+                    send_frame(self.sock, req)
+                    resp = recv_frame(self.sock)
+                    if resp is None: raise OSError("state server closed connection")
+                    if resp.get("status") != "ok": raise RuntimeError(resp.get("error"))
+                    return resp.get("result")
+                except OSError:
+                    if self.sock: self.sock.close()
+                    self.sock = None
+                    if attempt: raise
+
+    def get(self, key): return self._call("get", key=key)
+    def set(self, key, value, ttl=None, nx=False): return self._call("set", key=key, value=value, ttl=ttl, nx=nx)
+    def cas(self, key, expect, value, ttl=None): return self._call("cas", key=key, expect=expect, value=value, ttl=ttl)
+    def incr(self, key, by=1): return self._call("incr", key=key, by=by)
+    def delete(self, key): return self._call("delete", key=key)
+    def touch(self, keys, ttl): return self._call("touch", keys=list(keys), ttl=ttl)
+    def scan(self, prefix): return self._call("scan", prefix=prefix)
+    def publish(self, channel, msg): return self._call("publish", channel=channel, msg=msg)
+
+    def subscribe(self, channel: str, fn: Listener) -> None:
+        threading.Thread(target=self._listen, args=(channel, fn), daemon=True).start()
+
+    def _listen(self, channel: str, fn: Listener) -> None:
+        while True:
+            try:
+                with socket.create_connection((self.host, self.port)) as s:
+                    send_frame(s, {"action": "subscribe", "channel": channel})
+                    while True:
+                        msg = recv_frame(s)
+                        if msg is None: break
+                        fn(msg)
+            except OSError:
+                pass
+            time.sleep(1.0)
+
+
+STORE: Optional[StateStore] = None  # main() 建立
+
+
+def handle(req: Dict[str, Any]) -> Dict[str, Any]:
+    act = req.get("action")
+    try:
+        if act == "ping": return {"status": "ok", "result": "pong"}
+        if act == "get": return {"status": "ok", "result": STORE.get(req["key"])}
+        if act == "set": return {"status": "ok", "result": STORE.set(req["key"], req.get("value"), req.get("ttl"), bool(req.get("nx")))}
+        if act == "cas": return {"status": "ok", "result": STORE.cas(req["key"], req.get("expect"), req.get("value"), req.get("ttl"))}
+        if act == "incr": return {"status": "ok", "result": STORE.incr(req["key"], int(req.get("by", 1)))}
+        if act == "delete": return {"status": "ok", "result": STORE.delete(req["key"])}
+        if act == "touch": return {"status": "ok", "result": STORE.touch(req.get("keys") or [], float(req["ttl"]))}
+        if act == "scan": return {"status": "ok", "result": STORE.scan(req.get("prefix", ""))}
+        if act == "publish":
+            STORE.publish(req["channel"], req.get("msg") or {})
+            return {"status": "ok"}
+        return {"status": "error", "error": f"unknown action {act}"}
+    except (KeyError, TypeError, ValueError) as e:
+        return {"status": "error", "error": f"bad request: {e}"}
+
+
+def worker(conn: socket.socket, addr) -> None:
+    send_lock = threading.Lock()
+    subs = []
+    try:
+        while True:
+            req = recv_frame(conn)
+            if req is None: break
+            if req.get("action") == "subscribe":
+                # 這條連線之後只用來推播
+                def push(msg, conn=conn):
+                    with send_lock: send_frame(conn, msg)
+                STORE.subscribe(str(req.get("channel")), push)
+                subs.append((str(req.get("channel")), push))
+                continue
+            resp = handle(req)
+            with send_lock: send_frame(conn, resp)
+    finally:
+        for channel, fn in subs: STORE.unsubscribe(channel, fn)
+        conn.close()
+
+
+def main() -> None:
+    global STORE
+    STORE = StateStore()
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind((HOST, PORT))
+        s.listen(128)
+        # accept 直接阻塞；SIGTERM 時關掉 listener 喚醒它（Ctrl+C 本來就會打斷 accept）
+        signal.signal(signal.SIGTERM, lambda *_: s.close())
+        log.info("State", f"listening on {HOST}:{PORT}")
+        try:
+            while True:
+                try: conn, addr = s.accept()
+                except OSError: break
+                threading.Thread(target=worker, args=(conn, addr), daemon=True).start()
+        except KeyboardInterrupt:
+            pass
+        log.info("State", "Server closed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+# server/timers.py
+#
+# 行程內共用的計時服務：階層式時間輪 (hierarchical timing wheel)，整個行程只有一條計時執行緒
+# - 取代各處「每個房間 / 每條連線一個 threading.Timer 或 sleep 迴圈」：房間等人的期限、斷線重連的寬限、
+#   在線狀態過期、心跳與 worker 健康檢查都排在這裡
+# - LEVELS 層、每層 SLOTS 格；第 0 層一格 = TICK 秒，第 n 層一格 = 第 n-1 層一整圈。
+#   排程 / 取消都是 O(1) (放進 / 移出某一格的 set)；每轉完一圈才把上一層的一格「降級」分散到下層
+# - 計時執行緒只在下一個有 timer 的格子 (或下一次降級) 醒來，沒有 timer 時完全不醒
+# - callback 在計時執行緒上執行，必須很快；可能卡住的 (網路 I/O、join 行程) 用 offload=True 另開執行緒跑
+#
+#   from server import timers
+#   t = timers.call_later(30.0, fn, arg)     # 30 秒後呼叫 fn(arg)
+#   t.cancel()
+#   timers.call_every(10.0, heartbeat, offload=True)
+
+import threading
+import time
+from typing import Any, Callable, List, Optional, Set
+
+from server import log
+
+TICK = 0.05   # 第 0 層每格秒數 (計時精度)
+SLOTS = 64    # 每層格數 (2 的次方)
+LEVELS = 4    # 可直接排到 TICK * SLOTS**LEVELS ≈ 9.7 天；更久的先排在最上層，到時再重排
+
+_BITS = SLOTS.bit_length() - 1
+_MASK = SLOTS - 1
+_SPAN = SLOTS ** LEVELS
+
+
+class Timer:
+    __slots__ = ("wheel", "expires", "fn", "args", "interval", "offload", "bucket", "cancelled")
+
+    def __init__(self, wheel: "TimerWheel", expires: int, fn: Callable[..., Any], args: tuple,
+                 interval: Optional[float], offload: bool):
+        self.wheel = wheel
+        self.expires = expires      # 到期的 tick
+        self.fn = fn
+        self.args = args
+        self.interval = interval    # call_every 的週期，一次性的為 None
+        self.offload = offload
+        self.bucket: Optional[Set["Timer"]] = None  # 目前所在的格子
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        """O(1)；已觸發或已取消的再呼叫沒有作用。"""
+        with self.wheel.cond:
+            self.cancelled = True
+            if self.bucket is not None:
+                self.bucket.discard(self)
+                self.bucket = None
+                self.wheel.count -= 1
+
+
+class TimerWheel:
+    def __init__(self, tick: float = TICK):
+        self.tick_len = tick
+        self.origin = time.monotonic()
+        self.cond = threading.Condition()
+        self.levels: List[List[Set[Timer]]] = [[set() for _ in range(SLOTS)] for _ in range(LEVELS)]
+        self.tick = 0           # 下一個要處理的 tick
+        self.count = 0          # 輪子上的 timer 數
+        self.wake_at: Optional[int] = None  # 計時執行緒預計醒來的 tick (None = 無限期等待)
+        self.fired = 0
+        self.thread: Optional[threading.Thread] = None
+
+    def _now(self) -> int:
+        return int((time.monotonic() - self.origin) / self.tick_len)
+
+    # --- 排程 ---
+    def call_later(self, delay: float, fn: Callable[..., Any], *args: Any, offload: bool = False) -> Timer:
+        return self._schedule(delay, fn, args, None, offload)
+
+    def call_every(self, interval: float, fn: Callable[..., Any], *args: Any, offload: bool = False) -> Timer:
+        """每 interval 秒呼叫一次 (第一次在 interval 秒後)，直到 cancel()。"""
+        return self._schedule(interval, fn, args, interval, offload)
+
+    def _schedule(self, delay: float, fn: Callable[..., Any], args: tuple,
+                  interval: Optional[float], offload: bool) -> Timer:
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="timers", daemon=True)
+                self.thread.start()
+            if not self.count: self.tick = max(self.tick, self._now())  # 空轉期間不必逐格追上
+            t = Timer(self, self._ticks(delay), fn, args, interval, offload)
+            self._place(t)
+            if self.wake_at is None or t.expires < self.wake_at: self.cond.notify()
+            return t
+
+    def _ticks(self, delay: float) -> int:
+        # 無條件進位：不會比要求的時間早觸發
+        return -int(-(time.monotonic() - self.origin + max(delay, 0.0)) // self.tick_len)
+
+    def _place(self, t: Timer) -> None:
+        expires = max(t.expires, self.tick)
+        delta = expires - self.tick
+        if delta >= _SPAN: expires, delta = self.tick + _SPAN - 1, _SPAN - 1  # 先排在最遠處，降級時再重排
+        level = 0
+        while delta >= SLOTS ** (level + 1): level += 1
+        bucket = self.levels[level][(expires >> (_BITS * level)) & _MASK]
+        bucket.add(t)
+        t.bucket = bucket
+        self.count += 1
+
+    # --- 計時執行緒 ---
+    def _advance(self, due: List[Timer]) -> None:
+        """處理 self.tick 這一格：必要時先把上層的一格降級，再取出第 0 層到期的 timer。"""
+        tk = self.tick
+        level = 1
+        while level < LEVELS and (tk >> (_BITS * (level - 1))) & _MASK == 0:
+            bucket = self.levels[level][(tk >> (_BITS * level)) & _MASK]
+            self.levels[level][(tk >> (_BITS * level)) & _MASK] = set()
+            self.count -= len(bucket)
+            for t in bucket: self._place(t)
+            level += 1
+        bucket = self.levels[0][tk & _MASK]
+        self.levels[0][tk & _MASK] = set()
+        self.count -= len(bucket)
+        for t in bucket:
+            t.bucket = None
+            if t.expires > tk: self._place(t)  # 超出輪子範圍而提早降下來的
+            else: due.append(t)
+        self.tick = tk + 1
+
+    def _next_due(self) -> int:
+        """第 0 層在這一圈內下一個非空的格子；都沒有就等到下次降級 (剛好在降級的格子上就是現在)。"""
+        if not self.tick & _MASK: return self.tick
+        for tk in range(self.tick, (self.tick | _MASK) + 1):
+            if self.levels[0][tk & _MASK]: return tk
+        return (self.tick | _MASK) + 1
+
+    def _run(self) -> None:
+        while True:
+            due: List[Timer] = []
+            with self.cond:
+                while True:
+                    now = self._now()
+                    if self.count and self.tick <= now: break
+                    if not self.count:
+                        self.wake_at = None
+                        self.cond.wait()
+                        continue
+                    self.wake_at = self._next_due()
+                    if self.wake_at <= now: break
+                    self.cond.wait(self.wake_at * self.tick_len - (time.monotonic() - self.origin))
+                while self.tick <= now and self.count: self._advance(due)
+                if not self.count: self.tick = max(self.tick, now + 1)
+                self.wake_at = None
+            for t in due: self._fire(t)
+
+    def _fire(self, t: Timer) -> None:
+        if t.cancelled: return
+        self.fired += 1
+        if t.offload:
+            threading.Thread(target=self._call, args=(t,), daemon=True).start()
+        else:
+            self._call(t)
+        if t.interval is not None:
+            with self.cond:
+                if t.cancelled or t.bucket is not None: return
+                t.expires = self._ticks(t.interval)
+                self._place(t)
+
+    @staticmethod
+    def _call(t: Timer) -> None:
+        try:
+            t.fn(*t.args)
+        except Exception as e:
+            log.error("Timers", "callback failed", fn=getattr(t.fn, "__qualname__", t.fn), error=e)
+
+    def __len__(self) -> int:
+        return self.count
+
+
+# 行程內共用的時間輪 (session worker 是 spawn 出來的獨立行程，各自有一個)
+WHEEL = TimerWheel()
+
+
+def call_later(delay: float, fn: Callable[..., Any], *args: Any, offload: bool = False) -> Timer:
+    return WHEEL.call_later(delay, fn, *args, offload=offload)
+
+
+def call_every(interval: float, fn: Callable[..., Any], *args: Any, offload: bool = False) -> Timer:
+    return WHEEL.call_every(interval, fn, *args, offload=offload)
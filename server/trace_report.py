@@ -0,0 +1,119 @@
+# server/trace_report.py
+#
+# 分析 main_server / db_server 以 --trace-file 記下的 span (server/tracing.py)
+# - 合併多個行程的 trace 檔，依 trace id 與 parent 把 span 接成樹：
+#   lobby <action> → handler 裡的 helper / db_req → db_server 的 db <action> → lock_wait / commit_wait
+# - 依最外層的 action 分組，同一路徑的 span 合併計算：次數、每個 request 平均花多少時間、佔比、
+#   扣掉子 span 後的自身時間 (self)；db_req 的 self 約等於連線 + 序列化 + 網路的成本
+# - --collapsed 輸出「a;b;c 微秒」格式的自身時間堆疊，可直接餵給 flamegraph.pl / speedscope
+#
+#   python server/trace_report.py lobby.trace db.trace [--action login] [--top 10]
+#   python server/trace_report.py lobby.trace db.trace --collapsed > out.folded
+
+import argparse
+import collections
+import json
+import sys
+from typing import Any, Dict, Iterator, List, Tuple
+
+BAR_WIDTH = 30
+
+Key = Tuple[str, ...]
+
+
+def _read_spans(paths: List[str]) -> Iterator[Dict[str, Any]]:
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip(): continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # 行程被砍掉時最後一行可能寫了一半
+
+
+def aggregate(spans: List[Dict[str, Any]]) -> Tuple[Dict[str, List[float]], Dict[Key, List[float]]]:
+    """
+    回傳 (roots, paths)：
+      roots[action] = [request 數, 總時間]
+      paths[(root, ..., name)] = [次數, 總時間, 自身時間]
+    parent 不在檔案裡的 span (例如只給了 db_server 的 trace 檔) 自己當根。
+    """
+    by_id = {s["span"]: s for s in spans}
+    children: Dict[str, List[Dict[str, Any]]] = collections.defaultdict(list)
+    roots_list = []
+    for s in spans:
+        if s.get("parent") in by_id: children[s["parent"]].append(s)
+        else: roots_list.append(s)
+
+    roots: Dict[str, List[float]] = {}
+    paths: Dict[Key, List[float]] = {}
+    for root in roots_list:
+        r = roots.setdefault(root["name"], [0, 0.0])
+        r[0] += 1
+        r[1] += root["dur"]
+        stack = [(root, (root["name"],))]
+        while stack:
+            s, p = stack.pop()
+            kids = children.get(s["span"], ())
+            agg = paths.setdefault(p, [0, 0.0, 0.0])
+            agg[0] += 1
+            agg[1] += s["dur"]
+            agg[2] += max(0.0, s["dur"] - sum(k["dur"] for k in kids))
+            for k in kids: stack.append((k, p + (k["name"],)))
+    return roots, paths
+
+
+def _bar(frac: float) -> str:
+    n = int(round(frac * BAR_WIDTH))
+    return "█" * n + "·" * (BAR_WIDTH - n)
+
+
+def print_tree(roots: Dict[str, List[float]], paths: Dict[Key, List[float]], top: int) -> None:
+    kids: Dict[Key, List[Key]] = collections.defaultdict(list)
+    for p in paths:
+        if len(p) > 1: kids[p[:-1]].append(p)
+    order = sorted(roots, key=lambda name: roots[name][1], reverse=True)
+    for name in order[:top] if top else order:
+        n, total = roots[name]
+        print(f"{name}  requests={n}  avg={total / n * 1000:.3f}ms  total={total * 1000:.1f}ms")
+        print(f"  {'span':<44} {'calls/req':>9} {'ms/req':>9} {'%':>6} {'self%':>6}")
+
+        def walk(p: Key, depth: int) -> None:
+            count, dur, own = paths[p]
+            label = ("  " * depth + p[-1])[:44]
+            print(f"  {label:<44} {count / n:>9.2f} {dur / n * 1000:>9.3f} {dur / total * 100 if total else 0:>6.1f} "
+                  f"{own / total * 100 if total else 0:>6.1f} {_bar(dur / total if total else 0)}")
+            for c in sorted(kids.get(p, ()), key=lambda c: paths[c][1], reverse=True): walk(c, depth + 1)
+
+        walk((name,), 0)
+        print()
+
+
+def print_collapsed(paths: Dict[Key, List[float]]) -> None:
+    for p, (_, _, own) in sorted(paths.items()):
+        us = int(own * 1_000_000)
+        if us: print(f"{';'.join(p)} {us}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="+", help="main_server / db_server 的 --trace-file")
+    parser.add_argument("--action", default=None, help="只看名稱含這個字串的 action (例如 login)")
+    parser.add_argument("--top", type=int, default=0, help="只列總時間最多的前幾個 action (0 = 全部)")
+    parser.add_argument("--collapsed", action="store_true", help="輸出 flamegraph 用的 collapsed stacks (微秒)")
+    args = parser.parse_args()
+
+    spans = list(_read_spans(args.files))
+    roots, paths = aggregate(spans)
+    if args.action:
+        roots = {k: v for k, v in roots.items() if args.action in k}
+        paths = {p: v for p, v in paths.items() if p[0] in roots}
+    if not roots:
+        sys.exit("[Trace] no matching spans")
+    if args.collapsed: print_collapsed(paths)
+    else: print_tree(roots, paths, args.top)
+
+
+if __name__ == "__main__":
+    main()
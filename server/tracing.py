@@ -0,0 +1,107 @@
+# server/tracing.py
+#
+# 輕量的請求追蹤 (預設關閉；main_server / db_server 帶 --trace-file 才開啟)
+# - LobbyClient 每個 request 的 frame 帶一個 "trace" id；main_server 以它為根 span 處理 handler，
+#   handler 裡每次 db_req 是一個子 span，並把 trace / parent 放進送給 db_server 的 request，
+#   db_server 再記下自己的處理、等 LOCK、等落地 span —— 同一個 trace 跨兩個行程串起來
+# - 目前的 span 放在 thread-local：handler 在哪個執行緒跑，子 span 就自動接在它下面
+# - span 結束時放進佇列，由背景執行緒批次寫到 trace 檔 (每行一個 JSON)；
+#   server/trace_report.py 合併各行程的 trace 檔，依 action 畫出 flamegraph 式的時間分解
+# - 關閉時 start() / child() 直接回傳共用的空 context，不產生 id、不取時間
+
+import contextlib
+import functools
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+ENABLED = False
+NOOP = contextlib.nullcontext()
+PROC = ""  # 寫在每個 span 裡，分辨是哪個行程記的 (lobby:9800、db:9900 ...)
+
+_CTX = threading.local()
+_QUEUE: "queue.SimpleQueue[dict]" = queue.SimpleQueue()
+
+
+def new_id() -> str:
+    return os.urandom(8).hex()
+
+
+class Span:
+    __slots__ = ("trace", "id", "parent", "name", "start", "t0", "prev")
+
+    def __init__(self, name: str, trace: str, parent: Optional[str]):
+        self.name = name
+        self.trace = trace
+        self.parent = parent
+        self.id = new_id()
+
+    def __enter__(self) -> "Span":
+        self.prev = getattr(_CTX, "span", None)
+        _CTX.span = self
+        self.start = time.time()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        _CTX.span = self.prev
+        _QUEUE.put({"trace": self.trace, "span": self.id, "parent": self.parent, "name": self.name,
+                    "proc": PROC, "start": self.start, "dur": time.perf_counter() - self.t0})
+
+
+def start(name: str, trace: Optional[str], parent: Optional[str] = None) -> Any:
+    """入口的 span：trace 為 None (呼叫端沒帶) 或追蹤關閉時不記錄。"""
+    if not ENABLED or not trace: return NOOP
+    return Span(name, str(trace)[:32], parent)
+
+
+def child(name: str) -> Any:
+    """目前 span 底下的子 span；這個執行緒沒有進行中的 trace 就不記錄。"""
+    if not ENABLED: return NOOP
+    cur = getattr(_CTX, "span", None)
+    if cur is None: return NOOP
+    return Span(name, cur.trace, cur.id)
+
+
+def add(name: str, dur: float) -> None:
+    """補記一個剛結束、長度為 dur 秒的子 span (例如等鎖的時間)。"""
+    if not ENABLED: return
+    cur = getattr(_CTX, "span", None)
+    if cur is None: return
+    _QUEUE.put({"trace": cur.trace, "span": new_id(), "parent": cur.id, "name": name,
+                "proc": PROC, "start": time.time() - dur, "dur": dur})
+
+
+def active() -> bool:
+    return ENABLED and getattr(_CTX, "span", None) is not None
+
+
+def traced(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """把函式包成子 span (名稱 = 函式名)，用在會呼叫多次 DB 的 helper 上。"""
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kw: Any) -> Any:
+        with child(fn.__name__):
+            return fn(*args, **kw)
+    return wrapper
+
+
+def _writer(path: str) -> None:
+    with open(path, "a", encoding="utf-8") as f:
+        while True:
+            batch: List[dict] = [_QUEUE.get()]
+            while True:
+                try: batch.append(_QUEUE.get_nowait())
+                except queue.Empty: break
+            f.write("".join(json.dumps(s, separators=(",", ":")) + "\n" for s in batch))
+            f.flush()
+
+
+def configure(path: str, proc: str) -> None:
+    """開啟追蹤，span 附加寫到 path。"""
+    global ENABLED, PROC
+    PROC = proc
+    threading.Thread(target=_writer, args=(path,), name="trace-writer", daemon=True).start()
+    ENABLED = True